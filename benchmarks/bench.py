@@ -0,0 +1,335 @@
+# Python 3.10
+
+# Load tests and microbenchmarks for CraftBot, run from the repository root with `python benchmarks/bench.py`
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Stand-ins for Discord's REST API and gateway
+from fake_discord import FakeDiscordREST, FakeDiscordGateway
+from fake_rcon import FakeRCONServer
+# The bot reads its guild ID from the environment when it is created
+os.environ.setdefault('CRAFTBOT_GUILD_ID', str(FakeDiscordGateway.guild_id))
+# Main CraftBot class
+import craftbot
+# Built-in Python libraries
+import argparse, asyncio, json, random, re, resource, shutil, tempfile, time, timeit, tracemalloc
+
+
+# Channels of the fake guild
+chat_channel_id = 11
+stats_channel_id = 12
+help_channel_id = 13
+suggestions_channel_id = 14
+
+# Marks a message so its arrival on the other side can be timed
+token_pattern = re.compile(r'token:(\d+)')
+
+
+# Receives the datagrams the bot sends to the game server
+class SyntheticGameServer(asyncio.DatagramProtocol):
+
+    def __init__(self):
+        self.transport = None
+        self.listeners = []
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        for token in token_pattern.findall(data.decode('utf-8', errors='replace')):
+            for listener in self.listeners:
+                listener(int(token))
+
+
+# Times messages from when they are sent until their token is seen
+class LatencyTracker:
+
+    def __init__(self):
+        self.sent = {}
+        self.latencies = []
+
+    def send(self, token: int):
+        self.sent[token] = time.perf_counter()
+
+    def receive(self, token: int):
+        sent = self.sent.pop(token, None)
+        if sent is not None:
+            self.latencies.append(time.perf_counter() - sent)
+
+    # Wait until every sent message arrived, returns False on timeout
+    async def wait(self, timeout: float) -> bool:
+        deadline = time.perf_counter() + timeout
+        while self.sent and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        return not self.sent
+
+    def summary(self) -> dict:
+        return {'count': len(self.latencies), 'lost': len(self.sent), 'p50': percentile(self.latencies, 0.5), 'p99': percentile(self.latencies, 0.99), 'max': max(self.latencies, default=None)}
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+# Write a benchmark config to the working directory, based on the repository's config
+def write_config(args, game_port: int):
+    with open(os.path.join(args.repo_root, 'config.json'), 'r', encoding='utf-8') as config_file:
+        config = json.load(config_file)
+    config.pop('servers', None)
+    config['udp'].update({'listen_address': '127.0.0.1', 'listen_port': 0, 'sendto_address': '127.0.0.1', 'sendto_port': game_port, 'reliable': False})
+    config['modules']['chat'].update({'channel_id': chat_channel_id, 'webhook_url': None, 'flush_interval': args.flush_interval, 'presence_notices': False})
+    config['modules']['stats'].update({'channel_id': stats_channel_id, 'message_id': None, 'update_interval': args.update_interval})
+    config['modules']['help']['channel_id'] = help_channel_id
+    config['modules']['suggestions']['channel_id'] = suggestions_channel_id
+    config['logging'] = {'level': 'WARNING'}
+    config['metrics'] = {'listen_port': None}
+    with open('config.json', 'w', encoding='utf-8') as config_file:
+        json.dump(config, config_file)
+
+
+# Create a bot wired to the fake Discord and start its UDP bridge, without logging in
+async def start_bot(args, game_port: int) -> craftbot.CraftBot:
+    write_config(args, game_port)
+    bot = craftbot.CraftBot()
+    FakeDiscordGateway(bot).create_guild([chat_channel_id, stats_channel_id, help_channel_id, suggestions_channel_id])
+    for server in bot.servers.values():
+        await server.load()
+    await bot.udp_outbox.load()
+    bot.udp_task = asyncio.create_task(bot.run_udp('127.0.0.1', 0))
+    while bot.udp_transport is None:
+        await asyncio.sleep(0.01)
+    return bot
+
+
+# Blast chat, playerlist and playtimes datagrams at the bot and time chat lines until they reach Discord
+async def run_udp_load(bot: craftbot.CraftBot, rest: FakeDiscordREST, args) -> dict:
+    tracker = LatencyTracker()
+    def on_request(route, body: dict):
+        for token in token_pattern.findall(body.get('content') or ''):
+            tracker.receive(int(token))
+    rest.listeners.append(on_request)
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(asyncio.DatagramProtocol, remote_addr=bot.udp_transport.get_extra_info('sockname'))
+    players = ['Player{0}'.format(i) for i in range(args.players)]
+    handled = bot.metrics.get_histogram('craftbot_udp_handler_seconds').count
+    start = time.perf_counter()
+    for i in range(args.packets):
+        # One in ten packets is a player list and one in ten is playtimes, the rest is chat
+        if i % 10 == 0:
+            message = 'default\0playerlist\0' + ','.join(random.sample(players, len(players) // 2))
+        elif i % 10 == 1:
+            message = 'default\0playtimes\0' + ','.join('{0} {1}'.format(player, (i + j) * 1000) for j, player in enumerate(players))
+        else:
+            tracker.send(i)
+            message = 'default\0chat\0{0} hello token:{1}'.format(players[i % len(players)], i)
+        transport.sendto(message.encode())
+        # Keep to the target packet rate
+        delay = start + (i + 1) / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif i % 100 == 0:
+            await asyncio.sleep(0)
+    send_elapsed = time.perf_counter() - start
+    # Wait for the ingest queue to drain, then for chat to reach Discord
+    while len(bot.udp_queue) > 0:
+        await asyncio.sleep(0.001)
+    drain_elapsed = time.perf_counter() - start
+    await tracker.wait(args.timeout)
+    transport.close()
+    rest.listeners.remove(on_request)
+    handled = bot.metrics.get_histogram('craftbot_udp_handler_seconds').count - handled
+    handler = bot.metrics.get_histogram('craftbot_udp_handler_seconds')
+    return {
+        'packets_sent': args.packets,
+        'packets_received': int(bot.metrics.get('craftbot_udp_packets_received_total')),
+        'packets_handled': handled,
+        'dropped': bot.udp_queue.dropped,
+        'coalesced': bot.udp_queue.coalesced,
+        'send_seconds': send_elapsed,
+        'throughput': handled / drain_elapsed,
+        'handler_mean': handler.mean,
+        'chat_end_to_end': tracker.summary(),
+    }
+
+
+# Post member messages through the fake gateway and time chat until it reaches the game server
+async def run_message_load(bot: craftbot.CraftBot, gateway: FakeDiscordGateway, game_server: SyntheticGameServer, args) -> dict:
+    tracker = LatencyTracker()
+    game_server.listeners.append(tracker.receive)
+    start = time.perf_counter()
+    for i in range(args.messages):
+        # Some messages start help and suggestion threads, which are rate limited
+        if i % 20 == 0:
+            channel_id = help_channel_id
+        elif i % 20 == 1:
+            channel_id = suggestions_channel_id
+        else:
+            channel_id = chat_channel_id
+            tracker.send(i)
+        gateway.send_message(channel_id, 10 + i % 50, 'hello token:{0}'.format(i))
+        delay = start + (i + 1) / args.message_rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            await asyncio.sleep(0)
+    await tracker.wait(args.timeout)
+    elapsed = time.perf_counter() - start
+    game_server.listeners.remove(tracker.receive)
+    handlers = {name: {'count': timing[0], 'mean': timing[1] / timing[0], 'max': timing[2]} for name, timing in bot.message_router.timings.items()}
+    return {'messages_sent': args.messages, 'seconds': elapsed, 'throughput': args.messages / elapsed, 'chat_end_to_end': tracker.summary(), 'handlers': handlers}
+
+
+# Whitelist accounts over RCON one command at a time, then remove them in one pipelined round
+async def run_rcon_load(args) -> dict:
+    rcon_server = FakeRCONServer('bench', args.rcon_latency)
+    await rcon_server.start()
+    pool = craftbot.RCONPool('127.0.0.1', rcon_server.port, 'bench', args.rcon_pool_size, args.timeout)
+    names = ['Player{0}'.format(i) for i in range(args.rcon_commands)]
+    try:
+        start = time.perf_counter()
+        for name in names:
+            await pool.command('whitelist add ' + name)
+        sequential = time.perf_counter() - start
+        whitelisted = len(rcon_server.whitelist)
+        start = time.perf_counter()
+        replies = await pool.pipeline(['whitelist remove ' + name for name in names])
+        pipelined = time.perf_counter() - start
+    finally:
+        pool.close()
+        await rcon_server.close()
+    errors = sum(isinstance(reply, Exception) for reply in replies)
+    return {'commands': args.rcon_commands, 'sequential_seconds': sequential, 'pipelined_seconds': pipelined,
+        'whitelisted': whitelisted, 'remaining': len(rcon_server.whitelist), 'errors': errors, 'connections': rcon_server.connections}
+
+
+# Time the hot paths that run for every message or stats update
+def run_microbenchmarks(bot: craftbot.CraftBot, args) -> dict:
+    server = bot.get_server()
+    players = ['Player{0}'.format(i) for i in range(args.players)]
+    playerlist = ','.join(players)
+    playtimes = ','.join('{0} {1}'.format(player, i * 1000) for i, player in enumerate(players))
+    server.embed_data['playerlist'] = server.parse_playerlist(playerlist)
+    server.embed_data['playtimes'] = server.parse_playtimes(playtimes)
+    cases = {
+        'search_get_dict': lambda: craftbot.search_get_dict(bot.config, 'modules.suggestions.formats.reaction_upvote'),
+        'get_config_value': lambda: bot.get_config_value('modules.suggestions.formats.reaction_upvote'),
+        'parse_playerlist': lambda: server.parse_playerlist(playerlist),
+        'parse_playtimes': lambda: server.parse_playtimes(playtimes),
+        'generate_playerstats_embed': server.generate_playerstats_embed,
+    }
+    results = {}
+    for name, function in cases.items():
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        results[name] = min(timer.repeat(5, number)) / number
+    return results
+
+
+async def run(args) -> dict:
+    loop = asyncio.get_running_loop()
+    game_transport, game_server = await loop.create_datagram_endpoint(SyntheticGameServer, local_addr=('127.0.0.1', 0))
+    rest = FakeDiscordREST(args.rest_latency, args.rate_limit, args.rate_window)
+    rest.install()
+    try:
+        bot = await start_bot(args, game_transport.get_extra_info('sockname')[1])
+        results = {}
+        try:
+            if args.trace_memory:
+                tracemalloc.start()
+            results['udp'] = await run_udp_load(bot, rest, args)
+            results['messages'] = await run_message_load(bot, FakeDiscordGateway(bot), game_server, args)
+            results['rcon'] = await run_rcon_load(args)
+            results['micro'] = run_microbenchmarks(bot, args)
+            results['memory'] = {'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+            if args.trace_memory:
+                results['memory']['traced_current'], results['memory']['traced_peak'] = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            results['rest'] = {'requests': sum(rest.requests.values()), 'rate_limit_waits': len(rest.rate_limit_waits), 'rate_limit_seconds': sum(rest.rate_limit_waits)}
+        finally:
+            await bot.close()
+    finally:
+        rest.uninstall()
+        game_transport.close()
+    return results
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds is None:
+        return 'n/a'
+    if seconds < 0.001:
+        return '{0:.2f}us'.format(seconds * 1000000)
+    return '{0:.2f}ms'.format(seconds * 1000) if seconds < 1 else '{0:.2f}s'.format(seconds)
+
+def print_report(results: dict):
+    udp = results['udp']
+    print('UDP load')
+    print('  {0} sent, {1} received, {2} handled, {3} dropped, {4} coalesced'.format(udp['packets_sent'], udp['packets_received'], udp['packets_handled'], udp['dropped'], udp['coalesced']))
+    print('  {0:.0f} packets/s, {1} mean handler time'.format(udp['throughput'], format_seconds(udp['handler_mean'])))
+    latency = udp['chat_end_to_end']
+    print('  Chat to Discord: p50 {0}, p99 {1}, max {2}, {3} lost'.format(format_seconds(latency['p50']), format_seconds(latency['p99']), format_seconds(latency['max']), latency['lost']))
+    messages = results['messages']
+    print('Discord messages')
+    print('  {0} sent, {1:.0f} messages/s'.format(messages['messages_sent'], messages['throughput']))
+    latency = messages['chat_end_to_end']
+    print('  Chat to game server: p50 {0}, p99 {1}, max {2}, {3} lost'.format(format_seconds(latency['p50']), format_seconds(latency['p99']), format_seconds(latency['max']), latency['lost']))
+    for name, timing in messages['handlers'].items():
+        print('  {0}: {1} calls, {2} mean, {3} max'.format(name, timing['count'], format_seconds(timing['mean']), format_seconds(timing['max'])))
+    rest = results['rest']
+    print('Discord REST')
+    print('  {0} requests, {1} rate limit waits totalling {2}'.format(rest['requests'], rest['rate_limit_waits'], format_seconds(rest['rate_limit_seconds'])))
+    rcon = results['rcon']
+    print('RCON whitelist')
+    print('  {0} commands: {1} sequential, {2} pipelined over {3} connections, {4} errors'.format(rcon['commands'],
+        format_seconds(rcon['sequential_seconds']), format_seconds(rcon['pipelined_seconds']), rcon['connections'], rcon['errors']))
+    print('Microbenchmarks')
+    for name, seconds in results['micro'].items():
+        print('  {0:<28} {1}'.format(name, format_seconds(seconds)))
+    memory = results['memory']
+    print('Memory')
+    print('  Max RSS {0:.1f} MiB'.format(memory['max_rss_kb'] / 1024))
+    if 'traced_peak' in memory:
+        print('  Traced peak {0:.1f} MiB'.format(memory['traced_peak'] / 1024 / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test CraftBot against a local stand-in for Discord.')
+    parser.add_argument('--packets', type=int, default=20000, help='UDP packets to send')
+    parser.add_argument('--rate', type=float, default=5000, help='UDP packets sent per second')
+    parser.add_argument('--players', type=int, default=100, help='players in each player list and playtimes packet')
+    parser.add_argument('--messages', type=int, default=2000, help='Discord messages to post')
+    parser.add_argument('--message-rate', type=float, default=500, help='Discord messages posted per second')
+    parser.add_argument('--rest-latency', type=float, default=0.05, help='seconds each fake REST request takes')
+    parser.add_argument('--rate-limit', type=int, default=5, help='fake REST requests allowed per bucket and window')
+    parser.add_argument('--rate-window', type=float, default=5.0, help='seconds in each fake rate limit window')
+    parser.add_argument('--flush-interval', type=float, default=1.0, help='modules.chat.flush_interval for the run')
+    parser.add_argument('--update-interval', type=float, default=5.0, help='modules.stats.update_interval for the run')
+    parser.add_argument('--rcon-commands', type=int, default=500, help='whitelist commands to send over RCON')
+    parser.add_argument('--rcon-latency', type=float, default=0.002, help='seconds the fake RCON server takes to reply')
+    parser.add_argument('--rcon-pool-size', type=int, default=2, help='RCON connections to open')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds to wait for messages to arrive')
+    parser.add_argument('--trace-memory', action='store_true', help='also trace Python allocations, which slows the run')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for player lists')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+    args.repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    random.seed(args.seed)
+    # The bot reads and writes its config and database in the working directory
+    work_dir = tempfile.mkdtemp(prefix='craftbot-bench-')
+    json_path = os.path.abspath(args.json) if args.json else None
+    os.chdir(work_dir)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        os.chdir(args.repo_root)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print_report(results)
+    if json_path is not None:
+        with open(json_path, 'w', encoding='utf-8') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
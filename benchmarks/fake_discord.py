@@ -0,0 +1,115 @@
+# Python 3.10
+
+# PyCord API
+import discord
+import discord.http
+# Built-in Python libraries
+import asyncio, collections, itertools, logging, re
+
+
+# Stands in for Discord's REST API by replacing PyCord's HTTP request method, with configurable latency and rate limits
+class FakeDiscordREST:
+
+    def __init__(self, latency: float = 0.05, rate_limit: int = 5, rate_window: float = 5.0):
+        self.latency = latency
+        # Requests allowed per bucket in each window, like Discord's per-channel limits
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.buckets = {}
+        self.ids = itertools.count(1000000000000000000)
+        self.requests = collections.Counter()
+        self.rate_limit_waits = []
+        # Called with the route and the JSON body of every request
+        self.listeners = []
+        self.original_request = None
+
+    def install(self):
+        fake = self
+        self.original_request = discord.http.HTTPClient.request
+        async def request(http, route, **kwargs):
+            return await fake.request(route, **kwargs)
+        discord.http.HTTPClient.request = request
+
+    def uninstall(self):
+        if self.original_request is not None:
+            discord.http.HTTPClient.request = self.original_request
+            self.original_request = None
+
+    async def request(self, route: discord.http.Route, **kwargs):
+        loop = asyncio.get_running_loop()
+        # Wait out the bucket's window when it is used up, logging the wait the way PyCord does
+        while True:
+            now = loop.time()
+            window_start, count = self.buckets.get(route.bucket, (now, 0))
+            if now - window_start >= self.rate_window:
+                window_start, count = now, 0
+            if count < self.rate_limit:
+                self.buckets[route.bucket] = (window_start, count + 1)
+                break
+            retry_after = window_start + self.rate_window - now
+            self.rate_limit_waits.append(retry_after)
+            logging.getLogger('discord.http').warning('We are being rate limited. Retrying in %.2f seconds. Handled under the bucket "%s"', retry_after, route.bucket)
+            await asyncio.sleep(retry_after)
+        await asyncio.sleep(self.latency)
+        self.requests[(route.method, route.path)] += 1
+        body = kwargs.get('json') or {}
+        for listener in self.listeners:
+            listener(route, body)
+        return self.respond(route, body)
+
+    # Build the response payload PyCord expects for a route
+    def respond(self, route: discord.http.Route, body: dict):
+        if route.path == '/channels/{channel_id}/messages' and route.method == 'POST':
+            return self.message_payload(route.channel_id, next(self.ids), body.get('content') or '', body.get('embeds') or [])
+        if route.path == '/channels/{channel_id}/messages/{message_id}' and route.method in ['GET', 'PATCH']:
+            return self.message_payload(route.channel_id, int(route.url.rsplit('/', 1)[1]), body.get('content') or '', body.get('embeds') or [])
+        if route.path == '/channels/{channel_id}/messages/{message_id}/threads':
+            return self.thread_payload(route.channel_id, int(re.search(r'/messages/(\d+)/', route.url).group(1)), body.get('name', 'thread'))
+        return None
+
+    def message_payload(self, channel_id: int, message_id: int, content: str, embeds: list) -> dict:
+        return {
+            'id': str(message_id), 'channel_id': str(channel_id), 'author': user_payload(1, 'CraftBot', True),
+            'content': content, 'embeds': embeds, 'attachments': [], 'mentions': [], 'mention_roles': [],
+            'mention_everyone': False, 'pinned': False, 'tts': False, 'type': 0, 'timestamp': '2022-01-01T00:00:00+00:00', 'edited_timestamp': None,
+        }
+
+    def thread_payload(self, channel_id: int, message_id: int, name: str) -> dict:
+        return {
+            'id': str(message_id), 'parent_id': str(channel_id), 'guild_id': str(FakeDiscordGateway.guild_id), 'owner_id': '1', 'name': name, 'type': 11,
+            'last_message_id': None, 'message_count': 0, 'member_count': 1, 'rate_limit_per_user': 0,
+            'thread_metadata': {'archived': False, 'auto_archive_duration': 1440, 'archive_timestamp': '2022-01-01T00:00:00+00:00', 'locked': False},
+        }
+
+
+# Stands in for Discord's gateway by feeding guild and message events into the bot's connection state
+class FakeDiscordGateway:
+    guild_id = 100
+
+    def __init__(self, bot: discord.Bot):
+        self.bot = bot
+        self.message_ids = itertools.count(2000000000000000000)
+
+    # Create the bot's guild with a text channel for each ID
+    def create_guild(self, channel_ids: list[int]) -> discord.Guild:
+        data = {
+            'id': str(self.guild_id), 'name': 'Benchmark', 'roles': [], 'emojis': [], 'stickers': [], 'member_count': 1, 'members': [],
+            'channels': [{'id': str(channel_id), 'name': 'channel-{0}'.format(i), 'type': 0, 'position': i, 'permission_overwrites': []} for i, channel_id in enumerate(channel_ids)],
+        }
+        guild = discord.Guild(data=data, state=self.bot._connection)
+        self.bot._connection._add_guild(guild)
+        self.bot.guild = guild
+        return guild
+
+    # Deliver a MESSAGE_CREATE event as if a member had posted in a channel
+    def send_message(self, channel_id: int, author_id: int, content: str):
+        self.bot._connection.parse_message_create({
+            'id': str(next(self.message_ids)), 'channel_id': str(channel_id), 'guild_id': str(self.guild_id),
+            'author': user_payload(author_id, 'member{0}'.format(author_id), False),
+            'content': content, 'embeds': [], 'attachments': [], 'mentions': [], 'mention_roles': [],
+            'mention_everyone': False, 'pinned': False, 'tts': False, 'type': 0, 'timestamp': '2022-01-01T00:00:00+00:00', 'edited_timestamp': None,
+        })
+
+
+def user_payload(user_id: int, username: str, bot: bool) -> dict:
+    return {'id': str(user_id), 'username': username, 'discriminator': '0001', 'avatar': None, 'bot': bot}
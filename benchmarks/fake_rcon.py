@@ -0,0 +1,130 @@
+# Python 3.10
+
+# Built-in Python libraries
+import argparse, asyncio, struct
+
+
+# Stands in for a Minecraft server's RCON listener, with a whitelist, Floodgate's Bedrock whitelist and configurable latency
+class FakeRCONServer:
+    type_response = 0
+    type_command = 2
+    type_login = 3
+    # Vanilla splits replies into packets of at most this many bytes
+    max_payload = 4096
+
+    def __init__(self, password: str, latency: float = 0.0, bedrock_prefix: str = '.'):
+        self.password = password
+        # Seconds between a packet arriving and its reply being sent, replies keep their order
+        self.latency = latency
+        self.bedrock_prefix = bedrock_prefix
+        # Whitelisted names by lowercase name
+        self.whitelist = {}
+        self.commands = []
+        self.connections = 0
+        self.writers = set()
+        self.server = None
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def start(self, address: str = '127.0.0.1', port: int = 0):
+        self.server = await asyncio.start_server(self.on_connection, address, port)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.drop_connections()
+            await self.server.wait_closed()
+            self.server = None
+
+    # Cut every open connection, as if the game server crashed
+    def drop_connections(self):
+        for writer in list(self.writers):
+            writer.transport.abort()
+
+    async def on_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self.writers.add(writer)
+        replies = asyncio.Queue()
+        sender = asyncio.create_task(self.run_sender(replies, writer))
+        loop = asyncio.get_running_loop()
+        authenticated = False
+        try:
+            while True:
+                length, = struct.unpack('<i', await reader.readexactly(4))
+                data = await reader.readexactly(length)
+                request_id, packet_type = struct.unpack('<ii', data[:8])
+                payload = data[8:-2].decode('utf-8')
+                due = loop.time() + self.latency
+                if packet_type == self.type_login:
+                    authenticated = payload == self.password
+                    replies.put_nowait((due, self.encode(request_id if authenticated else -1, self.type_command, '')))
+                elif packet_type == self.type_command and authenticated:
+                    self.commands.append(payload)
+                    reply = self.run_command(payload)
+                    # Long replies are split over several packets with the same ID, like vanilla
+                    for start in range(0, max(len(reply), 1), self.max_payload):
+                        replies.put_nowait((due, self.encode(request_id, self.type_response, reply[start:start + self.max_payload])))
+                elif authenticated:
+                    replies.put_nowait((due, self.encode(request_id, self.type_response, 'Unknown request {0:x}'.format(packet_type))))
+                else:
+                    replies.put_nowait((due, self.encode(-1, self.type_response, '')))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            sender.cancel()
+            writer.close()
+
+    async def run_sender(self, replies: asyncio.Queue, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        while True:
+            due, data = await replies.get()
+            await asyncio.sleep(max(due - loop.time(), 0))
+            writer.write(data)
+
+    def encode(self, request_id: int, packet_type: int, payload: str) -> bytes:
+        data = struct.pack('<ii', request_id, packet_type) + payload.encode('utf-8') + b'\0\0'
+        return struct.pack('<i', len(data)) + data
+
+    # Answer the whitelist commands the bot uses the way vanilla and Floodgate do
+    def run_command(self, command: str) -> str:
+        words = command.split()
+        if len(words) == 3 and words[0] in ['whitelist', 'fwhitelist'] and words[1] in ['add', 'remove']:
+            name = words[2] if words[0] == 'whitelist' else self.bedrock_prefix + words[2]
+            if words[1] == 'add':
+                if name.lower() in self.whitelist:
+                    return 'Player is already whitelisted'
+                self.whitelist[name.lower()] = name
+                return 'Added {0} to the whitelist'.format(name)
+            if self.whitelist.pop(name.lower(), None) is None:
+                return 'Player is not whitelisted'
+            return 'Removed {0} from the whitelist'.format(name)
+        if words == ['whitelist', 'list']:
+            if not self.whitelist:
+                return 'There are no whitelisted players'
+            return 'There are {0} whitelisted player(s): {1}'.format(len(self.whitelist), ', '.join(self.whitelist.values()))
+        return 'Unknown or incomplete command, see below for error'
+
+
+async def serve(args):
+    server = FakeRCONServer(args.password, args.latency)
+    await server.start(args.address, args.port)
+    print('Fake RCON server listening on {0}:{1}'.format(args.address, server.port))
+    await server.server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a fake Minecraft RCON server for testing the RCON transport.')
+    parser.add_argument('--address', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=25575, help='port to listen on')
+    parser.add_argument('--password', required=True, help='RCON password clients must log in with')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each reply is sent')
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# Python 3.10
+
+# Main CraftBot class
+import craftbot
+# Discord API
+import discord
+from discord.ext import commands
+from discord import slash_command, Option
+
+
+class ChatLogCog(commands.Cog):
+    page_size = 15
+
+    def __init__(self, bot: craftbot.CraftBot):
+        self.bot = bot
+
+    @slash_command(description='Search the archive of bridged chat.')
+    @commands.check(craftbot.CraftBot.is_admin)
+    async def chatlog(self, ctx: discord.ApplicationContext,
+            query: Option(str, 'Words the messages must contain, end a word with * to match words starting with it.', required=False, default=None),
+            player: Option(str, 'Only show messages from this player or Discord username.', required=False, default=None),
+            server: Option(str, 'Only show messages bridged with this game server.', required=False, default=None)):
+        if server is not None and self.bot.get_server(server) is None:
+            await ctx.interaction.response.send_message(content='There is no game server with the ID "{0}"!'.format(server))
+            return
+        title = '**Chat Log**' if query is None else '**Chat Log: {0}**'.format(discord.utils.escape_markdown(query))
+        # Newest first, each page starting before the oldest message ID of the last
+        pages = craftbot.KeysetPages(title, lambda before, limit: self.bot.chat_archive.search(query, player, server, before, limit), self._format_messages, ctx.author.id,
+            cursor_column='id', first_cursor=None, page_size=self.page_size)
+        embed = await pages.render()
+        if embed is not None:
+            await ctx.interaction.response.send_message(embed=embed, view=pages)
+        else:
+            await ctx.interaction.response.send_message(content='No archived chat messages found.')
+
+    # Format a page of archived messages, one line each
+    async def _format_messages(self, rows: list) -> list[str]:
+        lines = []
+        for row in rows:
+            content = row['content'] if len(row['content']) <= 200 else row['content'][:199] + '…'
+            if row['author_id'] is not None:
+                author = '<@{0}>'.format(row['author_id'])
+            else:
+                author = discord.utils.escape_markdown(row['author']) or 'Server'
+            lines.append('<t:{0}:f> [{1}] **{2}**: {3}'.format(row['time'], row['server'], author, discord.utils.escape_markdown(content)))
+        return lines
+
+
+def setup(bot):
+    bot.add_cog(ChatLogCog(bot))
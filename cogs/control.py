@@ -7,22 +7,27 @@ import discord
 from discord.ext import commands
 from discord import slash_command, Option
 # Built-in Python libraries
-import os
+import datetime, math, time
 
 
 class ControlCog(commands.Cog):
-    env_guild_ids = [int(os.environ['CRAFTBOT_GUILD_ID'])]
 
     def __init__(self, bot: craftbot.CraftBot):
         self.bot = bot
 
-    @slash_command(description='Reload this bot\'s cogs.', guild_ids=env_guild_ids)
+    @slash_command(description='Reload this bot\'s cogs whose source changed.')
     @commands.check(craftbot.CraftBot.is_admin)
-    async def reload_cogs(self, ctx: discord.ApplicationContext):
-        if self.bot.reload_cogs():
-            await ctx.interaction.response.send_message(content='Reloaded all cogs!')
+    async def reload_cogs(self, ctx: discord.ApplicationContext,
+            force: Option(bool, 'Reload every cog, even those that did not change.', required=False, default=False)):
+        start = time.perf_counter()
+        changed, failed = self.bot.reload_cogs(force)
+        elapsed = self.format_seconds(time.perf_counter() - start)
+        if len(failed) > 0:
+            await ctx.interaction.response.send_message(content='Failed to reload {0}, the previous version is still running. Check the log for details.'.format(', '.join(failed)))
+        elif len(changed) > 0:
+            await ctx.interaction.response.send_message(content='Reloaded {0} in {1}!'.format(', '.join(changed), elapsed))
         else:
-            await ctx.interaction.response.send_message(content='An error occured while reloading cogs, check the log for details.')
+            await ctx.interaction.response.send_message(content='No cogs changed since they were loaded.')
 
     @reload_cogs.error
     async def reload_cogs_error(self, ctx: discord.ApplicationContext, error):
@@ -31,6 +36,38 @@ class ControlCog(commands.Cog):
         else:
             await ctx.interaction.response.send_message(content='An unspecified error has occured. Please check the log for details.')
 
+    @slash_command(description='Show this bot\'s performance stats.')
+    @commands.check(craftbot.CraftBot.is_admin)
+    async def botstats(self, ctx: discord.ApplicationContext):
+        metrics = self.bot.metrics
+        embed = discord.Embed(title='**Bot Stats**', colour=discord.Colour.from_rgb(255, 170, 0))
+        embed.add_field(name='**Uptime**', value=str(datetime.timedelta(seconds=int(time.time() - self.bot.start_time))))
+        embed.add_field(name='**Gateway Latency**', value=self.format_seconds(self.bot.latency) if math.isfinite(self.bot.latency) else 'Not connected')
+        embed.add_field(name='**Startup**', value=', '.join('{0} {1}'.format(phase, self.format_seconds(seconds)) for phase, seconds in self.bot.startup_times.items()) or 'Not finished', inline=False)
+        # UDP bridge
+        udp_queue = self.bot.udp_queue
+        embed.add_field(name='**UDP Packets**', value='{0:g} in, {1:g} out, {2:g} failed'.format(metrics.get('craftbot_udp_packets_received_total'), metrics.get('craftbot_udp_packets_sent_total'), metrics.get('craftbot_udp_send_errors_total')), inline=False)
+        if udp_queue is not None:
+            embed.add_field(name='**UDP Queue**', value='{0} queued, {1} dropped, {2} coalesced'.format(len(udp_queue), udp_queue.dropped, udp_queue.coalesced))
+        outbox = self.bot.udp_outbox
+        embed.add_field(name='**UDP Outbox**', value='{0} pending, {1} delivered, {2} retransmits'.format(outbox.queue_depth, outbox.delivered, outbox.retransmits))
+        # Handler and request timings
+        for field_name, metric_name in [('UDP Handler', 'craftbot_udp_handler_seconds'), ('Message Handlers', 'craftbot_message_handler_seconds'),
+                ('Discord Requests', 'craftbot_discord_request_seconds'), ('Rate Limit Waits', 'craftbot_discord_rate_limit_seconds'), ('Outbox Delivery', 'craftbot_udp_outbox_delivery_seconds')]:
+            histogram = metrics.get_histogram(metric_name)
+            if histogram.count > 0:
+                embed.add_field(name='**{0}**'.format(field_name), value='{0} calls, {1} avg, {2} p95'.format(histogram.count, self.format_seconds(histogram.mean), self.format_seconds(histogram.quantile(0.95))), inline=False)
+        cache = self.bot.identity_cache
+        lookups = cache.hits + cache.misses
+        embed.add_field(name='**Identity Cache**', value='{0} cached, {1:.0%} hit rate'.format(len(cache), cache.hits / lookups if lookups > 0 else 0))
+        await ctx.interaction.response.send_message(embed=embed)
+
+    def format_seconds(self, seconds: float) -> str:
+        if not math.isfinite(seconds):
+            # Beyond the largest histogram bucket
+            return 'over {0:g}s'.format(craftbot.Histogram.default_buckets[-1])
+        return '{0:.0f}ms'.format(seconds * 1000) if seconds < 1 else '{0:.2f}s'.format(seconds)
+
 
 def setup(bot):
     bot.add_cog(ControlCog(bot))
\ No newline at end of file
@@ -5,41 +5,66 @@ import craftbot
 # Discord API
 import discord
 from discord.ext import commands
-from discord import slash_command, Option, OptionChoice
+from discord import slash_command, Option
 # Built-in Python libraries
-import os, re, typing
+import asyncio, csv, io, json, re, sqlite3, time, types
 
 
 class RegistrationCog(commands.Cog):
-    env_guild_ids = [int(os.environ['CRAFTBOT_GUILD_ID'])]
+    # Maximum number of users fetched from Discord at once
+    owner_fetch_limit = 5
+    # Maximum number of whitelist requests processed at once
+    whitelist_workers = 4
 
     def __init__(self, bot: craftbot.CraftBot):
         self.bot = bot
+        # Whitelist requests waiting for a worker, as (function, arguments)
+        self.whitelist_jobs = asyncio.Queue()
+        self.whitelist_tasks = []
+        self.whitelist_resumed = False
+        self.bot.message_router.register('modules.whitelist.channel_id', self.on_whitelist_message)
 
-    @slash_command(description='Add a user to the server whitelist.', guild_ids=env_guild_ids)
+    def cog_unload(self):
+        self.bot.message_router.unregister('modules.whitelist.channel_id')
+        # Let the workers finish the requests already queued, so reloading the cog doesn't drop them
+        for _ in self.whitelist_tasks:
+            self.whitelist_jobs.put_nowait(None)
+
+    group_whitelist = discord.SlashCommandGroup(name='whitelist', description='Commands for managing the server whitelist in bulk.')
+
+    @slash_command(description='Add a user to the server whitelist.')
     @commands.check(craftbot.CraftBot.is_admin)
     async def register(self, ctx: discord.ApplicationContext,
             username: Option(str, 'The Minecraft username to register.', required=True),
             account_type: Option(str, 'The type of account to register. (Java or Bedrock)', required=True),
-            account_owner: Option(discord.User, 'The server member owning the specified username.', required=False)):
+            account_owner: Option(discord.User, 'The server member owning the specified username.', required=False),
+            server: Option(str, 'The game server to whitelist on, or all servers if empty.', required=False, default=None)):
         account_type = account_type.lower()
         # Ensure valid account type parameter
         if account_type in ['java', 'bedrock']:
             # Check username format
             if re.match(r'\w{3,16}$', username) is not None:
-                # Account owner parameter is optional
-                if account_owner is None:
-                    self._register(username, account_type, None)
-                    await ctx.interaction.response.send_message(content='Registered {0} Edition username "{1}".'.format(account_type.capitalize(), username))
+                if server is not None and self.bot.get_server(server) is None:
+                    await ctx.interaction.response.send_message(content='There is no game server with the ID "{0}"!'.format(server))
                 else:
-                    self._register(username, account_type, account_owner.id)
-                    await ctx.interaction.response.send_message(content='Registered {0} Edition username "{1}" as belonging to {2.mention}.'.format(account_type.capitalize(), username, account_owner))
+                    # Whitelisting over RCON can take longer than Discord waits for a response
+                    await ctx.defer()
+                    try:
+                        replies = await self._register(username, account_type, account_owner.id if account_owner is not None else None, server)
+                    except sqlite3.IntegrityError:
+                        await ctx.followup.send(content='{0} Edition username "{1}" is already registered!'.format(account_type.capitalize(), username))
+                        return
+                    # Account owner parameter is optional
+                    if account_owner is None:
+                        await ctx.followup.send(content='Registered {0} Edition username "{1}".'.format(account_type.capitalize(), username) + self._format_replies(replies))
+                    else:
+                        await ctx.followup.send(content='Registered {0} Edition username "{1}" as belonging to {2.mention}.'.format(account_type.capitalize(), username, account_owner) + self._format_replies(replies))
             else:
                 await ctx.interaction.response.send_message(content='"{0}" is not a valid Minecraft username!'.format(username))
         else:
             await ctx.interaction.response.send_message(content='The parameter "account_type" must be either "java" or "bedrock"!')
 
-    @slash_command(description='Remove a user from the server whitelist.', guild_ids=env_guild_ids)
+    @slash_command(description='Remove a user from the server whitelist.')
     @commands.check(craftbot.CraftBot.is_admin)
     async def unregister(self, ctx: discord.ApplicationContext,
             username: Option(str, 'The Minecraft username to unregister.', required=True),
@@ -49,100 +74,354 @@ class RegistrationCog(commands.Cog):
         if account_type in ['java', 'bedrock']:
             # Check username format
             if re.match(r'\w{3,16}$', username) is not None:
-                self._unregister(username, account_type)
-                await ctx.interaction.response.send_message(content='Unregistered {0} Edition username "{1}".'.format(account_type.capitalize(), username))
+                # Whitelisting over RCON can take longer than Discord waits for a response
+                await ctx.defer()
+                replies = await self._unregister(username, account_type)
+                await ctx.followup.send(content='Unregistered {0} Edition username "{1}".'.format(account_type.capitalize(), username) + self._format_replies(replies))
             else:
                 await ctx.interaction.response.send_message(content='"{0}" is not a valid Minecraft username!'.format(username))
         else:
             await ctx.interaction.response.send_message(content='The parameter "account_type" must be either "java" or "bedrock"!')
 
-    @slash_command(description='Lookup an existing registration.', guild_ids=env_guild_ids)
+    @slash_command(description='Lookup an existing registration.')
     @commands.check(craftbot.CraftBot.is_admin)
     async def lookup(self, ctx: discord.ApplicationContext,
             username: Option(str, 'The Minecraft username to lookup.', required=True),
             account_type: Option(str, 'The type of account to lookup. (Java or Bedrock)', required=True)):
         account_type = account_type.lower()
         # Lookup username registrations
-        rows = self._lookup_username(username, account_type).fetchall()
-        if len(rows) > 0:
-            # Build results
-            results_string = '**{0} Edition registrations for {1}**'.format(account_type.capitalize(), username)
-            for row in rows:
-                user = await self.bot.get_or_fetch_user(int(row[3]))
-                if user is not None:
-                    results_string += '\n' + user.display_name + ' (ID: ' + str(user.id) +')'
-                else:
-                    results_string += '\n' + str(row[3])
+        title = '**{0} Edition registrations for {1}**'.format(account_type.capitalize(), username)
+        pages = craftbot.KeysetPages(title, lambda after, limit: self._lookup_username(username, account_type, after, limit), self._format_registrations, ctx.author.id)
+        embed = await pages.render()
+        if embed is not None:
             # Reply to command sender
-            await ctx.interaction.response.send_message(content=results_string)
+            await ctx.interaction.response.send_message(embed=embed, view=pages)
         else:
             # Reply to command sender
             await ctx.interaction.response.send_message(content='No existing {0} Edition registrations found for {1}.'.format(account_type.capitalize(), username))
 
-    @slash_command(description='List all existing registrations.', guild_ids=env_guild_ids)
+    @slash_command(description='List all existing registrations.')
     @commands.check(craftbot.CraftBot.is_admin)
-    async def registrations(self, ctx: discord.ApplicationContext):
-        # Lookup username registrations
-        rows = self._list_registrations().fetchall()
-        if len(rows) > 0:
-            # Build results
-            results_string = '**Account Registrations**'
-            for row in rows:
-                # Format result string
-                results_string += '\n{0} ({1} Edition): '.format(row[0], row[1].capitalize())
-                # Append owner name
-                if row[3] is not None:
-                    user = await self.bot.get_or_fetch_user(int(row[3]))
-                    if user is not None:
-                        results_string += user.display_name + ' (ID: ' + str(user.id) +')'
-                    else:
-                        results_string += str(row[3])
-                else:
-                    results_string += 'No owner'
+    async def registrations(self, ctx: discord.ApplicationContext,
+            account_type: Option(str, 'Only list accounts of this type.', required=False, choices=['java', 'bedrock'], default=None),
+            account_owner: Option(discord.User, 'Only list accounts belonging to this server member.', required=False, default=None)):
+        # Lookup username registrations, one page at a time
+        if account_owner is not None:
+            title = '**Account Registrations for {0.display_name}**'.format(account_owner)
+            fetch_page = lambda after, limit: self._lookup_member(account_owner.id, account_type, after, limit)
+        else:
+            title = '**Account Registrations**'
+            fetch_page = lambda after, limit: self._list_registrations(account_type, after, limit)
+        pages = craftbot.KeysetPages(title, fetch_page, self._format_registrations, ctx.author.id)
+        embed = await pages.render()
+        if embed is not None:
             # Reply to command sender
-            await ctx.interaction.response.send_message(content=results_string)
+            await ctx.interaction.response.send_message(embed=embed, view=pages)
         else:
             # Reply to command sender
             await ctx.interaction.response.send_message(content='No existing registrations found.')
 
-    # Registers a Minecraft username
-    def _register(self, username: str, account_type: str, account_owner: int = None):
+    @group_whitelist.command(name='import', description='Register every account in a CSV file or Minecraft whitelist.json.')
+    @commands.check(craftbot.CraftBot.is_admin)
+    async def whitelist_import(self, ctx: discord.ApplicationContext,
+            file: Option(discord.Attachment, 'A CSV file (username,type,uuid,owner) or whitelist.json to import.', required=True),
+            account_type: Option(str, 'The type of account for entries without one. (Java or Bedrock)', required=False, default='java'),
+            server: Option(str, 'The game server for entries without one, or all servers if empty.', required=False, default=None)):
+        await ctx.defer()
+        try:
+            rows, invalid = self._parse_whitelist_file(file.filename, (await file.read()).decode('utf-8-sig'), account_type.lower(), server)
+        except (ValueError, UnicodeDecodeError) as e:
+            await ctx.followup.send(content='Could not read "{0}": {1}'.format(file.filename, e))
+            return
+        # Insert all new rows in one transaction, then whitelist them in one round per server
+        new_rows = await self.bot.database.run(self._import_rows, rows)
+        entries = {}
+        for row in new_rows:
+            entries.setdefault(row[4], []).append('{1} {0}'.format(*row))
+        results = await asyncio.gather(*[self.bot.update_whitelist('register', server_entries, server_id) for server_id, server_entries in entries.items()])
+        failed = sum(reply.startswith('Error: ') for replies in results for server_replies in replies.values() for reply in server_replies)
+        await ctx.followup.send(content='Registered {0} accounts ({1} already registered, {2} invalid).'.format(len(new_rows), len(rows) - len(new_rows), invalid)
+            + (' {0} whitelist commands failed, run `/whitelist reconcile` to retry them.'.format(failed) if failed > 0 else ''))
+
+    @group_whitelist.command(name='export', description='Export all registrations as a CSV file or Minecraft whitelist.json.')
+    @commands.check(craftbot.CraftBot.is_admin)
+    async def whitelist_export(self, ctx: discord.ApplicationContext,
+            file_format: Option(str, 'The format to export.', required=False, choices=['csv', 'json'], default='csv')):
+        rows = await self.bot.database.fetch_all('SELECT username, type, uuid, owner, server FROM mc_accounts ORDER BY type, username COLLATE NOCASE;')
+        output = io.StringIO()
+        if file_format == 'json':
+            # Minecraft's whitelist.json only covers Java Edition accounts
+            entries = []
+            for row in rows:
+                if row['type'] == 'java':
+                    entries.append({'uuid': row['uuid'], 'name': row['username']} if row['uuid'] is not None else {'name': row['username']})
+            json.dump(entries, output, indent=2)
+            filename = 'whitelist.json'
+        else:
+            writer = csv.writer(output)
+            writer.writerow(['username', 'type', 'uuid', 'owner', 'server'])
+            writer.writerows([tuple(row) for row in rows])
+            filename = 'registrations.csv'
+        await ctx.interaction.response.send_message(content='Exported {0} registrations.'.format(len(rows)), file=discord.File(io.BytesIO(output.getvalue().encode('utf-8')), filename=filename))
+
+    @group_whitelist.command(name='reconcile', description='Sync the server whitelist with the registered accounts.')
+    @commands.check(craftbot.CraftBot.is_admin)
+    async def whitelist_reconcile(self, ctx: discord.ApplicationContext,
+            dry_run: Option(bool, 'Only report the differences without changing the whitelist.', required=False, default=False),
+            server: Option(str, 'The game server to reconcile, or all servers if empty.', required=False, default=None)):
+        if server is not None and self.bot.get_server(server) is None:
+            await ctx.interaction.response.send_message(content='There is no game server with the ID "{0}"!'.format(server))
+            return
+        await ctx.defer()
+        server_ids = [server] if server is not None else list(self.bot.servers.keys())
+        results = await asyncio.gather(*[self._reconcile_server(server_id, dry_run) for server_id in server_ids])
+        # Report results per server
+        lines = []
+        for server_id, result in zip(server_ids, results):
+            if result is None:
+                lines.append('{0}: The game server did not report its whitelist, please try again later.'.format(server_id))
+            else:
+                lines.append('{0}: {1} {2} missing accounts and {3} {4} unregistered accounts.'.format(server_id,
+                    'Found' if dry_run else 'Whitelisted', len(result[0]), 'found' if dry_run else 'removed', len(result[1])))
+        await ctx.followup.send(content='\n'.join(lines))
+
+    # Whitelist channel, members post their username and react with their account type
+    async def on_whitelist_message(self, message: discord.Message):
+        self._queue_whitelist_job(self._handle_whitelist_message, message)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        if payload.channel_id != self.bot.get_config_value('modules.whitelist.channel_id') or payload.user_id == self.bot.user.id:
+            return
+        account_type = self._get_whitelist_type(payload.emoji)
+        if account_type is not None:
+            self._queue_whitelist_job(self._handle_whitelist_reaction, payload, account_type)
+
+    # Finish requests that were being registered when the bot stopped
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if self.whitelist_resumed:
+            return
+        self.whitelist_resumed = True
+        rows = await self.bot.database.fetch_all("SELECT * FROM whitelist_requests WHERE state = 'registering';")
+        for row in rows:
+            self._queue_whitelist_job(self._finish_whitelist_request, row['message_id'], row['channel_id'], row['user_id'], row['username'], row['type'])
+
+    def _queue_whitelist_job(self, function, *args):
+        self.whitelist_jobs.put_nowait((function, args))
+        # Start the workers on first use
+        if not self.whitelist_tasks:
+            self.whitelist_tasks = [asyncio.create_task(self._run_whitelist_worker()) for _ in range(self.whitelist_workers)]
+
+    async def _run_whitelist_worker(self):
+        while True:
+            job = await self.whitelist_jobs.get()
+            if job is None:
+                return
+            function, args = job
+            try:
+                await function(*args)
+            except Exception as e:
+                craftbot.log_exception('Whitelist', 'Error while processing whitelist request!', e)
+            finally:
+                self.whitelist_jobs.task_done()
+
+    # Get the account type a reaction stands for, or None for any other reaction
+    def _get_whitelist_type(self, emoji) -> str:
+        emoji = str(emoji)
+        for account_type in ['java', 'bedrock']:
+            if emoji == self.bot.get_config_value('modules.whitelist.formats.reaction_' + account_type):
+                return account_type
+        return None
+
+    # Check a posted username and ask for the account type, saving the request as awaiting a reaction
+    async def _handle_whitelist_message(self, message: discord.Message):
+        scheduler = self.bot.call_scheduler
+        username = message.content.strip()
+        if re.match(r'\w{3,16}$', username) is None:
+            await scheduler.call('message', message.channel.id, message.channel.send, self.bot.get_config_value('modules.whitelist.formats.error_invalid').format(message))
+            return
+        if await self._check_registration_member(message.author.id):
+            await scheduler.call('message', message.channel.id, message.channel.send, self.bot.get_config_value('modules.whitelist.formats.error_registered').format(message))
+            return
+        now = int(time.time())
+        await self.bot.database.execute("INSERT OR IGNORE INTO whitelist_requests (message_id, channel_id, user_id, username, state, created, updated) VALUES (?, ?, ?, ?, 'awaiting_type', ?, ?);",
+            [message.id, message.channel.id, message.author.id, username, now, now])
+        # Add reactions and greet user
+        await scheduler.call('reaction', message.channel.id, message.add_reaction, self.bot.get_config_value('modules.whitelist.formats.reaction_java'))
+        await scheduler.call('reaction', message.channel.id, message.add_reaction, self.bot.get_config_value('modules.whitelist.formats.reaction_bedrock'))
+        await scheduler.call('message', message.channel.id, message.channel.send, self.bot.get_config_value('modules.whitelist.formats.message_greeting').format(message))
+
+    # Register a request once its author picks an account type, only the first pick counts
+    async def _handle_whitelist_reaction(self, payload: discord.RawReactionActionEvent, account_type: str):
+        row = await self.bot.database.fetch_one('SELECT * FROM whitelist_requests WHERE message_id = ?;', [payload.message_id])
+        if row is None or row['user_id'] != payload.user_id:
+            return
+        claimed = await self.bot.database.execute("UPDATE whitelist_requests SET type = ?, state = 'registering', updated = ? WHERE message_id = ? AND state = 'awaiting_type';",
+            [account_type, int(time.time()), payload.message_id])
+        if claimed == 1:
+            await self._finish_whitelist_request(row['message_id'], row['channel_id'], row['user_id'], row['username'], account_type)
+
+    async def _finish_whitelist_request(self, message_id: int, channel_id: int, user_id: int, username: str, account_type: str):
+        state, inserted = await self.bot.database.run(self._claim_whitelist_request, message_id, user_id, username, account_type)
+        if inserted:
+            await self.bot.update_whitelist('register', ['{0} {1}'.format(account_type, username)])
+        # Reply without fetching the request message, the formats only need its author and content
+        channel = self.bot.get_channel(channel_id)
+        if channel is not None:
+            message = types.SimpleNamespace(author=types.SimpleNamespace(id=user_id, mention='<@{0}>'.format(user_id)), content=username, channel=channel)
+            format_key = 'message_finished' if state == 'registered' else 'error_registered'
+            await self.bot.call_scheduler.call('message', channel_id, channel.send, self.bot.get_config_value('modules.whitelist.formats.' + format_key).format(message))
+
+    # Check and register a requested username in one transaction, so concurrent requests can't both take it, returns the request's state and whether a row was inserted
+    def _claim_whitelist_request(self, connection, message_id: int, user_id: int, username: str, account_type: str) -> tuple[str, bool]:
+        inserted = False
+        with connection:
+            owner = connection.execute('SELECT owner FROM mc_accounts WHERE username = ? COLLATE NOCASE AND type = ? LIMIT 1;', [username, account_type]).fetchone()
+            if owner is not None and owner['owner'] == user_id:
+                # Registered before the bot stopped
+                state = 'registered'
+            elif owner is not None or connection.execute('SELECT 1 FROM mc_accounts WHERE owner = ? LIMIT 1;', [user_id]).fetchone() is not None:
+                state = 'rejected'
+            else:
+                try:
+                    connection.execute('INSERT INTO mc_accounts (username, type, owner) VALUES (?, ?, ?);', [username, account_type, user_id])
+                    state, inserted = 'registered', True
+                except sqlite3.IntegrityError:
+                    state = 'rejected'
+            connection.execute('UPDATE whitelist_requests SET state = ?, updated = ? WHERE message_id = ?;', [state, int(time.time()), message_id])
+        return (state, inserted)
+
+    # Sync one server's whitelist, returns the entries registered and unregistered or None if the server didn't respond
+    async def _reconcile_server(self, server_id: str, dry_run: bool) -> tuple[list[str], list[str]]:
+        # Ask the game server for its current whitelist
+        try:
+            whitelist = await self.bot.get_server(server_id).fetch_whitelist()
+        except (asyncio.TimeoutError, OSError):
+            return None
+        rows = await self.bot.database.fetch_all('SELECT username, type FROM mc_accounts WHERE server IS NULL OR server = ?;', [server_id])
+        to_register, to_unregister = self._diff_whitelist(rows, whitelist)
+        if not dry_run:
+            await asyncio.gather(self.bot.update_whitelist('register', to_register, server_id), self.bot.update_whitelist('unregister', to_unregister, server_id))
+        return (to_register, to_unregister)
+
+    # Parse registration rows from a CSV file or Minecraft whitelist.json, returns valid rows and the number of invalid ones
+    def _parse_whitelist_file(self, filename: str, text: str, account_type: str, server: str = None) -> tuple[list[tuple], int]:
+        rows = []
+        if filename.lower().endswith('.json'):
+            entries = json.loads(text)
+            if not isinstance(entries, list):
+                raise ValueError('expected a list of whitelist entries')
+            for entry in entries:
+                # Entries that aren't objects with a string name are counted as invalid
+                if not isinstance(entry, dict) or not isinstance(entry.get('name'), str):
+                    entry = {'name': ''}
+                uuid = entry.get('uuid')
+                rows.append((entry['name'], account_type, uuid if isinstance(uuid, str) else None, None, server))
+        else:
+            for record in csv.reader(io.StringIO(text)):
+                # Skip blank lines and the header row
+                if len(record) == 0 or record[0].strip().lower() == 'username':
+                    continue
+                username, row_type, uuid, owner, row_server = [field.strip() for field in (record + [''] * 5)[:5]]
+                rows.append((username, row_type.lower() or account_type, uuid or None, int(owner) if owner.isdigit() else None, row_server or server))
+        valid_rows = [row for row in rows if row[1] in ['java', 'bedrock'] and re.match(r'\w{3,16}$', row[0]) is not None and (row[4] is None or row[4] in self.bot.servers)]
+        return (valid_rows, len(rows) - len(valid_rows))
+
+    # Insert rows that aren't registered yet in a single transaction, returns the inserted rows
+    def _import_rows(self, connection, rows: list[tuple]) -> list[tuple]:
+        with connection:
+            existing = {(row[0].lower(), row[1]) for row in connection.execute('SELECT username, type FROM mc_accounts;')}
+            new_rows = []
+            for row in rows:
+                key = (row[0].lower(), row[1])
+                if key in existing:
+                    continue
+                existing.add(key)
+                # Rows whose UUID is already registered under another name are ignored too
+                if connection.execute('INSERT OR IGNORE INTO mc_accounts (username, type, uuid, owner, server) VALUES (?, ?, ?, ?, ?);', row).rowcount == 1:
+                    new_rows.append(row)
+        return new_rows
+
+    # Compare registrations to a whitelist reported by the server, returns the entries to register and unregister
+    def _diff_whitelist(self, rows: list, whitelist: str) -> tuple[list[str], list[str]]:
+        registered = {(row['type'], row['username'].lower()): row['username'] for row in rows}
+        whitelisted = {}
+        for entry in whitelist.split(','):
+            if ' ' in entry:
+                account_type, username = entry.split(' ', 1)
+                whitelisted[(account_type, username.lower())] = username
+        to_register = ['{0} {1}'.format(key[0], registered[key]) for key in sorted(registered.keys() - whitelisted.keys())]
+        to_unregister = ['{0} {1}'.format(key[0], whitelisted[key]) for key in sorted(whitelisted.keys() - registered.keys())]
+        return (to_register, to_unregister)
+
+    # Registers a Minecraft username, returns the replies of servers reached over RCON
+    async def _register(self, username: str, account_type: str, account_owner: int = None, server: str = None) -> dict[str, list[str]]:
         # Insert row to register username
-        self.bot.database.execute('INSERT INTO mc_accounts (username, type, owner) VALUES (?, ?, ?);', [username, account_type, account_owner])
-        self.bot.database.commit()
-        # Add to server whitelist
-        self.bot.send_udp_message('register', '{0} {1}'.format(account_type, username))
+        await self.bot.database.execute('INSERT INTO mc_accounts (username, type, owner, server) VALUES (?, ?, ?, ?);', [username, account_type, account_owner, server])
+        # Add to the whitelist of the chosen server, or all servers
+        return await self.bot.update_whitelist('register', ['{0} {1}'.format(account_type, username)], server)
 
-    # Unregisters a Minecraft username
-    def _unregister(self, username: str, account_type: str):
+    # Unregisters a Minecraft username, returns the replies of servers reached over RCON
+    async def _unregister(self, username: str, account_type: str) -> dict[str, list[str]]:
         # For case-insensitive checking
         username = username.lower()
         # Delete appropriate rows
-        self.bot.database.execute('DELETE FROM mc_accounts WHERE lower(username) = ? AND type = ?;', [username, account_type])
-        self.bot.database.commit()
-        # Remove from server whitelist
-        self.bot.send_udp_message('unregister', '{0} {1}'.format(account_type, username))
+        await self.bot.database.execute('DELETE FROM mc_accounts WHERE username = ? COLLATE NOCASE AND type = ?;', [username, account_type])
+        # Remove from every server's whitelist
+        return await self.bot.update_whitelist('unregister', ['{0} {1}'.format(account_type, username)])
 
-    # Lookup any existing registrations of a Minecraft username
-    def _lookup_username(self, username: str, account_type: str):
-        # For case-insensitive checking
-        username = username.lower()
-        # Select all matching rows
-        return self.bot.database.execute('SELECT * FROM mc_accounts WHERE lower(username) = ? AND type = ?;', [username, account_type])
+    # Format the replies of servers reached over RCON to append to a command response
+    def _format_replies(self, replies: dict[str, list[str]]) -> str:
+        return ''.join('\n{0}: {1}'.format(self.bot.servers[server_id].name if server_id in self.bot.servers else server_id, '; '.join(server_replies)) for server_id, server_replies in replies.items())
+
+    # Lookup any existing registrations of a Minecraft username, optionally only those after a rowid
+    async def _lookup_username(self, username: str, account_type: str, after: int = 0, limit: int = -1):
+        # Select all matching rows, case-insensitively
+        return await self.bot.database.fetch_all('SELECT rowid, * FROM mc_accounts WHERE username = ? COLLATE NOCASE AND type = ? AND rowid > ? ORDER BY rowid LIMIT ?;', [username, account_type, after, limit])
 
     # Lookup any existing registrations belonging to a Discord guild member
-    def _lookup_member(self, member_id: int):
+    async def _lookup_member(self, member_id: int, account_type: str = None, after: int = 0, limit: int = -1):
         # Select all matching rows
-        return self.bot.database.execute('SELECT * FROM mc_accounts WHERE owner = ?;', [member_id])
+        if account_type is not None:
+            return await self.bot.database.fetch_all('SELECT rowid, * FROM mc_accounts WHERE owner = ? AND type = ? AND rowid > ? ORDER BY rowid LIMIT ?;', [member_id, account_type, after, limit])
+        return await self.bot.database.fetch_all('SELECT rowid, * FROM mc_accounts WHERE owner = ? AND rowid > ? ORDER BY rowid LIMIT ?;', [member_id, after, limit])
+
+    async def _list_registrations(self, account_type: str = None, after: int = 0, limit: int = -1):
+        if account_type is not None:
+            return await self.bot.database.fetch_all('SELECT rowid, * FROM mc_accounts WHERE type = ? AND rowid > ? ORDER BY rowid LIMIT ?;', [account_type, after, limit])
+        return await self.bot.database.fetch_all('SELECT rowid, * FROM mc_accounts WHERE rowid > ? ORDER BY rowid LIMIT ?;', [after, limit])
+
+    # Resolve owner IDs to display strings, fetching unknown users concurrently
+    async def _resolve_owners(self, owner_ids) -> dict[int, str]:
+        semaphore = asyncio.Semaphore(self.owner_fetch_limit)
+        async def resolve(owner_id: int) -> str:
+            async with semaphore:
+                try:
+                    user = await self.bot.resolve_user(owner_id)
+                except discord.HTTPException:
+                    user = None
+            if user is not None:
+                return user.display_name + ' (ID: ' + str(user.id) +')'
+            return str(owner_id)
+        owner_ids = list({int(owner_id) for owner_id in owner_ids if owner_id is not None})
+        return dict(zip(owner_ids, await asyncio.gather(*[resolve(owner_id) for owner_id in owner_ids])))
 
-    def _list_registrations(self):
-        return self.bot.database.execute('SELECT * FROM mc_accounts;')
+    # Format a page of registrations, one line each
+    async def _format_registrations(self, rows: list) -> list[str]:
+        owners = await self._resolve_owners(row['owner'] for row in rows)
+        lines = []
+        for row in rows:
+            owner = owners[int(row['owner'])] if row['owner'] is not None else 'No owner'
+            server = ' [{0}]'.format(row['server']) if row['server'] is not None else ''
+            lines.append('{0} ({1} Edition){2}: {3}'.format(row['username'], row['type'].capitalize(), server, owner))
+        return lines
 
-    def _check_registration_username(self, username: str, account_type: str):
-        return len(self._lookup_username(username, account_type)) > 0
+    async def _check_registration_username(self, username: str, account_type: str) -> bool:
+        return await self.bot.database.fetch_one('SELECT 1 FROM mc_accounts WHERE username = ? COLLATE NOCASE AND type = ? LIMIT 1;', [username, account_type]) is not None
 
-    def _check_registration_member(self, member_id: int):
-        return len(self._lookup_member(member_id)) > 0
+    async def _check_registration_member(self, member_id: int) -> bool:
+        return await self.bot.database.fetch_one('SELECT 1 FROM mc_accounts WHERE owner = ? LIMIT 1;', [member_id]) is not None
 
 
 def setup(bot):
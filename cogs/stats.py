@@ -0,0 +1,53 @@
+# Python 3.10
+
+# Main CraftBot class
+import craftbot
+# Discord API
+import discord
+from discord.ext import commands
+from discord import slash_command, Option
+# Built-in Python libraries
+import time
+
+
+class StatsCog(commands.Cog):
+    # Length of each leaderboard window in seconds, None for all time
+    playtime_windows = {'daily': 24 * 60 * 60, 'weekly': 7 * 24 * 60 * 60, 'all-time': None}
+
+    def __init__(self, bot: craftbot.CraftBot):
+        self.bot = bot
+
+    @slash_command(description='Show the players with the most playtime.')
+    async def playtimes(self, ctx: discord.ApplicationContext,
+            window: Option(str, 'The time window to rank players over.', required=False, choices=list(playtime_windows.keys()), default='all-time'),
+            count: Option(int, 'The number of players to show.', required=False, min_value=1, max_value=25, default=10),
+            server: Option(str, 'The game server to show, or the first server if empty.', required=False, default=None)):
+        game_server = self.bot.get_server(server)
+        if game_server is None:
+            await ctx.interaction.response.send_message(content='There is no game server with the ID "{0}"!'.format(server))
+            return
+        window_length = self.playtime_windows[window]
+        rankings = await game_server.playtime_store.query_top(count, time.time() - window_length if window_length is not None else None)
+        embed = discord.Embed(title=game_server.format_title('Playtime Rankings ({0})'.format(window.capitalize())), description=self.bot.format_playtimes(rankings, count), colour=discord.Colour.from_rgb(255, 170, 0))
+        await ctx.interaction.response.send_message(embed=embed)
+
+    @slash_command(description='Show when the server is busiest.')
+    async def activity(self, ctx: discord.ApplicationContext,
+            days: Option(int, 'The number of days to look back.', required=False, min_value=1, max_value=90, default=7),
+            server: Option(str, 'The game server to show, or the first server if empty.', required=False, default=None)):
+        game_server = self.bot.get_server(server)
+        if game_server is None:
+            await ctx.interaction.response.send_message(content='There is no game server with the ID "{0}"!'.format(server))
+            return
+        peak_hours = await game_server.presence_tracker.query_peak_hours(time.time() - days * 24 * 60 * 60)
+        # Format results
+        hourslist = ['No data']
+        if len(peak_hours) > 0:
+            hourslist = ['{0:02d}:00 UTC  {1} players'.format(hour, peak) for hour, peak in peak_hours[:10]]
+        embed = discord.Embed(title=game_server.format_title('Peak Hours (Last {0} Days)'.format(days)), description='\n'.join(['```'] + hourslist + ['```']), colour=discord.Colour.from_rgb(255, 170, 0))
+        embed.add_field(name='**Currently Online**', value=str(len(game_server.presence_tracker.online)))
+        await ctx.interaction.response.send_message(embed=embed)
+
+
+def setup(bot):
+    bot.add_cog(StatsCog(bot))
\ No newline at end of file
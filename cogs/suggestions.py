@@ -0,0 +1,41 @@
+# Python 3.10
+
+# Main CraftBot class
+import craftbot
+# Discord API
+import discord
+from discord.ext import commands
+from discord import Option
+# Built-in Python libraries
+import time
+
+
+class SuggestionsCog(commands.Cog):
+    # Length of each leaderboard window in seconds, None for all time
+    suggestion_windows = {'weekly': 7 * 24 * 60 * 60, 'monthly': 30 * 24 * 60 * 60, 'all-time': None}
+
+    def __init__(self, bot: craftbot.CraftBot):
+        self.bot = bot
+
+    group_suggestions = discord.SlashCommandGroup(name='suggestions', description='Commands for browsing suggestions.')
+
+    @group_suggestions.command(name='top', description='Show the suggestions with the best votes.')
+    async def top(self, ctx: discord.ApplicationContext,
+            window: Option(str, 'Only rank suggestions posted in this time window.', required=False, choices=list(suggestion_windows.keys()), default='all-time'),
+            count: Option(int, 'The number of suggestions to show.', required=False, min_value=1, max_value=25, default=10)):
+        window_length = self.suggestion_windows[window]
+        rows = await self.bot.suggestion_index.query_top(count, time.time() - window_length if window_length is not None else None)
+        # Format results, linking to each suggestion
+        lines = ['No suggestions found']
+        if len(rows) > 0:
+            lines = []
+            for i, row in enumerate(rows):
+                content = row['content'] if len(row['content']) <= 80 else row['content'][:79] + '…'
+                link = 'https://discord.com/channels/{0}/{1}/{2}'.format(ctx.guild_id, row['channel_id'], row['message_id'])
+                lines.append('{0}. [{1}]({2}) (+{3} / -{4})'.format(i + 1, discord.utils.escape_markdown(content) or 'Suggestion', link, row['upvotes'], row['downvotes']))
+        embed = discord.Embed(title='**Top Suggestions ({0})**'.format(window.capitalize()), description='\n'.join(lines), colour=discord.Colour.from_rgb(255, 170, 0))
+        await ctx.interaction.response.send_message(embed=embed)
+
+
+def setup(bot):
+    bot.add_cog(SuggestionsCog(bot))
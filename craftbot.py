@@ -4,29 +4,98 @@
 import discord
 from discord.ext import commands
 from discord.commands import slash_command, Option
-# Asynchronous Minecraft RCON library (https://github.com/MrReacher/async-mcrcon)
-# from async_mcrcon import MinecraftClient, InvalidPassword
 # SQLite database library
 import sqlite3
+# HTTP client library used by PyCord, needed for webhooks
+import aiohttp
 # Library to load variables from the .env file
 import dotenv
 # Built-in Python libraries
-import asyncio, datetime as date, json, math, os, re, socket, sys, threading
+import asyncio, atexit, bisect, collections, concurrent.futures, copy, datetime as date, hashlib, heapq, hmac, itertools, json, logging, logging.handlers, math, os, queue, re, socket, struct, sys, time, types
 
 
 
-def log_message(location: str, message: str):
-    print('[{0}] [{1}] {2}'.format(date.datetime.now().strftime(r'%d-%m-%Y %H:%M:%S'), location, message))
+# Log a message under a location, such as 'UDP' or 'Init', whose level can be set in the config
+def log_message(location: str, message: str, level: int = logging.INFO):
+    logging.getLogger('craftbot.' + location).log(level, message)
 
+# Log an error with its traceback, which is only formatted on the log writer thread
 def log_exception(location: str, details: str, exception: Exception):
-    log_message(location, details)
-    log_message(location, '{0}: {1}'.format(type(exception).__name__, exception))
-    traceback = exception.__traceback__
-    while traceback:
-        log_message(location, '  {0}: {1}'.format(traceback.tb_frame.f_code.co_filename, traceback.tb_lineno))
-        traceback = traceback.tb_next
-    if exception.__cause__ is not None:
-        log_exception(location, 'Caused by', exception.__cause__)
+    logging.getLogger('craftbot.' + location).error(details, exc_info=exception)
+
+
+# Human-readable log lines, as printed before the pipeline existed
+class LogTextFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        lines = ['[{0}] [{1}] {2}{3}'.format(self.formatTime(record, r'%d-%m-%Y %H:%M:%S'), get_log_location(record), record.getMessage(), format_log_repeats(record))]
+        if record.exc_info:
+            lines.append(self.formatException(record.exc_info))
+        return '\n'.join(lines)
+
+# One JSON object per log line
+class LogJSONFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': record.created, 'level': record.levelname, 'location': get_log_location(record), 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if getattr(record, 'repeated', 0) > 0:
+            entry['repeated'] = record.repeated
+        return json.dumps(entry)
+
+def get_log_location(record: logging.LogRecord) -> str:
+    return record.name[len('craftbot.'):] if record.name.startswith('craftbot.') else record.name
+
+def format_log_repeats(record: logging.LogRecord) -> str:
+    repeated = getattr(record, 'repeated', 0)
+    return ' (repeated {0} more times)'.format(repeated) if repeated > 0 else ''
+
+
+# Suppresses repeats of the same warning or error within an interval, counting them on the next one let through
+class LogDeduplicator(logging.Filter):
+    # Forget old messages once this many are remembered
+    max_entries = 1024
+
+    def __init__(self, interval: float = 60):
+        super().__init__()
+        self.interval = interval
+        # When each message was last let through, and how many repeats were suppressed since
+        self.entries = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        now = time.monotonic()
+        key = (record.name, record.msg)
+        entry = self.entries.get(key)
+        if entry is not None and now - entry[0] < self.interval:
+            entry[1] += 1
+            return False
+        record.repeated = entry[1] if entry is not None else 0
+        self.entries[key] = [now, 0]
+        if len(self.entries) > self.max_entries:
+            expired = now - self.interval
+            self.entries = {key: entry for key, entry in self.entries.items() if entry[0] >= expired}
+        return True
+
+
+# Hands log records to the writer thread without formatting them or ever blocking
+class LogQueueHandler(logging.handlers.QueueHandler):
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    # Formatting happens on the writer thread instead
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
 
 # Deep search a dictionary for the value associated with a dot-delimited key
@@ -58,32 +127,2263 @@ def search_set_dict(dictionary: dict, dotted_key: str, value) -> bool:
 def split_prefix(string: str) -> str:
     return re.split(r'\s+', string, 1)
 
+# Reads the entire contents of a text file
+def read_file(file_path: str) -> str:
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return file.read()
 
 
-# Our custom bot implementation :)
-class CraftBot(discord.Bot):
+
+# Flatten a dictionary into the provided one, keyed by dot-delimited keys
+def flatten_dict(dictionary: dict, prefix: str, flattened: dict):
+    for key, value in dictionary.items():
+        dotted_key = prefix + key
+        flattened[dotted_key] = freeze_value(value)
+        if isinstance(value, dict):
+            flatten_dict(value, dotted_key + '.', flattened)
+
+# Make a read-only copy of a config value
+def freeze_value(value):
+    if isinstance(value, dict):
+        return types.MappingProxyType({key: freeze_value(subvalue) for key, subvalue in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze_value(subvalue) for subvalue in value)
+    return value
+
+
+# Expected types of config values, as (type, default) with a default of ... marking a required value
+config_schema = {
+    'admin.roles': (list, ...),
+    'admin.users': (list, ...),
+    'prefix': (str, None),
+    'modules.chat.flush_interval': ((int, float), 1.0),
+    'modules.chat.webhook_url': (str, None),
+    'modules.chat.presence_notices': (bool, False),
+    'modules.chat.presence_interval': ((int, float), 10),
+    'modules.stats.message_id': (int, None),
+    'modules.stats.update_interval': ((int, float), 5),
+    'modules.stats.flush_interval': ((int, float), 30),
+    'modules.help.channel_id': (int, ...),
+    'modules.help.formats.message_greeting': (str, ...),
+    'modules.help.formats.thread_title': (str, ...),
+    'modules.suggestions.channel_id': (int, ...),
+    'modules.suggestions.formats.message_greeting': (str, ...),
+    'modules.suggestions.formats.thread_title': (str, ...),
+    'modules.suggestions.formats.reaction_downvote': (str, ...),
+    'modules.suggestions.formats.reaction_upvote': (str, ...),
+    'modules.whitelist.channel_id': (int, None),
+    'modules.whitelist.formats.message_greeting': (str, None),
+    'modules.whitelist.formats.message_finished': (str, None),
+    'modules.whitelist.formats.error_invalid': (str, None),
+    'modules.whitelist.formats.error_registered': (str, None),
+    'modules.whitelist.formats.reaction_bedrock': (str, None),
+    'modules.whitelist.formats.reaction_java': (str, None),
+    'logging.level': (str, 'INFO'),
+    'logging.levels': (dict, None),
+    'logging.file': (str, 'craftbot.log'),
+    'logging.max_bytes': (int, 10 * 1024 * 1024),
+    'logging.backup_count': (int, 5),
+    'logging.dedup_interval': ((int, float), 60),
+    'metrics.listen_address': (str, 'localhost'),
+    'metrics.listen_port': (int, None),
+    'chat_archive.enabled': (bool, True),
+    'chat_archive.flush_interval': ((int, float), 2),
+    'chat_archive.batch_size': (int, 500),
+    'chat_archive.retention_days': ((int, float), 90),
+    'chat_archive.prune_interval': ((int, float), 3600),
+    'identity_cache.max_size': (int, 10000),
+    'identity_cache.ttl': ((int, float), 3600),
+    'udp.listen_address': (str, ...),
+    'udp.listen_port': (int, ...),
+    'udp.queue_size': (int, 1024),
+    'udp.queue_policy': (str, 'coalesce'),
+    'udp.batch_size': (int, 64),
+    'udp.reliable': (bool, False),
+    'udp.retransmit_timeout': ((int, float), 1.0),
+    'udp.retransmit_max_timeout': ((int, float), 60),
+    'udp.dedup_window': ((int, float), 300),
+    'udp.chunk_timeout': ((int, float), 10),
+    'transport': (str, 'udp'),
+    'rcon.port': (int, 25575),
+    'rcon.password': (str, None),
+    'rcon.pool_size': (int, 2),
+    'rcon.timeout': ((int, float), 5),
+}
+
+# Expected types of each game server's settings in the servers section
+server_schema = {
+    'name': (str, None),
+    'address': (str, ...),
+    'port': (int, ...),
+    'secret': (str, None),
+    'chat_channel_id': (int, None),
+    'webhook_url': (str, None),
+    'stats_channel_id': (int, None),
+    'stats_message_id': (int, None),
+    'reliable': (bool, False),
+    'transport': (str, 'udp'),
+    'rcon_port': (int, 25575),
+    'rcon_password': (str, None),
+    'rcon_pool_size': (int, 2),
+    'rcon_timeout': ((int, float), 5),
+}
+
+# Ways the bot can send whitelist changes to a game server
+server_transports = ('udp', 'rcon')
+
+# What the UDP ingest queue does with a packet that arrives while it is full
+udp_queue_policies = ('drop_newest', 'drop_oldest', 'coalesce')
+
+# Single server settings, required when the config has no servers section
+legacy_server_schema = {
+    'modules.chat.channel_id': (int, ...),
+    'modules.stats.channel_id': (int, ...),
+    'udp.sendto_address': (str, ...),
+    'udp.sendto_port': (int, ...),
+}
+
+# Immutable, validated view of the config with every dot-delimited key precomputed
+class ConfigSnapshot:
+
+    def __init__(self, config: dict, schema: dict = config_schema):
+        values = {}
+        flatten_dict(config, '', values)
+        # Check types and fill in defaults
+        errors = []
+        self.check(values, schema, '', errors)
+        if values.get('servers') is not None:
+            for server_id in values['servers']:
+                self.check(values, server_schema, 'servers.{0}.'.format(server_id), errors)
+        else:
+            self.check(values, legacy_server_schema, '', errors)
+        # Servers using RCON need a password to log in with
+        for prefix in (['servers.{0}.'.format(server_id) for server_id in values['servers']] if values.get('servers') is not None else ['']):
+            transport = values.get(prefix + 'transport')
+            if transport not in server_transports:
+                errors.append('"{0}transport" must be one of {1}'.format(prefix, ', '.join(server_transports)))
+            elif transport == 'rcon' and values.get(prefix + ('rcon_password' if prefix else 'rcon.password')) is None:
+                errors.append('"{0}" is required by the RCON transport'.format(prefix + ('rcon_password' if prefix else 'rcon.password')))
+        if values.get('udp.queue_policy') not in udp_queue_policies:
+            errors.append('"udp.queue_policy" must be one of {0}'.format(', '.join(udp_queue_policies)))
+        # Log levels must be names the logging module knows
+        for key, level in [('logging.level', values.get('logging.level'))] + [('logging.levels.' + location, level) for location, level in (values.get('logging.levels') or {}).items()]:
+            if not isinstance(level, str) or not isinstance(logging.getLevelName(level.upper()), int):
+                errors.append('"{0}" is not a log level'.format(key))
+        if len(errors) > 0:
+            raise ValueError('Invalid config: ' + ', '.join(errors))
+        self.values = types.MappingProxyType(values)
+
+    def check(self, values: dict, schema: dict, prefix: str, errors: list[str]):
+        for key, (value_type, default) in schema.items():
+            key = prefix + key
+            if values.get(key) is None:
+                if default is ...:
+                    errors.append('"{0}" is required'.format(key))
+                else:
+                    values[key] = default
+            elif not isinstance(values[key], {list: tuple, dict: types.MappingProxyType}.get(value_type, value_type)):
+                errors.append('"{0}" has the wrong type'.format(key))
+
+    def get(self, key: str, default=None):
+        return self.values.get(key, default)
+
+    def get_int(self, key: str, default: int = None) -> int:
+        value = self.values.get(key)
+        return default if value is None else int(value)
+
+    def get_float(self, key: str, default: float = None) -> float:
+        value = self.values.get(key)
+        return default if value is None else float(value)
+
+    def get_str(self, key: str, default: str = None) -> str:
+        value = self.values.get(key)
+        return default if value is None else str(value)
+
+    def get_list(self, key: str, default: tuple = ()) -> tuple:
+        value = self.values.get(key)
+        return default if value is None else tuple(value)
+
+
+# Queue-backed logging, written to stdout and a rotating JSON lines file by a background thread
+class LogPipeline:
+
+    def __init__(self, queue_size: int = 10000):
+        self.logger = logging.getLogger('craftbot')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.deduplicator = LogDeduplicator()
+        self.queue_handler = LogQueueHandler(queue.Queue(queue_size))
+        self.queue_handler.addFilter(self.deduplicator)
+        self.logger.addHandler(self.queue_handler)
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(LogTextFormatter())
+        self.file_handler = None
+        self.file_settings = None
+        self.location_levels = {}
+        self.listener = logging.handlers.QueueListener(self.queue_handler.queue, console_handler, respect_handler_level=True)
+        self.listener.start()
+        self.running = True
+        atexit.register(self.close)
+
+    # Apply the logging settings from the config
+    def configure(self, snapshot: ConfigSnapshot):
+        self.logger.setLevel(snapshot.get_str('logging.level').upper())
+        self.deduplicator.interval = snapshot.get_float('logging.dedup_interval')
+        # Reset locations that no longer have their own level
+        levels = {location: str(level).upper() for location, level in (snapshot.get('logging.levels') or {}).items()}
+        for location in self.location_levels.keys() - levels.keys():
+            logging.getLogger('craftbot.' + location).setLevel(logging.NOTSET)
+        for location, level in levels.items():
+            logging.getLogger('craftbot.' + location).setLevel(level)
+        self.location_levels = levels
+        # Reopen the log file only if its settings changed
+        file_settings = (snapshot.get_str('logging.file'), snapshot.get_int('logging.max_bytes'), snapshot.get_int('logging.backup_count'))
+        if file_settings != self.file_settings:
+            self.file_settings = file_settings
+            file_handler = None
+            if file_settings[0] is not None:
+                file_handler = logging.handlers.RotatingFileHandler(file_settings[0], maxBytes=file_settings[1], backupCount=file_settings[2], encoding='utf-8', delay=True)
+                file_handler.setFormatter(LogJSONFormatter())
+            # The listener's handlers are only read by the writer thread, so swap them in one assignment
+            handlers = [handler for handler in self.listener.handlers if handler is not self.file_handler]
+            if file_handler is not None:
+                handlers.append(file_handler)
+            self.listener.handlers = tuple(handlers)
+            if self.file_handler is not None:
+                self.file_handler.close()
+            self.file_handler = file_handler
+
+    # Write out everything still queued and stop the writer thread
+    def close(self):
+        if not self.running:
+            return
+        self.running = False
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+
+
+
+# Schema migrations, applied in order and tracked with the database's user_version
+database_migrations = [
+    # Registered Minecraft accounts
+    '''
+        CREATE TABLE IF NOT EXISTS mc_accounts (
+            username TEXT NOT NULL,
+            type TEXT NOT NULL,
+            uuid TEXT UNIQUE,
+            owner INTEGER
+        );
+    ''',
+    # Indexes for case-insensitive username lookups and owner lookups
+    '''
+        CREATE INDEX IF NOT EXISTS mc_accounts_username ON mc_accounts (username COLLATE NOCASE, type);
+        CREATE INDEX IF NOT EXISTS mc_accounts_owner ON mc_accounts (owner);
+    ''',
+    # Cumulative playtime per player, and how much of it was gained in each hour
+    '''
+        CREATE TABLE IF NOT EXISTS playtimes (
+            username TEXT PRIMARY KEY,
+            total INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS playtimes_total ON playtimes (total DESC);
+        CREATE TABLE IF NOT EXISTS playtime_deltas (
+            username TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            PRIMARY KEY (username, bucket)
+        );
+        CREATE INDEX IF NOT EXISTS playtime_deltas_bucket ON playtime_deltas (bucket);
+    ''',
+    # Player sessions, and the number of players online over time
+    '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL,
+            start INTEGER NOT NULL,
+            end INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS sessions_username ON sessions (username COLLATE NOCASE, start);
+        CREATE INDEX IF NOT EXISTS sessions_open ON sessions (username) WHERE end IS NULL;
+        CREATE TABLE IF NOT EXISTS player_counts (
+            time INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL
+        );
+    ''',
+    # Per-server registrations and stats, existing stats belong to the default server
+    '''
+        ALTER TABLE mc_accounts ADD COLUMN server TEXT;
+        CREATE TABLE playtimes_new (
+            server TEXT NOT NULL,
+            username TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (server, username)
+        );
+        INSERT INTO playtimes_new SELECT 'default', username, total FROM playtimes;
+        DROP TABLE playtimes;
+        ALTER TABLE playtimes_new RENAME TO playtimes;
+        CREATE INDEX playtimes_total ON playtimes (server, total DESC);
+        CREATE TABLE playtime_deltas_new (
+            server TEXT NOT NULL,
+            username TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            PRIMARY KEY (server, username, bucket)
+        );
+        INSERT INTO playtime_deltas_new SELECT 'default', username, bucket, delta FROM playtime_deltas;
+        DROP TABLE playtime_deltas;
+        ALTER TABLE playtime_deltas_new RENAME TO playtime_deltas;
+        CREATE INDEX playtime_deltas_bucket ON playtime_deltas (server, bucket);
+        ALTER TABLE sessions ADD COLUMN server TEXT NOT NULL DEFAULT 'default';
+        DROP INDEX sessions_open;
+        CREATE INDEX sessions_open ON sessions (server, username) WHERE end IS NULL;
+        CREATE TABLE player_counts_new (
+            server TEXT NOT NULL,
+            time INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (server, time)
+        );
+        INSERT INTO player_counts_new SELECT 'default', time, count FROM player_counts;
+        DROP TABLE player_counts;
+        ALTER TABLE player_counts_new RENAME TO player_counts;
+    ''',
+    # Control messages waiting to be acknowledged by a game server, numbered by their row ID
+    '''
+        CREATE TABLE udp_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            server TEXT NOT NULL,
+            type TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX udp_outbox_server ON udp_outbox (server, id);
+    ''',
+    # Suggestion vote tallies, and the votes behind them so each user counts once per reaction
+    '''
+        CREATE TABLE suggestions (
+            message_id INTEGER PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            author INTEGER,
+            content TEXT NOT NULL DEFAULT '',
+            created INTEGER NOT NULL,
+            upvotes INTEGER NOT NULL DEFAULT 0,
+            downvotes INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX suggestions_score ON suggestions (upvotes - downvotes DESC, upvotes DESC);
+        CREATE INDEX suggestions_created ON suggestions (created);
+        CREATE TABLE suggestion_votes (
+            message_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            vote INTEGER NOT NULL,
+            PRIMARY KEY (message_id, user_id, vote)
+        );
+    ''',
+    # Self-service whitelist requests and the state each one has reached
+    '''
+        CREATE TABLE whitelist_requests (
+            message_id INTEGER PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            type TEXT,
+            state TEXT NOT NULL,
+            created INTEGER NOT NULL,
+            updated INTEGER NOT NULL
+        );
+        CREATE INDEX whitelist_requests_state ON whitelist_requests (state) WHERE state = 'registering';
+    ''',
+    # Bridged chat in both directions, with a full-text index kept in sync by triggers
+    '''
+        CREATE TABLE chat_log (
+            id INTEGER PRIMARY KEY,
+            server TEXT NOT NULL,
+            source TEXT NOT NULL,
+            author TEXT NOT NULL,
+            author_id INTEGER,
+            content TEXT NOT NULL,
+            time INTEGER NOT NULL
+        );
+        CREATE INDEX chat_log_time ON chat_log (time);
+        CREATE INDEX chat_log_author ON chat_log (author COLLATE NOCASE, id);
+        CREATE VIRTUAL TABLE chat_log_search USING fts5 (content, content='chat_log', content_rowid='id');
+        CREATE TRIGGER chat_log_insert AFTER INSERT ON chat_log BEGIN
+            INSERT INTO chat_log_search (rowid, content) VALUES (new.id, new.content);
+        END;
+        CREATE TRIGGER chat_log_delete AFTER DELETE ON chat_log BEGIN
+            INSERT INTO chat_log_search (chat_log_search, rowid, content) VALUES ('delete', old.id, old.content);
+        END;
+    ''',
+    # Values the bot keeps across runs, starting with the random epoch that tells its UDP sequence numbers apart from another database's
+    '''
+        CREATE TABLE bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        INSERT INTO bot_state (key, value) VALUES ('udp_epoch', lower(hex(randomblob(8))));
+    ''',
+    # Each username can only be registered once per account type, the earliest registration of any duplicates is kept
+    '''
+        DELETE FROM mc_accounts WHERE rowid NOT IN (SELECT MIN(rowid) FROM mc_accounts GROUP BY username COLLATE NOCASE, type);
+        DROP INDEX mc_accounts_username;
+        CREATE UNIQUE INDEX mc_accounts_username ON mc_accounts (username COLLATE NOCASE, type);
+    ''',
+]
+
+# SQLite connection whose queries all run on a dedicated thread, keeping them off the event loop
+class Database:
+
+    def __init__(self, db_file_path: str):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self.connection = self.executor.submit(self._connect, db_file_path).result()
+
+    def _connect(self, db_file_path: str) -> sqlite3.Connection:
+        connection = sqlite3.connect(db_file_path, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        # Write-ahead logging lets reads proceed during writes and makes commits cheaper
+        connection.execute('PRAGMA journal_mode=WAL;')
+        connection.execute('PRAGMA synchronous=NORMAL;')
+        return connection
+
+    # Apply any migrations the database hasn't seen yet, returns the resulting schema version
+    def migrate(self, migrations: list[str]) -> int:
+        return self.executor.submit(self._migrate, migrations).result()
+
+    def _migrate(self, migrations: list[str]) -> int:
+        version = self.connection.execute('PRAGMA user_version;').fetchone()[0]
+        for i in range(version, len(migrations)):
+            try:
+                self.connection.executescript('BEGIN;' + migrations[i] + 'PRAGMA user_version = {0}; COMMIT;'.format(i + 1))
+            except sqlite3.Error:
+                self.connection.rollback()
+                raise
+            log_message('Init', 'Migrated database to schema version {0}'.format(i + 1))
+        return max(version, len(migrations))
+
+    # Run a function with the connection on the database thread
+    async def run(self, function, *args):
+        return await asyncio.wrap_future(self.executor.submit(function, self.connection, *args))
+
+    # Select all rows matching a query
+    async def fetch_all(self, query: str, parameters=()) -> list[sqlite3.Row]:
+        return await self.run(lambda connection: connection.execute(query, parameters).fetchall())
+
+    # Select the first row matching a query
+    async def fetch_one(self, query: str, parameters=()) -> sqlite3.Row:
+        return await self.run(lambda connection: connection.execute(query, parameters).fetchone())
+
+    # Run a statement and commit it, returns the number of affected rows
+    async def execute(self, query: str, parameters=()) -> int:
+        return await self.run(self._execute, query, parameters)
+
+    def _execute(self, connection: sqlite3.Connection, query: str, parameters) -> int:
+        with connection:
+            return connection.execute(query, parameters).rowcount
+
+    # Run a statement for each set of parameters in a single transaction, returns the number of affected rows
+    async def execute_many(self, query: str, parameter_sets) -> int:
+        return await self.run(self._execute_many, query, list(parameter_sets))
+
+    def _execute_many(self, connection: sqlite3.Connection, query: str, parameter_sets: list) -> int:
+        with connection:
+            return connection.executemany(query, parameter_sets).rowcount
+
+    def close(self):
+        self.executor.submit(self.connection.close)
+        self.executor.shutdown(wait=True)
+
+
+# Least recently used cache of Discord users and members, with entries expiring after a set time
+class IdentityCache:
+
+    def __init__(self, max_size: int = 10000, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        # Counters for tuning the size and expiry time
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    # Get a cached user, or None if it isn't cached or has expired
+    def get(self, user_id: int):
+        entry = self.entries.get(user_id)
+        if entry is not None:
+            expires, user = entry
+            if expires > time.monotonic():
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return user
+            del self.entries[user_id]
+        self.misses += 1
+        return None
+
+    def put(self, user: discord.abc.User):
+        self.entries[user.id] = (time.monotonic() + self.ttl, user)
+        self.entries.move_to_end(user.id)
+        # Evict the least recently used entries
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self.entries.pop(user_id, None)
+
+
+# Type and description of each metric, as (type, help)
+metric_descriptions = {
+    'craftbot_udp_packets_received_total': ('counter', 'UDP packets received from game servers.'),
+    'craftbot_udp_bytes_received_total': ('counter', 'Bytes of UDP packets received from game servers.'),
+    'craftbot_udp_packets_sent_total': ('counter', 'UDP packets sent to game servers.'),
+    'craftbot_udp_bytes_sent_total': ('counter', 'Bytes of UDP packets sent to game servers.'),
+    'craftbot_udp_send_errors_total': ('counter', 'UDP packets that could not be sent.'),
+    'craftbot_udp_queue_depth': ('gauge', 'UDP messages waiting to be dispatched.'),
+    'craftbot_udp_queue_dropped_total': ('counter', 'UDP messages dropped because the ingest queue was full.'),
+    'craftbot_udp_queue_coalesced_total': ('counter', 'UDP messages merged into an older queued message.'),
+    'craftbot_udp_handler_seconds': ('histogram', 'Time spent handling each UDP message.'),
+    'craftbot_udp_outbox_depth': ('gauge', 'Control messages waiting to be acknowledged.'),
+    'craftbot_udp_outbox_delivered_total': ('counter', 'Control messages acknowledged by game servers.'),
+    'craftbot_udp_outbox_retransmits_total': ('counter', 'Control messages sent again after a timeout.'),
+    'craftbot_udp_outbox_delivery_seconds': ('histogram', 'Time from queueing a control message to its acknowledgement.'),
+    'craftbot_rcon_command_seconds': ('histogram', 'Time from sending an RCON command to its reply.'),
+    'craftbot_rcon_errors_total': ('counter', 'RCON commands that failed or timed out.'),
+    'craftbot_message_handler_seconds': ('histogram', 'Time spent handling each routed Discord message.'),
+    'craftbot_discord_request_seconds': ('histogram', 'Latency of Discord REST requests, including rate limit waits.'),
+    'craftbot_discord_rate_limit_seconds': ('histogram', 'Time spent waiting on Discord rate limits.'),
+    'craftbot_discord_schedule_wait_seconds': ('histogram', 'Time scheduled Discord calls waited for their route bucket.'),
+    'craftbot_discord_call_retries_total': ('counter', 'Scheduled Discord calls retried after a transient error.'),
+    'craftbot_discord_gateway_latency_seconds': ('gauge', 'Latency of the Discord gateway heartbeat.'),
+    'craftbot_chat_queue_depth': ('gauge', 'Chat lines waiting to be sent to Discord.'),
+    'craftbot_chat_messages_sent_total': ('counter', 'Discord messages sent by the chat relay.'),
+    'craftbot_chat_flush_latency_seconds': ('gauge', 'Time the oldest line waited in the last chat flush.'),
+    'craftbot_chat_archive_pending': ('gauge', 'Chat lines waiting to be archived.'),
+    'craftbot_chat_archive_written_total': ('counter', 'Chat lines written to the archive.'),
+    'craftbot_chat_archive_pruned_total': ('counter', 'Archived chat lines deleted by the retention policy.'),
+    'craftbot_identity_cache_hits_total': ('counter', 'Identity cache lookups that found a user.'),
+    'craftbot_identity_cache_misses_total': ('counter', 'Identity cache lookups that did not find a user.'),
+}
+
+# Counts of observed values at or below each bucket's upper bound
+class Histogram:
+    default_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, buckets: tuple = default_buckets):
+        self.buckets = buckets
+        # The last count is for values above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count > 0 else 0.0
+
+    # Estimate a quantile as the upper bound of the bucket it falls in
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+
+# Counters and histograms rendered in the Prometheus text format, labels are tuples of (name, value) pairs
+class Metrics:
 
     def __init__(self):
-        super().__init__()
+        self.counters = {}
+        self.histograms = {}
+        # Functions sampled when rendering, for values other objects already keep
+        self.collectors = {}
+
+    def inc(self, name: str, value: float = 1, labels: tuple = ()):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: tuple = ()):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    # Sample a value from a function whenever the metrics are rendered
+    def collect(self, name: str, function):
+        self.collectors[name] = function
+
+    def get(self, name: str, labels: tuple = ()) -> float:
+        return self.counters.get((name, labels), 0)
+
+    # Merge the histograms of a metric across all of its labels
+    def get_histogram(self, name: str) -> Histogram:
+        merged = Histogram()
+        for (histogram_name, _), histogram in self.histograms.items():
+            if histogram_name == name:
+                merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                merged.count += histogram.count
+                merged.sum += histogram.sum
+        return merged
+
+    def render(self) -> str:
+        samples = {}
+        for (name, labels), value in self.counters.items():
+            samples.setdefault(name, []).append((name, labels, value))
+        for name, function in self.collectors.items():
+            try:
+                value = function()
+            except Exception:
+                continue
+            if value is not None:
+                samples.setdefault(name, []).append((name, (), value))
+        for (name, labels), histogram in self.histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (math.inf,), histogram.counts):
+                cumulative += count
+                lines.append((name + '_bucket', labels + (('le', '+Inf' if bound == math.inf else repr(bound)),), cumulative))
+            lines.append((name + '_sum', labels, histogram.sum))
+            lines.append((name + '_count', labels, histogram.count))
+        output = []
+        for name in sorted(samples):
+            metric_type, metric_help = metric_descriptions.get(name, ('untyped', ''))
+            output.append('# HELP {0} {1}'.format(name, metric_help))
+            output.append('# TYPE {0} {1}'.format(name, metric_type))
+            for sample_name, labels, value in samples[name]:
+                label_text = ','.join('{0}="{1}"'.format(key, str(label).replace('\\', '\\\\').replace('"', '\\"')) for key, label in labels)
+                output.append('{0}{1} {2}'.format(sample_name, '{' + label_text + '}' if label_text else '', value))
+        return '\n'.join(output) + '\n'
+
+
+# Records the waits logged by PyCord whenever Discord rate limits a request
+class RateLimitLogHandler(logging.Handler):
+    # PyCord logs every 429 with this message, a global limit is logged a second time with another message
+    message_prefix = 'We are being rate limited.'
+
+    def __init__(self, metrics: Metrics):
+        super().__init__(logging.WARNING)
+        self.metrics = metrics
+
+    def emit(self, record: logging.LogRecord):
+        if not str(record.msg).startswith(self.message_prefix):
+            return
+        # The retry delay is the first number in the message arguments
+        arguments = record.args if isinstance(record.args, tuple) else ()
+        wait = next((argument for argument in arguments if isinstance(argument, float)), None)
+        if wait is not None:
+            self.metrics.observe('craftbot_discord_rate_limit_seconds', wait)
+
+
+# Playtime totals and hourly deltas per player of a server, kept in memory and written to SQLite in batches
+class PlaytimeStore:
+    bucket_size = 3600
+
+    def __init__(self, bot, server, top_size: int = 10):
+        self.bot = bot
+        self.server = server
+        self.top_size = top_size
+        self.totals = {}
+        # The top players as (total, username), largest first
+        self.top = []
+        # Changes waiting to be written
+        self.pending_totals = {}
+        self.pending_deltas = {}
+        self.flush_task = None
+
+    # Load the saved totals from the database
+    async def load(self):
+        rows = await self.bot.database.fetch_all('SELECT username, total FROM playtimes WHERE server = ?;', [self.server.id])
+        self.totals = {row['username']: row['total'] for row in rows}
+        self.top = heapq.nlargest(self.top_size, ((total, username) for username, total in self.totals.items()))
+
+    # Apply the cumulative totals reported by the game server
+    def update(self, entries: dict[str, int]):
+        bucket = int(time.time()) // self.bucket_size * self.bucket_size
+        changed = []
+        decreased = False
+        for username, total in entries.items():
+            previous = self.totals.get(username)
+            if previous == total:
+                continue
+            if previous is not None:
+                if total > previous:
+                    # Attribute the gained time to the current hour
+                    key = (username, bucket)
+                    self.pending_deltas[key] = self.pending_deltas.get(key, 0) + total - previous
+                else:
+                    decreased = True
+            self.totals[username] = total
+            self.pending_totals[username] = total
+            changed.append(username)
+        if len(changed) == 0:
+            return
+        if decreased:
+            # A total went down, so any player could have moved into the top
+            self.top = heapq.nlargest(self.top_size, ((total, username) for username, total in self.totals.items()))
+        else:
+            # Totals only grew, so only the current top and the changed players can be in the new top
+            candidates = {username for _, username in self.top}
+            candidates.update(changed)
+            self.top = heapq.nlargest(self.top_size, ((self.totals[username], username) for username in candidates))
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.run_flush())
+
+    # Apply playtime gained since the last report, players without a total start from zero
+    def add(self, increments: dict[str, int]):
+        for username in increments:
+            self.totals.setdefault(username, 0)
+        self.update({username: self.totals[username] + increment for username, increment in increments.items()})
+
+    # Get the players with the most playtime as (username, total)
+    def get_top(self, count: int) -> list[tuple[str, int]]:
+        if count > self.top_size:
+            return [(username, total) for total, username in heapq.nlargest(count, ((total, username) for username, total in self.totals.items()))]
+        return [(username, total) for total, username in self.top[:count]]
+
+    # Query the players with the most playtime gained since a timestamp, or overall if it is None
+    async def query_top(self, count: int, since: float = None) -> list[tuple[str, int]]:
+        await self.flush()
+        if since is None:
+            rows = await self.bot.database.fetch_all('SELECT username, total FROM playtimes WHERE server = ? ORDER BY total DESC LIMIT ?;', [self.server.id, count])
+        else:
+            rows = await self.bot.database.fetch_all('SELECT username, SUM(delta) AS total FROM playtime_deltas WHERE server = ? AND bucket >= ? GROUP BY username ORDER BY total DESC LIMIT ?;', [self.server.id, int(since) // self.bucket_size * self.bucket_size, count])
+        return [(row['username'], row['total']) for row in rows]
+
+    async def run_flush(self):
+        await asyncio.sleep(self.bot.config_snapshot.get_float('modules.stats.flush_interval'))
+        try:
+            await self.flush()
+        except Exception as e:
+            log_exception('Stats', 'Error while saving playtimes!', e)
+
+    # Write all pending changes in one transaction, a failed write is merged back to be retried by the next flush
+    async def flush(self):
+        if len(self.pending_totals) == 0 and len(self.pending_deltas) == 0:
+            return
+        totals, self.pending_totals = self.pending_totals, {}
+        deltas, self.pending_deltas = self.pending_deltas, {}
+        try:
+            await self.bot.database.run(self._write,
+                [(self.server.id, username, total) for username, total in totals.items()],
+                [(self.server.id, username, bucket, delta) for (username, bucket), delta in deltas.items()])
+        except BaseException:
+            # Totals reported since then are newer, deltas add up
+            for username, total in totals.items():
+                self.pending_totals.setdefault(username, total)
+            for key, delta in deltas.items():
+                self.pending_deltas[key] = self.pending_deltas.get(key, 0) + delta
+            raise
+
+    def _write(self, connection: sqlite3.Connection, totals: list[tuple], deltas: list[tuple]):
+        with connection:
+            connection.executemany('INSERT INTO playtimes (server, username, total) VALUES (?, ?, ?) ON CONFLICT (server, username) DO UPDATE SET total = excluded.total;', totals)
+            connection.executemany('INSERT INTO playtime_deltas (server, username, bucket, delta) VALUES (?, ?, ?, ?) ON CONFLICT (server, username, bucket) DO UPDATE SET delta = delta + excluded.delta;', deltas)
+
+
+# Turns a server's player list snapshots into join and leave events, recording sessions and player counts
+class PresenceTracker:
+
+    def __init__(self, bot, server):
+        self.bot = bot
+        self.server = server
+        # Online players and when they joined
+        self.online = {}
+        # Events waiting to be written, in order
+        self.pending_events = []
+        self.pending_counts = []
+        self.flush_task = None
+        # Join and leave notices waiting to be sent
+        self.notice_joins = []
+        self.notice_leaves = []
+        self.notice_task = None
+
+    # Load the sessions that were still open when the bot stopped
+    async def load(self):
+        rows = await self.bot.database.fetch_all('SELECT username, start FROM sessions WHERE server = ? AND end IS NULL;', [self.server.id])
+        self.online = {row['username']: row['start'] for row in rows}
+
+    # Compare a player list snapshot to the previous one
+    def update(self, players: list[str]):
+        players = set(players)
+        joined = [username for username in players if username not in self.online]
+        left = [username for username in self.online if username not in players]
+        self.apply(joined, left)
+
+    # Record players joining and leaving
+    def apply(self, joined: list[str], left: list[str]):
+        now = int(time.time())
+        joined = [username for username in dict.fromkeys(joined) if username not in self.online]
+        left = [username for username in left if username in self.online]
+        if len(joined) == 0 and len(left) == 0:
+            return
+        for username in left:
+            del self.online[username]
+            self.pending_events.append(('leave', username, now))
+        for username in joined:
+            self.online[username] = now
+            self.pending_events.append(('join', username, now))
+        self.pending_counts.append((now, len(self.online)))
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.run_flush())
+        if self.bot.get_config_value('modules.chat.presence_notices'):
+            self.queue_notices(joined, left)
+
+    # Queue join and leave notices, merging everything that happens within the notice window
+    def queue_notices(self, joined: list[str], left: list[str]):
+        for username in joined:
+            # Someone who leaves and rejoins within the window cancels out
+            if username in self.notice_leaves:
+                self.notice_leaves.remove(username)
+            else:
+                self.notice_joins.append(username)
+        for username in left:
+            if username in self.notice_joins:
+                self.notice_joins.remove(username)
+            else:
+                self.notice_leaves.append(username)
+        if self.notice_task is None or self.notice_task.done():
+            self.notice_task = asyncio.create_task(self.run_notices())
+
+    async def run_notices(self):
+        await asyncio.sleep(self.bot.config_snapshot.get_float('modules.chat.presence_interval'))
+        joins, self.notice_joins = self.notice_joins, []
+        leaves, self.notice_leaves = self.notice_leaves, []
+        chat_channel = self.bot.guild.get_channel(self.server.get_config_value('chat_channel_id')) if self.bot.guild is not None else None
+        if chat_channel is None:
+            return
+        if len(joins) > 0:
+            self.bot.chat_relay.queue(chat_channel, '*{0} joined the game*'.format(self.format_names(joins)))
+        if len(leaves) > 0:
+            self.bot.chat_relay.queue(chat_channel, '*{0} left the game*'.format(self.format_names(leaves)))
+
+    # List some names, summarizing the rest
+    def format_names(self, names: list[str], limit: int = 10) -> str:
+        if len(names) > limit:
+            return '{0} and {1} others'.format(', '.join(names[:limit]), len(names) - limit)
+        return ', '.join(names)
+
+    async def run_flush(self):
+        await asyncio.sleep(self.bot.config_snapshot.get_float('modules.stats.flush_interval'))
+        try:
+            await self.flush()
+        except Exception as e:
+            log_exception('Stats', 'Error while saving player sessions!', e)
+
+    # Write all pending events in one transaction, a failed write goes back in front of newer events for the next flush
+    async def flush(self):
+        if len(self.pending_events) == 0 and len(self.pending_counts) == 0:
+            return
+        events, self.pending_events = self.pending_events, []
+        counts, self.pending_counts = self.pending_counts, []
+        try:
+            await self.bot.database.run(self._write, events, counts)
+        except BaseException:
+            self.pending_events[:0] = events
+            self.pending_counts[:0] = counts
+            raise
+
+    def _write(self, connection: sqlite3.Connection, events: list[tuple], counts: list[tuple]):
+        with connection:
+            for event, username, timestamp in events:
+                if event == 'join':
+                    connection.execute('INSERT INTO sessions (server, username, start) VALUES (?, ?, ?);', [self.server.id, username, timestamp])
+                else:
+                    connection.execute('UPDATE sessions SET end = ? WHERE server = ? AND username = ? AND end IS NULL;', [timestamp, self.server.id, username])
+            connection.executemany('INSERT OR REPLACE INTO player_counts (server, time, count) VALUES (?, ?, ?);', [(self.server.id, timestamp, count) for timestamp, count in counts])
+
+    # Query the highest player count in each hour of the day (UTC) since a timestamp, as (hour, count)
+    async def query_peak_hours(self, since: float) -> list[tuple[int, int]]:
+        await self.flush()
+        rows = await self.bot.database.fetch_all('SELECT (time / 3600) % 24 AS hour, MAX(count) AS peak FROM player_counts WHERE server = ? AND time >= ? GROUP BY hour ORDER BY peak DESC, hour;', [self.server.id, int(since)])
+        return [(row['hour'], row['peak']) for row in rows]
+
+
+# Tallies of suggestion votes in SQLite, updated from reaction events so ranking never needs to fetch messages
+class SuggestionIndex:
+    # Most recent suggestions checked at startup, and how many are written at once
+    backfill_limit = 500
+    backfill_batch = 100
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    # Get the vote a reaction stands for, 1 for an upvote, -1 for a downvote or None for any other reaction
+    def get_vote(self, emoji) -> int:
+        emoji = str(emoji)
+        if emoji == self.bot.get_config_value('modules.suggestions.formats.reaction_upvote'):
+            return 1
+        if emoji == self.bot.get_config_value('modules.suggestions.formats.reaction_downvote'):
+            return -1
+        return None
+
+    async def add_suggestion(self, message: discord.Message):
+        await self.bot.database.execute('INSERT INTO suggestions (message_id, channel_id, author, content, created) VALUES (?, ?, ?, ?, ?) ON CONFLICT (message_id) DO UPDATE SET author = excluded.author, content = excluded.content;',
+            [message.id, message.channel.id, message.author.id, message.clean_content, int(message.created_at.timestamp())])
+
+    async def remove_suggestion(self, message_id: int):
+        await self.bot.database.run(self._remove_suggestion, message_id)
+
+    def _remove_suggestion(self, connection: sqlite3.Connection, message_id: int):
+        with connection:
+            connection.execute('DELETE FROM suggestions WHERE message_id = ?;', [message_id])
+            connection.execute('DELETE FROM suggestion_votes WHERE message_id = ?;', [message_id])
+
+    # Record a vote, returns False if the user had already cast it
+    async def add_vote(self, message_id: int, channel_id: int, user_id: int, vote: int) -> bool:
+        return await self.bot.database.run(self._add_vote, message_id, channel_id, user_id, vote)
+
+    def _add_vote(self, connection: sqlite3.Connection, message_id: int, channel_id: int, user_id: int, vote: int) -> bool:
+        with connection:
+            if connection.execute('INSERT OR IGNORE INTO suggestion_votes (message_id, user_id, vote) VALUES (?, ?, ?);', [message_id, user_id, vote]).rowcount == 0:
+                return False
+            # Votes can arrive for suggestions posted before the index existed, the backfill fills in their details
+            connection.execute('INSERT OR IGNORE INTO suggestions (message_id, channel_id, created) VALUES (?, ?, ?);', [message_id, channel_id, int(discord.utils.snowflake_time(message_id).timestamp())])
+            connection.execute('UPDATE suggestions SET {0} = {0} + 1 WHERE message_id = ?;'.format('upvotes' if vote > 0 else 'downvotes'), [message_id])
+        return True
+
+    # Remove a vote, returns False if the user hadn't cast it
+    async def remove_vote(self, message_id: int, user_id: int, vote: int) -> bool:
+        return await self.bot.database.run(self._remove_vote, message_id, user_id, vote)
+
+    def _remove_vote(self, connection: sqlite3.Connection, message_id: int, user_id: int, vote: int) -> bool:
+        with connection:
+            if connection.execute('DELETE FROM suggestion_votes WHERE message_id = ? AND user_id = ? AND vote = ?;', [message_id, user_id, vote]).rowcount == 0:
+                return False
+            connection.execute('UPDATE suggestions SET {0} = {0} - 1 WHERE message_id = ?;'.format('upvotes' if vote > 0 else 'downvotes'), [message_id])
+        return True
+
+    # Query the suggestions with the best score posted since a timestamp, or overall if it is None
+    async def query_top(self, count: int, since: float = None) -> list[sqlite3.Row]:
+        if since is None:
+            return await self.bot.database.fetch_all('SELECT * FROM suggestions ORDER BY upvotes - downvotes DESC, upvotes DESC LIMIT ?;', [count])
+        return await self.bot.database.fetch_all('SELECT * FROM suggestions WHERE created >= ? ORDER BY upvotes - downvotes DESC, upvotes DESC LIMIT ?;', [int(since), count])
+
+    # Rebuild the votes of the most recent suggestions from their reactions, in batches
+    async def backfill(self, channel: discord.TextChannel) -> int:
+        count = 0
+        batch = []
+        async for message in channel.history(limit=self.backfill_limit):
+            votes = []
+            for reaction in message.reactions:
+                vote = self.get_vote(reaction.emoji)
+                # Only reactions someone other than the bot added need their users fetched
+                if vote is not None and reaction.count > (1 if reaction.me else 0):
+                    async for user in reaction.users():
+                        if user.id != self.bot.user.id:
+                            votes.append((message.id, user.id, vote))
+            batch.append(((message.id, message.channel.id, message.author.id, message.clean_content, int(message.created_at.timestamp())), votes))
+            if len(batch) >= self.backfill_batch:
+                await self.bot.database.run(self._write_backfill, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            await self.bot.database.run(self._write_backfill, batch)
+            count += len(batch)
+        return count
+
+    def _write_backfill(self, connection: sqlite3.Connection, batch: list[tuple]):
+        with connection:
+            for suggestion, votes in batch:
+                message_id = suggestion[0]
+                connection.execute('DELETE FROM suggestion_votes WHERE message_id = ?;', [message_id])
+                connection.executemany('INSERT OR IGNORE INTO suggestion_votes (message_id, user_id, vote) VALUES (?, ?, ?);', votes)
+                connection.execute('INSERT INTO suggestions (message_id, channel_id, author, content, created) VALUES (?, ?, ?, ?, ?) ON CONFLICT (message_id) DO UPDATE SET author = excluded.author, content = excluded.content;', suggestion)
+                connection.execute('UPDATE suggestions SET upvotes = (SELECT COUNT(*) FROM suggestion_votes WHERE message_id = ?1 AND vote = 1), downvotes = (SELECT COUNT(*) FROM suggestion_votes WHERE message_id = ?1 AND vote = -1) WHERE message_id = ?1;', [message_id])
+
+
+# Bridged chat in both directions, saved in batches and searchable with SQLite full-text search
+class ChatArchive:
+    # Rows deleted in each pruning step, so pruning never holds the database for long
+    prune_batch = 1000
+
+    def __init__(self, bot):
+        self.bot = bot
+        # Rows waiting to be written, in order
+        self.pending = []
+        self.flush_task = None
+        # Set once a batch fills up, cutting the wait before the next write short
+        self.flush_event = asyncio.Event()
+        self.written = 0
+        self.pruned = 0
+
+    # Queue a chat line for the archive, source is 'discord' or 'game'
+    def add(self, server_id: str, source: str, author: str, content: str, author_id: int = None):
+        if not self.bot.config_snapshot.get('chat_archive.enabled'):
+            return
+        self.pending.append((server_id, source, author or '', author_id, content, int(time.time())))
+        # Write right away once a batch fills up instead of waiting for the interval
+        if len(self.pending) >= self.bot.config_snapshot.get_int('chat_archive.batch_size'):
+            self.flush_event.set()
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.run_flush())
+
+    # Write pending lines until none are left, a full batch never interrupts a write that already started
+    async def run_flush(self):
+        while self.pending:
+            try:
+                await asyncio.wait_for(self.flush_event.wait(), self.bot.config_snapshot.get_float('chat_archive.flush_interval'))
+            except asyncio.TimeoutError:
+                pass
+            self.flush_event.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                log_exception('Chat', 'Error while archiving chat!', e)
+
+    # Write all pending rows in one transaction, a failed write goes back in front of newer rows for the next flush
+    async def flush(self):
+        if len(self.pending) == 0:
+            return
+        rows, self.pending = self.pending, []
+        try:
+            await self.bot.database.run(self._write, rows)
+        except BaseException:
+            self.pending[:0] = rows
+            raise
+        self.written += len(rows)
+
+    def _write(self, connection: sqlite3.Connection, rows: list[tuple]):
+        with connection:
+            connection.executemany('INSERT INTO chat_log (server, source, author, author_id, content, time) VALUES (?, ?, ?, ?, ?, ?);', rows)
+
+    # Find archived lines, newest first, optionally matching words, an author and a server, before a row ID
+    async def search(self, text: str = None, author: str = None, server_id: str = None, before: int = None, limit: int = 20) -> list[sqlite3.Row]:
+        await self.flush()
+        conditions, parameters = [], []
+        if text:
+            # Ordering by the full-text index's own row IDs lets it return the newest matches without sorting them all
+            table, row_id = 'chat_log_search JOIN chat_log ON chat_log.id = chat_log_search.rowid', 'chat_log_search.rowid'
+            conditions.append('chat_log_search MATCH ?')
+            parameters.append(self.format_query(text))
+        else:
+            table, row_id = 'chat_log', 'chat_log.id'
+        if author:
+            conditions.append('chat_log.author = ? COLLATE NOCASE')
+            parameters.append(author)
+        if server_id:
+            conditions.append('chat_log.server = ?')
+            parameters.append(server_id)
+        if before is not None:
+            conditions.append(row_id + ' < ?')
+            parameters.append(before)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return await self.bot.database.fetch_all('SELECT chat_log.* FROM {0}{1} ORDER BY {2} DESC LIMIT ?;'.format(table, where, row_id), parameters + [limit])
+
+    # Turn search words into an FTS5 query matching all of them, a trailing * matches words starting with the rest
+    def format_query(self, text: str) -> str:
+        terms = []
+        for word in text.split():
+            prefix = word.endswith('*') and len(word) > 1
+            word = word.rstrip('*')
+            if word:
+                terms.append('"{0}"{1}'.format(word.replace('"', '""'), '*' if prefix else ''))
+        return ' '.join(terms) or '""'
+
+    # Delete lines older than the retention period a batch at a time, letting other queries run in between
+    async def prune(self) -> int:
+        retention = self.bot.config_snapshot.get_float('chat_archive.retention_days')
+        # A retention of 0 keeps chat forever
+        if not retention:
+            return 0
+        cutoff = int(time.time() - retention * 24 * 60 * 60)
+        deleted = 0
+        while True:
+            count = await self.bot.database.execute('DELETE FROM chat_log WHERE id IN (SELECT id FROM chat_log WHERE time < ? ORDER BY id LIMIT ?);', [cutoff, self.prune_batch])
+            deleted += count
+            if count < self.prune_batch:
+                break
+            await asyncio.sleep(0)
+        self.pruned += deleted
+        if deleted > 0:
+            log_message('Chat', 'Pruned {0} archived chat lines'.format(deleted))
+        return deleted
+
+    async def run_prune(self):
+        while True:
+            try:
+                await self.prune()
+            except Exception as e:
+                log_exception('Chat', 'Error while pruning the chat archive!', e)
+            await asyncio.sleep(self.bot.config_snapshot.get_float('chat_archive.prune_interval'))
+
+
+# Bounded queue of raw UDP messages waiting to be dispatched
+class UDPIngestQueue:
+    # Message types where only the most recent message matters
+    coalesce_types = ('playerlist', 'playtimes')
+
+    def __init__(self, maxsize: int = 1024, policy: str = 'coalesce'):
+        if policy not in udp_queue_policies:
+            raise ValueError('Unknown UDP queue policy "{0}"'.format(policy))
+        self.maxsize = maxsize
+        self.policy = policy
+        # Queued messages as (message, reliable), reliable messages were acknowledged and are never dropped
+        self.messages = collections.deque()
+        self.ready = asyncio.Event()
+        # Counters for tuning the queue size and policy
+        self.received = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    # Add a message to the queue, returns False if a message had to be dropped
+    # Reliable messages have already been acknowledged, so they are queued even when the queue is full
+    def put(self, message: str, reliable: bool = False) -> bool:
+        self.received += 1
+        success = True
+        if len(self.messages) >= self.maxsize:
+            if self.policy == 'coalesce' and self._coalesce(message, reliable):
+                self.coalesced += 1
+                return True
+            if self.policy == 'drop_oldest' or self.policy == 'coalesce':
+                # Make room by discarding the oldest message that wasn't acknowledged
+                for i, (_, queued_reliable) in enumerate(self.messages):
+                    if not queued_reliable:
+                        del self.messages[i]
+                        self.dropped += 1
+                        success = False
+                        break
+            if success and not reliable:
+                # Nothing could be dropped to make room, so drop the new message
+                self.dropped += 1
+                return False
+        self.messages.append((message, reliable))
+        self.ready.set()
+        return success
+
+    # Replace a queued message of the same type from the same server, if that type can be coalesced
+    def _coalesce(self, message: str, reliable: bool) -> bool:
+        message_key = get_udp_message_key(message)
+        if message_key[1] in self.coalesce_types:
+            for i in range(len(self.messages) - 1, -1, -1):
+                if get_udp_message_key(self.messages[i][0]) == message_key:
+                    # Move the snapshot behind any deltas queued after the one it replaces, a newer snapshot supersedes an acknowledged one
+                    del self.messages[i]
+                    self.messages.append((message, reliable))
+                    return True
+        return False
+
+    # Wait for messages and remove up to the specified number of them from the queue
+    async def get_batch(self, limit: int) -> list[str]:
+        while not self.messages:
+            self.ready.clear()
+            await self.ready.wait()
+        batch = []
+        while self.messages and len(batch) < limit:
+            batch.append(self.messages.popleft()[0])
+        return batch
+
+
+# Receives datagrams from the game server directly on the bot's event loop
+class UDPBridgeProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    def datagram_received(self, data: bytes, addr):
+        self.bot.metrics.inc('craftbot_udp_packets_received_total')
+        self.bot.metrics.inc('craftbot_udp_bytes_received_total', len(data))
+        message = data.decode('utf-8', errors='replace')
+        # Acknowledge and unwrap sequenced frames before they are queued, they can't be dropped after that
+        reliable = get_udp_message_key(message)[1] in ['ack', udp_protocol_version, udp_legacy_protocol_version]
+        if reliable:
+            message = self.bot.unwrap_udp_frame(message)
+            if message is None:
+                return
+        # Only queue split messages once every chunk has arrived
+        if get_udp_message_key(message)[1] == 'chunk':
+            message = self.bot.reassemble_udp_chunk(message)
+            if message is None:
+                return
+        self.bot.udp_queue.put(message, reliable)
+
+    def error_received(self, exc: Exception):
+        log_exception('UDP', 'Error while handling UDP socket!', exc)
+
+    def connection_lost(self, exc: Exception):
+        if exc is not None:
+            log_exception('UDP', 'UDP socket closed unexpectedly!', exc)
+
+
+# A control message waiting in the outbox, its row ID doubles as its sequence number
+class OutboxMessage:
+
+    def __init__(self, sequence: int, message_type: str, message_content: str, created: float, attempts: int = 0):
+        self.sequence = sequence
+        self.type = message_type
+        self.content = message_content
+        self.created = created
+        self.attempts = attempts
+        self.acked = None
+
+
+# Durable queue of control messages for game servers, resent with backoff until they are acknowledged
+class UDPOutbox:
+    # Message types that must not be lost
+    message_types = ('register', 'unregister', 'register_batch', 'unregister_batch')
+    # Log a message that still hasn't been acknowledged after this many attempts
+    warn_attempts = 5
+
+    def __init__(self, bot):
+        self.bot = bot
+        # Sent in every sequenced frame, it stays the same across runs like the sequence numbers
+        self.epoch = None
+        # Unacknowledged messages per server, oldest first
+        self.queues = {}
+        self.tasks = {}
+        self.write_tasks = set()
+        # Stats for tuning the retransmit timeouts
+        self.delivered = 0
+        self.retransmits = 0
+        self.last_delivery_latency = 0.0
+        self.max_delivery_latency = 0.0
+        self.total_delivery_latency = 0.0
+
+    # Number of messages waiting to be acknowledged across all servers
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    # Load the messages that were still unacknowledged when the bot stopped and start resending them
+    async def load(self):
+        self.epoch = (await self.bot.database.fetch_one("SELECT value FROM bot_state WHERE key = 'udp_epoch';"))['value']
+        rows = await self.bot.database.fetch_all('SELECT id, server, type, content, created, attempts FROM udp_outbox ORDER BY id;')
+        for row in rows:
+            self.queues.setdefault(row['server'], []).append(OutboxMessage(row['id'], row['type'], row['content'], row['created'], row['attempts']))
+        for server_id in self.queues:
+            self.start(server_id)
+
+    # Queue a message for a server, it is saved before it is first sent
+    def put(self, server_id: str, message_type: str, message_content: str):
+        task = asyncio.create_task(self.enqueue(server_id, message_type, message_content))
+        self.write_tasks.add(task)
+        task.add_done_callback(self.write_tasks.discard)
+
+    async def enqueue(self, server_id: str, message_type: str, message_content: str):
+        created = time.time()
+        try:
+            sequence = await self.bot.database.run(self._insert, server_id, message_type, message_content, created)
+        except Exception as e:
+            log_exception('UDP', 'Failed to queue "{0}" message for server "{1}"!'.format(message_type, server_id), e)
+            return
+        bisect.insort(self.queues.setdefault(server_id, []), OutboxMessage(sequence, message_type, message_content, created), key=lambda message: message.sequence)
+        self.start(server_id)
+
+    def _insert(self, connection: sqlite3.Connection, server_id: str, message_type: str, message_content: str, created: float) -> int:
+        with connection:
+            return connection.execute('INSERT INTO udp_outbox (server, type, content, created) VALUES (?, ?, ?, ?);', [server_id, message_type, message_content, created]).lastrowid
+
+    def start(self, server_id: str):
+        task = self.tasks.get(server_id)
+        if task is None or task.done():
+            self.tasks[server_id] = asyncio.create_task(self.run(server_id))
+
+    # Mark a server's oldest message as delivered if the acknowledgement is for it
+    def ack(self, server_id: str, sequence: int):
+        queue = self.queues.get(server_id)
+        if queue and queue[0].sequence == sequence and queue[0].acked is not None and not queue[0].acked.done():
+            queue[0].acked.set_result(None)
+
+    # Deliver a server's messages one at a time, so a retransmitted message never overtakes a newer one
+    async def run(self, server_id: str):
+        queue = self.queues[server_id]
+        while queue:
+            message = queue[0]
+            try:
+                await self.deliver(server_id, message)
+            except Exception as e:
+                log_exception('UDP', 'Error while delivering "{0}" message to server "{1}"!'.format(message.type, server_id), e)
+                await asyncio.sleep(self.bot.config_snapshot.get_float('udp.retransmit_max_timeout'))
+                continue
+            queue.pop(0)
+            try:
+                await self.bot.database.execute('DELETE FROM udp_outbox WHERE id = ?;', [message.sequence])
+            except Exception as e:
+                log_exception('UDP', 'Failed to remove delivered message from the outbox!', e)
+
+    # Send a message until it is acknowledged, doubling the timeout after each attempt
+    async def deliver(self, server_id: str, message: OutboxMessage):
+        message.acked = self.bot.loop.create_future()
+        while True:
+            timeout = min(self.bot.config_snapshot.get_float('udp.retransmit_timeout') * 2 ** message.attempts, self.bot.config_snapshot.get_float('udp.retransmit_max_timeout'))
+            server = self.bot.get_server(server_id)
+            # Messages for a server removed from the config wait in case it comes back
+            if server is not None:
+                self.bot.send_udp_packet(server, server.encode_udp_message(message.type, message.content, message.sequence))
+                if message.attempts > 0:
+                    self.retransmits += 1
+                message.attempts += 1
+                if message.attempts == self.warn_attempts:
+                    log_message('UDP', 'Server "{0}" has not acknowledged message {1} after {2} attempts, still retrying'.format(server_id, message.sequence, message.attempts))
+            try:
+                await asyncio.wait_for(asyncio.shield(message.acked), timeout)
+                break
+            except asyncio.TimeoutError:
+                await self.bot.database.execute('UPDATE udp_outbox SET attempts = ? WHERE id = ?;', [message.attempts, message.sequence])
+        # Record the time from queueing to acknowledgement
+        self.delivered += 1
+        self.last_delivery_latency = time.time() - message.created
+        self.max_delivery_latency = max(self.max_delivery_latency, self.last_delivery_latency)
+        self.total_delivery_latency += self.last_delivery_latency
+        self.bot.metrics.observe('craftbot_udp_outbox_delivery_seconds', self.last_delivery_latency)
+
+    async def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
+        # Finish saving queued messages so they are resent after a restart
+        if self.write_tasks:
+            await asyncio.gather(*self.write_tasks, return_exceptions=True)
+
+
+# Keeps a server's player stats embed up to date while avoiding redundant edits
+class StatsPublisher:
+
+    def __init__(self, bot, server):
+        self.bot = bot
+        self.server = server
+        self.message = None
+        self.embed_hash = None
+        self.dirty = False
+        self.task = None
+        self.last_publish = 0.0
+
+    # Request an update of the stats embed, bursts of requests are merged into one edit
+    def request_update(self):
+        self.dirty = True
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while self.dirty:
+            # Wait out the remainder of the update window
+            interval = self.bot.config_snapshot.get_float('modules.stats.update_interval')
+            delay = self.last_publish + interval - self.bot.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.dirty = False
+            self.last_publish = self.bot.loop.time()
+            try:
+                await self.publish()
+            except Exception as e:
+                log_exception('Stats', 'Error while updating player stats message!', e)
+
+    # Render the stats embed and send or edit the stats message if the content changed
+    async def publish(self):
+        embed = self.server.generate_playerstats_embed()
+        # Hash everything except the timestamp, which changes on every render
+        embed_dict = embed.to_dict()
+        embed_dict.pop('timestamp', None)
+        embed_hash = hashlib.sha1(json.dumps(embed_dict, sort_keys=True).encode()).hexdigest()
+        if embed_hash == self.embed_hash:
+            return
+        # Locate channel of player list message
+        stats_channel_id = self.server.get_config_value('stats_channel_id')
+        if stats_channel_id is None:
+            # This server has no stats message
+            return
+        stats_channel = self.bot.guild.get_channel(stats_channel_id)
+        if stats_channel is None or type(stats_channel) != discord.TextChannel:
+            log_message('Stats', 'Could not find the player list text channel with ID {0} for server "{1}"!'.format(stats_channel_id, self.server.id))
+            return
+        # Locate player list message to edit, only fetching it once
+        if self.message is None:
+            stats_message_id = self.server.get_config_value('stats_message_id')
+            if stats_message_id is not None:
+                try:
+                    self.message = await stats_channel.fetch_message(stats_message_id)
+                except discord.NotFound:
+                    self.message = None
+        if self.message is not None:
+            try:
+                await self.message.edit(embed=embed)
+                self.embed_hash = embed_hash
+                return
+            except discord.NotFound:
+                self.message = None
+        # Message could not be found, so send a new one and remember it
+        self.message = await stats_channel.send(embed=embed)
+        self.embed_hash = embed_hash
+        self.server.set_config_value('stats_message_id', self.message.id)
+
+
+# Buffers chat lines bound for Discord and sends them in as few messages as possible
+class ChatRelay:
+    message_limit = 2000
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.buffers = {}
+        self.buffer_sizes = {}
+        self.wake_events = {}
+        self.tasks = {}
+        self.session = None
+        self.webhooks = {}
+        self.webhook_urls = {}
+        # Stats for tuning the flush window
+        self.flushes = 0
+        self.messages_sent = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    # Number of lines waiting to be sent across all channels
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(buffer) for buffer in self.buffers.values())
+
+    # Queue a line to be sent to a channel, optionally through the channel's webhook as the specified author
+    def queue(self, channel: discord.TextChannel, line: str, author: str = None, webhook_url: str = None):
+        if webhook_url is not None:
+            self.webhook_urls[channel.id] = webhook_url
+        buffer = self.buffers.setdefault(channel.id, collections.deque())
+        line = line[:self.message_limit]
+        buffer.append((self.bot.loop.time(), author, line))
+        self.buffer_sizes[channel.id] = self.buffer_sizes.get(channel.id, 0) + len(line) + 1
+        wake_event = self.wake_events.setdefault(channel.id, asyncio.Event())
+        # Flush early once there is enough text for a full message
+        if self.buffer_sizes[channel.id] >= self.message_limit:
+            wake_event.set()
+        task = self.tasks.get(channel.id)
+        if task is None or task.done():
+            self.tasks[channel.id] = asyncio.create_task(self.run(channel))
+
+    async def run(self, channel: discord.TextChannel):
+        buffer = self.buffers[channel.id]
+        wake_event = self.wake_events[channel.id]
+        # Lines that arrive while a flush is waiting for the channel's rate limit are picked up by the next flush
+        while buffer:
+            try:
+                await asyncio.wait_for(wake_event.wait(), self.bot.config_snapshot.get_float('modules.chat.flush_interval'))
+            except asyncio.TimeoutError:
+                pass
+            wake_event.clear()
+            try:
+                await self.flush(channel)
+            except Exception as e:
+                log_exception('Chat', 'Error while sending chat messages!', e)
+
+    # Send all buffered lines for a channel, lines not sent because of an error go back to the front of the buffer
+    # Each message waits for the channel's message bucket, so bursts of early flushes are paced instead of running into 429s
+    async def flush(self, channel: discord.TextChannel):
+        buffer = self.buffers[channel.id]
+        lines = list(buffer)
+        buffer.clear()
+        self.buffer_sizes[channel.id] = 0
+        if not lines:
+            return
+        sent = 0
+        try:
+            for author, content, count in self.pack(lines):
+                try:
+                    if author is not None:
+                        webhook = await self.get_webhook(self.webhook_urls[channel.id])
+                        await self.bot.call_scheduler.call('message', channel.id, webhook.send, content=content, username=author)
+                    else:
+                        await self.bot.call_scheduler.call('message', channel.id, channel.send, content)
+                except discord.HTTPException as e:
+                    # Discord would reject the same message again, so only retry server errors
+                    if e.status < 500:
+                        sent += count
+                    raise
+                sent += count
+                self.messages_sent += 1
+        finally:
+            unsent = lines[sent:]
+            buffer.extendleft(reversed(unsent))
+            self.buffer_sizes[channel.id] += sum(len(line) + 1 for _, _, line in unsent)
+        # Record the time the oldest line spent waiting
+        self.flushes += 1
+        self.last_flush_latency = self.bot.loop.time() - lines[0][0]
+        self.max_flush_latency = max(self.max_flush_latency, self.last_flush_latency)
+
+    # Join consecutive lines from the same sender into messages that fit under the length limit, with the number of lines in each
+    def pack(self, lines: list[tuple]) -> list[tuple[str, str, int]]:
+        messages = []
+        for _, author, line in lines:
+            if messages and messages[-1][0] == author and len(messages[-1][1]) + len(line) + 1 <= self.message_limit:
+                messages[-1][1] += '\n' + line
+                messages[-1][2] += 1
+            else:
+                messages.append([author, line, 1])
+        return [tuple(message) for message in messages]
+
+    async def get_webhook(self, webhook_url: str) -> discord.Webhook:
+        webhook = self.webhooks.get(webhook_url)
+        if webhook is None:
+            if self.session is None:
+                self.session = aiohttp.ClientSession()
+            webhook = self.webhooks[webhook_url] = discord.Webhook.from_url(webhook_url, session=self.session)
+        return webhook
+
+    async def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+            self.webhooks.clear()
+
+
+# Routes guild messages to the handler registered for their channel
+class MessageRouter:
+    # Handlers taking longer than this many seconds are logged
+    slow_threshold = 1.0
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.routes = {}
+        self.index = {}
+        # Per-handler call count, total time and maximum time
+        self.timings = {}
+
+    # Register a handler for messages in the channel whose ID is stored under the specified config key
+    def register(self, config_key: str, handler, allow_bots: bool = False):
+        self.routes[config_key] = (handler, allow_bots)
+        self.rebuild()
+
+    def unregister(self, config_key: str):
+        self.routes.pop(config_key, None)
+        self.rebuild()
+
+    # Recompute the channel ID index from the current config
+    def rebuild(self):
+        index = {}
+        for config_key, route in self.routes.items():
+            channel_id = self.bot.get_config_value(config_key)
+            if channel_id is not None:
+                index[channel_id] = route
+        self.index = index
+
+    # Pass a message to its channel's handler, returns whether a handler was run
+    async def dispatch(self, message: discord.Message) -> bool:
+        route = self.index.get(message.channel.id)
+        if route is None:
+            return False
+        handler, allow_bots = route
+        # Prevent bot from replying to itself, and other bots unless the handler allows it
+        if message.author == self.bot.user or (message.author.bot and not allow_bots):
+            return False
+        start = time.perf_counter()
+        try:
+            await handler(message)
+        finally:
+            elapsed = time.perf_counter() - start
+            timing = self.timings.setdefault(handler.__qualname__, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+            self.bot.metrics.observe('craftbot_message_handler_seconds', elapsed, (('handler', handler.__qualname__),))
+            if elapsed > self.slow_threshold:
+                log_message('Router', 'Handler {0} took {1:.3f}s'.format(handler.__qualname__, elapsed))
+        return True
+
+
+# Paces the calls made to one Discord route, never starting more than the limit within any window of the given length
+# Discord counts its limits in fixed windows, which a continuously refilling token bucket can overrun right after a burst
+class RateLimitBucket:
+
+    def __init__(self, limit: int, per: float):
+        self.limit = limit
+        self.per = per
+        # When each of the most recent calls started, oldest first
+        self.calls = collections.deque()
+
+    # Wait until a call can be made without exceeding the limit
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            while self.calls and now - self.calls[0] >= self.per:
+                self.calls.popleft()
+            if len(self.calls) < self.limit:
+                self.calls.append(now)
+                return
+            await asyncio.sleep(self.calls[0] + self.per - now)
+
+    # Whether the bucket is back to its starting state, so dropping it changes nothing
+    @property
+    def idle(self) -> bool:
+        return len(self.calls) == 0 or time.monotonic() - self.calls[-1] >= self.per
+
+
+# Runs the Discord calls for busy channels with bounded concurrency, per-route pacing and retries
+class DiscordCallScheduler:
+    # Calls allowed per route and channel, as (calls, seconds), kept under Discord's limits
+    # These are fixed estimates rather than Discord's live X-RateLimit-* bucket state, which PyCord reads and waits on itself,
+    # they only spread bursts out so calls don't pile up behind PyCord's bucket locks and 429 retries
+    route_limits = {'message': (5, 5.0), 'reaction': (1, 0.25), 'thread': (5, 10.0)}
+    # Workflows run at once for each channel
+    channel_concurrency = 4
+    # Attempts at each call before giving up on transient errors
+    attempts = 3
+    transient_errors = (discord.DiscordServerError, aiohttp.ClientError, asyncio.TimeoutError)
+    # Routes safe to call again after a failure that may still have gone through, a second thread or message would be a duplicate
+    retry_routes = ('reaction',)
+    # Seconds between sweeps for idle buckets, most channels and threads are only called a few times
+    prune_interval = 60.0
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.buckets = {}
+        self.pruned_at = time.monotonic()
+        # Semaphores of channels with workflows running or waiting, and how many there are
+        self.semaphores = {}
+        self.workflow_counts = {}
+
+    # Run a workflow for a channel, waiting while the channel already has too many running
+    # The workflow is only called once it gets a slot, so nothing is left unawaited if the wait is cancelled
+    async def run(self, channel_id: int, workflow, *args, **kwargs):
+        semaphore = self.semaphores.get(channel_id)
+        if semaphore is None:
+            semaphore = self.semaphores[channel_id] = asyncio.Semaphore(self.channel_concurrency)
+        self.workflow_counts[channel_id] = self.workflow_counts.get(channel_id, 0) + 1
+        try:
+            async with semaphore:
+                return await workflow(*args, **kwargs)
+        finally:
+            # Forget the semaphore once the channel's last workflow is done
+            self.workflow_counts[channel_id] -= 1
+            if self.workflow_counts[channel_id] == 0:
+                del self.workflow_counts[channel_id]
+                del self.semaphores[channel_id]
+
+    # Get the bucket of a route and channel, dropping idle buckets every so often
+    def get_bucket(self, route: str, channel_id: int) -> RateLimitBucket:
+        key = (route, channel_id)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            now = time.monotonic()
+            if now - self.pruned_at >= self.prune_interval:
+                self.pruned_at = now
+                self.buckets = {bucket_key: existing for bucket_key, existing in self.buckets.items() if not existing.idle}
+            bucket = self.buckets[key] = RateLimitBucket(*self.route_limits[route])
+        return bucket
+
+    # Make a call once its route's bucket allows it, retrying transient failures of idempotent routes with backoff
+    async def call(self, route: str, channel_id: int, function, *args, **kwargs):
+        for attempt in range(self.attempts):
+            start = time.perf_counter()
+            # Looked up on every attempt, as the bucket may have been dropped while idle during the backoff
+            await self.get_bucket(route, channel_id).acquire()
+            self.bot.metrics.observe('craftbot_discord_schedule_wait_seconds', time.perf_counter() - start, (('route', route),))
+            try:
+                return await function(*args, **kwargs)
+            except self.transient_errors as e:
+                if route not in self.retry_routes or attempt + 1 == self.attempts:
+                    raise
+                self.bot.metrics.inc('craftbot_discord_call_retries_total', labels=(('route', route),))
+                log_message('Scheduler', 'Retrying {0} call after {1}: {2}'.format(route, type(e).__name__, e), logging.WARNING)
+                await asyncio.sleep(2 ** attempt)
+
+
+# Button-navigable embed pages of database rows, each page fetched after the cursor column of the previous one instead of by offset
+class KeysetPages(discord.ui.View):
+
+    def __init__(self, title: str, fetch_page, format_rows, author_id: int, cursor_column: str = 'rowid', first_cursor=0, page_size: int = 20):
+        super().__init__(timeout=300)
+        self.title = title
+        # Called with the cursor a page starts from and the number of rows to fetch
+        self.fetch_page = fetch_page
+        # Called with a page of rows, returns a line of the embed for each
+        self.format_rows = format_rows
+        self.author_id = author_id
+        self.cursor_column = cursor_column
+        self.page_size = page_size
+        # The cursor each visited page starts from
+        self.page_starts = [first_cursor]
+        self.page = 0
+
+    # Build the embed for the current page, returns None if there are no rows
+    async def render(self) -> discord.Embed:
+        # Fetch one extra row to find out whether there is a next page
+        rows = await self.fetch_page(self.page_starts[self.page], self.page_size + 1)
+        has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if len(rows) == 0:
+            return None
+        if has_next and len(self.page_starts) == self.page + 1:
+            self.page_starts.append(rows[-1][self.cursor_column])
+        lines = await self.format_rows(rows)
+        embed = discord.Embed(title=self.title, description='\n'.join(lines), colour=discord.Colour.from_rgb(255, 170, 0))
+        embed.set_footer(text='Page {0}'.format(self.page + 1))
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = not has_next
+        return embed
+
+    # Only the command sender can change pages
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return interaction.user is not None and interaction.user.id == self.author_id
+
+    @discord.ui.button(label='Previous', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, button: discord.ui.Button, interaction: discord.Interaction):
+        self.page = max(self.page - 1, 0)
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+    @discord.ui.button(label='Next', style=discord.ButtonStyle.secondary)
+    async def next_page(self, button: discord.ui.Button, interaction: discord.Interaction):
+        self.page = min(self.page + 1, len(self.page_starts) - 1)
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+
+# One authenticated RCON connection, with any number of commands in flight at once
+class RCONConnection:
+    # Packet types of the Source RCON protocol Minecraft speaks
+    type_response = 0
+    type_command = 2
+    type_login = 3
+    # Servers reply to unknown types in order, so one sent after each command marks the end of its reply
+    type_marker = 100
+    # Largest packet a server sends, replies longer than this are split
+    max_packet_size = 4096 + 12
+
+    def __init__(self, address: str, port: int, password: str):
+        self.address = address
+        self.port = port
+        self.password = password
+        self.reader = None
+        self.writer = None
+        self.read_task = None
+        self.closed = False
+        self.request_ids = itertools.count(1)
+        # Waiting commands by request ID, as (future, reply fragments), and the command each marker ends
+        self.pending = {}
+        self.markers = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.pending)
+
+    # Open the connection and log in, raises PermissionError if the password is rejected
+    async def connect(self, timeout: float):
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.address, self.port), timeout)
+        self.read_task = asyncio.create_task(self.run_reader())
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = (future, None)
+        self.send_packet(request_id, self.type_login, self.password)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException:
+            self.close()
+            raise
+        finally:
+            self.pending.pop(request_id, None)
+
+    def send_packet(self, request_id: int, packet_type: int, payload: str):
+        data = struct.pack('<ii', request_id, packet_type) + payload.encode('utf-8') + b'\0\0'
+        self.writer.write(struct.pack('<i', len(data)) + data)
+
+    # Run a command without waiting for earlier ones to finish, returns the server's reply
+    async def command(self, command: str, timeout: float) -> str:
+        if self.closed:
+            raise ConnectionError('RCON connection to {0}:{1} is closed'.format(self.address, self.port))
+        request_id, marker_id = next(self.request_ids), next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = (future, [])
+        self.markers[marker_id] = request_id
+        self.send_packet(request_id, self.type_command, command)
+        self.send_packet(marker_id, self.type_marker, '')
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(request_id, None)
+            self.markers.pop(marker_id, None)
+
+    # Match replies to waiting commands until the connection drops
+    async def run_reader(self):
+        error = ConnectionError('RCON connection to {0}:{1} was closed'.format(self.address, self.port))
+        try:
+            while True:
+                length, = struct.unpack('<i', await self.reader.readexactly(4))
+                if not 10 <= length <= self.max_packet_size:
+                    raise ConnectionError('Invalid RCON packet length {0}'.format(length))
+                data = await self.reader.readexactly(length)
+                request_id, packet_type = struct.unpack('<ii', data[:8])
+                payload = data[8:-2].decode('utf-8', errors='replace')
+                if request_id == -1:
+                    # Failed logins are answered with ID -1
+                    error = PermissionError('RCON password for {0}:{1} was rejected'.format(self.address, self.port))
+                    break
+                if request_id in self.markers:
+                    future, fragments = self.pending.pop(self.markers.pop(request_id), (None, None))
+                    if future is not None and not future.done():
+                        future.set_result(''.join(fragments))
+                elif request_id in self.pending:
+                    future, fragments = self.pending[request_id]
+                    if fragments is None:
+                        if not future.done():
+                            future.set_result(payload)
+                    else:
+                        fragments.append(payload)
+        except (asyncio.IncompleteReadError, OSError, ConnectionError) as e:
+            if isinstance(e, ConnectionError):
+                error = e
+        finally:
+            self.closed = True
+            for future, _ in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.pending.clear()
+            self.markers.clear()
+            if self.writer is not None:
+                self.writer.close()
+
+    def close(self):
+        self.closed = True
+        if self.read_task is not None:
+            self.read_task.cancel()
+        elif self.writer is not None:
+            self.writer.close()
+
+
+# A few RCON connections to one game server, reconnected with backoff and shared by every command
+class RCONPool:
+    # Longest wait between reconnect attempts in seconds
+    max_backoff = 30.0
+
+    def __init__(self, address: str, port: int, password: str, size: int = 2, timeout: float = 5.0, metrics: Metrics = None):
+        self.address = address
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self.metrics = metrics
+        self.connections = [None] * max(size, 1)
+        self.locks = [asyncio.Lock() for _ in self.connections]
+        # Consecutive failed connection attempts and when the next may start
+        self.failures = 0
+        self.retry_at = 0.0
+        self.fill_task = None
+
+    # Get the open connection with the fewest commands in flight, only connecting first if none is open
+    async def get_connection(self) -> RCONConnection:
+        open_connections = [connection for connection in self.connections if connection is not None and not connection.closed]
+        if len(open_connections) == 0:
+            return await self.connect(0)
+        # Open the rest of the pool in the background, commands never wait on it
+        if len(open_connections) < len(self.connections) and (self.fill_task is None or self.fill_task.done()) and time.monotonic() >= self.retry_at:
+            self.fill_task = asyncio.create_task(self.fill())
+        return min(open_connections, key=lambda connection: connection.in_flight)
+
+    # Open the connection in a slot unless it already is, with backoff after failed attempts
+    async def connect(self, index: int) -> RCONConnection:
+        async with self.locks[index]:
+            connection = self.connections[index]
+            if connection is not None and not connection.closed:
+                return connection
+            # Fail fast rather than piling up reconnects to a server that is down
+            wait = self.retry_at - time.monotonic()
+            if wait > 0:
+                raise ConnectionError('RCON server at {0}:{1} is unreachable, retrying in {2:.1f}s'.format(self.address, self.port, wait))
+            connection = RCONConnection(self.address, self.port, self.password)
+            try:
+                await connection.connect(self.timeout)
+            except Exception:
+                self.failures += 1
+                self.retry_at = time.monotonic() + min(2 ** (self.failures - 1), self.max_backoff)
+                raise
+            self.failures = 0
+            self.connections[index] = connection
+            return connection
+
+    async def fill(self):
+        for index, connection in enumerate(self.connections):
+            if connection is None or connection.closed:
+                try:
+                    await self.connect(index)
+                except Exception as e:
+                    log_message('RCON', 'Could not open another connection to {0}:{1}: {2}'.format(self.address, self.port, e), logging.DEBUG)
+                    return
+
+    # Run a command on the pool, returns the server's reply
+    async def command(self, command: str, timeout: float = None) -> str:
+        start = time.perf_counter()
+        try:
+            connection = await self.get_connection()
+            return await connection.command(command, self.timeout if timeout is None else timeout)
+        except Exception:
+            if self.metrics is not None:
+                self.metrics.inc('craftbot_rcon_errors_total')
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe('craftbot_rcon_command_seconds', time.perf_counter() - start)
+
+    # Send commands all at once so their replies come back in one round, returns each reply or the error it failed with
+    async def pipeline(self, commands: list[str], timeout: float = None) -> list:
+        return list(await asyncio.gather(*[self.command(command, timeout) for command in commands], return_exceptions=True))
+
+    def close(self):
+        if self.fill_task is not None:
+            self.fill_task.cancel()
+        for connection in self.connections:
+            if connection is not None:
+                connection.close()
+        self.connections = [None] * len(self.connections)
+
+
+# A game server bridged to the bot, with its own endpoint, secret, channels and stats
+class GameServer:
+    # Where each server setting lives when the config has no servers section
+    legacy_keys = {
+        'address': 'udp.sendto_address',
+        'port': 'udp.sendto_port',
+        'chat_channel_id': 'modules.chat.channel_id',
+        'webhook_url': 'modules.chat.webhook_url',
+        'stats_channel_id': 'modules.stats.channel_id',
+        'stats_message_id': 'modules.stats.message_id',
+        'reliable': 'udp.reliable',
+        'transport': 'transport',
+        'rcon_port': 'rcon.port',
+        'rcon_password': 'rcon.password',
+        'rcon_pool_size': 'rcon.pool_size',
+        'rcon_timeout': 'rcon.timeout',
+    }
+    # Whitelist commands run over RCON, by action and account type, Bedrock accounts go through Floodgate
+    rcon_whitelist_commands = {
+        ('register', 'java'): 'whitelist add {0}',
+        ('register', 'bedrock'): 'fwhitelist add {0}',
+        ('unregister', 'java'): 'whitelist remove {0}',
+        ('unregister', 'bedrock'): 'fwhitelist remove {0}',
+    }
+    # Prefix Floodgate gives Bedrock usernames in the whitelist
+    bedrock_prefix = '.'
+    # Most sequence numbers remembered for deduplication
+    dedup_limit = 4096
+    # Most chunks in one split message, and most split messages assembled at once
+    chunk_limit = 64
+
+    def __init__(self, bot, server_id: str, legacy: bool = False):
+        self.bot = bot
+        self.id = server_id
+        self.legacy = legacy
         # Cached embed data
         self.embed_data = {}
         self.message_cache = {}
-        # Cogs
-        self.cog_names = ['cogs.control', 'cogs.thread', 'cogs.registration']
+        self.stat_parsers = {'playerlist': self.parse_playerlist, 'playtimes': self.parse_playtimes}
+        # Parsers of changes since the last message, by message type and the stat they update
+        self.delta_parsers = {'playerlist_delta': ('playerlist', self.parse_playerlist_delta), 'playtimes_delta': ('playtimes', self.parse_playtimes_delta)}
+        # Online players in the order the server listed them
+        self.players = {}
+        self.stats_publisher = StatsPublisher(bot, self)
+        self.playtime_store = PlaytimeStore(bot, self)
+        self.presence_tracker = PresenceTracker(bot, self)
+        # Recently received sequence numbers and when they arrived
+        self.received_sequences = collections.OrderedDict()
+        # Chunks of split messages by message ID, as (first arrival, chunks)
+        self.chunks = {}
+        # RCON connections and the settings they were opened with
+        self.rcon_pool = None
+        self.rcon_settings = None
+
+    # Get the full config key of a server setting
+    def config_key(self, key: str) -> str:
+        if self.legacy:
+            return self.legacy_keys.get(key)
+        return 'servers.{0}.{1}'.format(self.id, key)
+
+    def get_config_value(self, key: str):
+        config_key = self.config_key(key)
+        return self.bot.get_config_value(config_key) if config_key is not None else None
+
+    def set_config_value(self, key: str, value) -> bool:
+        config_key = self.config_key(key)
+        return self.bot.set_config_value(config_key, value) if config_key is not None else False
+
+    @property
+    def name(self) -> str:
+        return self.get_config_value('name') or self.id
+
+    # Format an embed title, naming the server when there is more than one
+    def format_title(self, title: str) -> str:
+        return '**{0}**'.format(title) if self.legacy else '**{0} {1}**'.format(self.name, title)
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return (self.get_config_value('address'), self.get_config_value('port'))
+
+    # RCON connections to this server, or None if it uses the UDP bridge, reopened when its settings change
+    @property
+    def rcon(self) -> RCONPool:
+        settings = None
+        if self.get_config_value('transport') == 'rcon':
+            settings = (self.get_config_value('address'), self.get_config_value('rcon_port'), self.get_config_value('rcon_password'),
+                self.get_config_value('rcon_pool_size'), self.get_config_value('rcon_timeout'))
+        if settings != self.rcon_settings:
+            self.close_rcon()
+            if settings is not None:
+                self.rcon_pool = RCONPool(*settings, metrics=self.bot.metrics)
+            self.rcon_settings = settings
+        return self.rcon_pool
+
+    def close_rcon(self):
+        if self.rcon_pool is not None:
+            self.rcon_pool.close()
+            self.rcon_pool = None
+        self.rcon_settings = None
+
+    # Add or remove 'type username' whitelist entries, returns each RCON reply or error, or None over UDP where nothing replies
+    async def update_whitelist(self, action: str, entries: list[str]) -> list:
+        rcon = self.rcon
+        if rcon is None:
+            if len(entries) == 1:
+                self.bot.send_udp_message(action, entries[0], self.id)
+            elif len(entries) > 1:
+                self.bot.send_udp_batch(action + '_batch', entries, self.id)
+            return None
+        commands = []
+        for entry in entries:
+            account_type, username = entry.split(' ', 1)
+            commands.append(self.rcon_whitelist_commands[(action, account_type)].format(username))
+        return await rcon.pipeline(commands)
+
+    # Get the server's whitelist as comma-separated 'type username' entries, raises asyncio.TimeoutError if it doesn't answer
+    async def fetch_whitelist(self) -> str:
+        rcon = self.rcon
+        if rcon is None:
+            self.bot.send_udp_message('whitelist_request', '', self.id)
+            return await self.bot.wait_for_udp_message(self.id, 'whitelist')
+        # Replies look like 'There are 2 whitelisted player(s): Steve, .Alex'
+        _, _, names = (await rcon.command('whitelist list')).partition(':')
+        entries = []
+        for name in names.split(','):
+            name = name.strip()
+            if name.startswith(self.bedrock_prefix):
+                entries.append('bedrock ' + name[len(self.bedrock_prefix):])
+            elif name:
+                entries.append('java ' + name)
+        return ','.join(entries)
+
+    # Checks the secret a packet was sent with
+    def check_secret(self, secret: str) -> bool:
+        expected = self.get_config_value('secret')
+        return expected is None or hmac.compare_digest(secret.encode(), expected.encode())
+
+    # Encode a packet for this server, prefixed with its secret if it has one and framed with the bot's epoch and a sequence number if given
+    def encode_udp_message(self, message_type: str, message_content: str, sequence: int = None) -> bytes:
+        fields = [message_type, message_content]
+        if sequence is not None:
+            fields[0:0] = [udp_protocol_version, self.bot.udp_outbox.epoch, str(sequence)]
+        secret = self.get_config_value('secret')
+        if secret is not None:
+            fields.insert(0, secret)
+        return '\0'.join(fields).encode(errors='replace')
+
+    # Remember a sequence number received from this server, returns False if it was already received recently
+    # Sequence numbers restart when the game server does, so they are only compared within the epoch it sent them with
+    def check_sequence(self, epoch: str, sequence: int) -> bool:
+        now = time.monotonic()
+        expired = now - self.bot.config_snapshot.get_float('udp.dedup_window')
+        # Forget the oldest sequence numbers once they expire or there are too many
+        while self.received_sequences:
+            received = next(iter(self.received_sequences.values()))
+            if received > expired and len(self.received_sequences) < self.dedup_limit:
+                break
+            self.received_sequences.popitem(last=False)
+        if (epoch, sequence) in self.received_sequences:
+            return False
+        self.received_sequences[(epoch, sequence)] = now
+        return True
+
+    # Store one chunk of a split message, returns the whole message once every chunk has arrived
+    def add_chunk(self, chunk_id: str, index: int, count: int, payload: str) -> str:
+        now = time.monotonic()
+        # Give up on messages whose chunks stopped arriving
+        expired = now - self.bot.config_snapshot.get_float('udp.chunk_timeout')
+        for expired_id in [key for key, (received, _) in self.chunks.items() if received < expired]:
+            del self.chunks[expired_id]
+        if not 0 < count <= self.chunk_limit or not 0 <= index < count:
+            raise ValueError('Invalid chunk {0} of {1}'.format(index, count))
+        if chunk_id not in self.chunks and len(self.chunks) >= self.chunk_limit:
+            del self.chunks[next(iter(self.chunks))]
+        _, parts = self.chunks.setdefault(chunk_id, (now, [None] * count))
+        if len(parts) != count:
+            raise ValueError('Chunk count of message "{0}" changed from {1} to {2}'.format(chunk_id, len(parts), count))
+        parts[index] = payload
+        if None in parts:
+            return None
+        del self.chunks[chunk_id]
+        return ''.join(parts)
+
+    async def load(self):
+        await self.playtime_store.load()
+        await self.presence_tracker.load()
+
+    async def flush(self):
+        self.close_rcon()
+        await self.playtime_store.flush()
+        await self.presence_tracker.flush()
+
+    # Chat forwarding channel
+    async def on_chat_message(self, message: discord.Message):
+        # Forward message to in-game chat
+        self.bot.send_udp_message('chat', '{0.name}#{0.discriminator} {1}'.format(message.author, message.clean_content), self.id)
+        self.bot.chat_archive.add(self.id, 'discord', message.author.name, message.clean_content, message.author.id)
+
+    def generate_playerstats_embed(self) -> discord.Embed:
+        embed = discord.Embed(title=self.format_title('Player Stats'), colour=discord.Colour.from_rgb(255, 170, 0), timestamp=date.datetime.now(tz=date.timezone.utc))
+        for field_type, parser in self.stat_parsers.items():
+            field = self.embed_data.get(field_type)
+            if field is None:
+                field = parser(self.message_cache.get(field_type, ''))
+            field_name, field_content = field
+            embed.add_field(name=field_name, value=field_content, inline=False)
+        return embed
+
+    def parse_playerlist(self, message: str) -> tuple[str, str]:
+        self.players = dict.fromkeys(message.split(',') if message is not None and len(message) > 0 else [])
+        return self.format_playerlist()
+
+    # Apply players joining (+name) and leaving (-name) since the last player list
+    def parse_playerlist_delta(self, message: str) -> tuple[str, str]:
+        joined = []
+        left = []
+        for item in message.split(','):
+            if item.startswith('+'):
+                joined.append(item[1:])
+            elif item.startswith('-'):
+                left.append(item[1:])
+        for username in left:
+            self.players.pop(username, None)
+        self.players.update(dict.fromkeys(joined))
+        self.presence_tracker.apply(joined, left)
+        return self.format_playerlist()
+
+    def format_playerlist(self) -> tuple[str, str]:
+        playerlist = list(self.players) if len(self.players) > 0 else ['No players online']
+        return ('**Currently Online**', '\n'.join(['```'] + playerlist + ['```']))
+
+    def parse_playtimes(self, message: str, count=10) -> tuple[str, str]:
+        if message is not None and len(message) > 0:
+            entries = {}
+            for item in message.split(','):
+                username, playtime = item.split(' ', 1)
+                entries[username] = int(playtime)
+            self.playtime_store.update(entries)
+        return ('**Playtime Rankings**', self.bot.format_playtimes(self.playtime_store.get_top(count), count))
+
+    # Apply playtime gained since the last report, as 'username milliseconds' entries
+    def parse_playtimes_delta(self, message: str, count=10) -> tuple[str, str]:
+        increments = {}
+        for item in message.split(','):
+            if ' ' in item:
+                username, increment = item.split(' ', 1)
+                increments[username] = increments.get(username, 0) + int(increment)
+        self.playtime_store.add(increments)
+        return ('**Playtime Rankings**', self.bot.format_playtimes(self.playtime_store.get_top(count), count))
+
+
+# Type field marking a sequenced frame, which carries the sender's epoch and a sequence number before the real type
+udp_protocol_version = 'v2'
+# Older sequenced frames without an epoch, still accepted from game servers
+udp_legacy_protocol_version = 'v1'
+
+# Folder the bot's cogs are loaded from
+cogs_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cogs')
+
+# Reads the server and type fields of a raw UDP message
+def get_udp_message_key(message: str) -> tuple[str, str]:
+    message_split = message.split('\0', 2)
+    return (message_split[0], message_split[1] if len(message_split) > 1 else None)
+
+
+
+# Our custom bot implementation :)
+class CraftBot(discord.Bot):
+
+    def __init__(self):
+        init_start = time.perf_counter()
+        # Start logging before anything can log
+        self.log_pipeline = LogPipeline()
         # Load environment variables
         dotenv.load_dotenv()
+        # Member events are needed to keep cached identities fresh, this privileged intent must be enabled for the bot in the Developer Portal
+        intents = discord.Intents.default()
+        intents.members = True
+        # Commands are registered in the bot's guild, so cogs don't need to know its ID
+        self.guild_id = int(os.environ['CRAFTBOT_GUILD_ID'])
+        super().__init__(intents=intents, debug_guilds=[self.guild_id])
+        # Game servers by ID
+        self.servers = {}
+        self.chat_relay = ChatRelay(self)
+        self.chat_archive = ChatArchive(self)
+        self.chat_archive_task = None
+        self.message_router = MessageRouter(self)
+        self.call_scheduler = DiscordCallScheduler(self)
+        self.suggestion_index = SuggestionIndex(self)
+        self.suggestion_backfill_task = None
+        self.identity_cache = IdentityCache()
+        self.metrics = Metrics()
+        self.metrics_server = None
+        self.start_time = time.time()
+        # Seconds taken by each startup phase, by phase name
+        self.startup_times = {}
+        self.init_metrics()
+        # UDP bridge state
+        self.guild = None
+        self.udp_transport = None
+        self.udp_queue = None
+        self.udp_task = None
+        self.udp_waiters = {}
+        self.udp_outbox = UDPOutbox(self)
+        # Config file state
+        self.config_stat = None
+        self.config_task = None
+        self.config_save_task = None
+        self.config_save_pending = False
+        # Cogs found in the cogs folder, and the hash of each loaded cog's source
+        self.cog_names = self.discover_cogs()
+        self.cog_hashes = {}
+        # Connect to and migrate the SQLite database on another thread while the config and cogs load, neither needs it
+        startup_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='startup')
+        sqlite_future = startup_executor.submit(self.time_startup_phase, 'database', self.init_sqlite, 'data.db')
+        startup_executor.shutdown(wait=False)
         # Load bot configuration file
-        if self.init_config('config.json'):
-            # Connect to SQLite database
-            if self.init_sqlite('data.db'):
-                # Load cogs
-                self.init_cogs()
-                # Start UDP server thread
-                threading.Thread(target=self.run_udp, args=(self.get_config_value('udp.listen_address'), int(self.get_config_value('udp.listen_port')))).start()
-            else:
-                raise Exception('Failed to initialize bot!')
-        else:
+        config_loaded = self.time_startup_phase('config', self.init_config, 'config.json')
+        if config_loaded:
+            # Route messages from the built-in module channels
+            self.message_router.register('modules.help.channel_id', self.on_help_message)
+            self.message_router.register('modules.suggestions.channel_id', self.on_suggestion_message)
+            # Load cogs
+            self.time_startup_phase('cogs', self.init_cogs)
+        if not sqlite_future.result() or not config_loaded:
             raise Exception('Failed to initialize bot!')
+        self.startup_times['init'] = time.perf_counter() - init_start
+
+    # Sample the counters other objects keep and time every Discord REST request
+    def init_metrics(self):
+        self.metrics.collect('craftbot_udp_queue_depth', lambda: len(self.udp_queue) if self.udp_queue is not None else None)
+        self.metrics.collect('craftbot_udp_queue_dropped_total', lambda: self.udp_queue.dropped if self.udp_queue is not None else None)
+        self.metrics.collect('craftbot_udp_queue_coalesced_total', lambda: self.udp_queue.coalesced if self.udp_queue is not None else None)
+        self.metrics.collect('craftbot_udp_outbox_depth', lambda: self.udp_outbox.queue_depth)
+        self.metrics.collect('craftbot_udp_outbox_delivered_total', lambda: self.udp_outbox.delivered)
+        self.metrics.collect('craftbot_udp_outbox_retransmits_total', lambda: self.udp_outbox.retransmits)
+        self.metrics.collect('craftbot_discord_gateway_latency_seconds', lambda: self.latency if math.isfinite(self.latency) else None)
+        self.metrics.collect('craftbot_chat_queue_depth', lambda: self.chat_relay.queue_depth)
+        self.metrics.collect('craftbot_chat_messages_sent_total', lambda: self.chat_relay.messages_sent)
+        self.metrics.collect('craftbot_chat_flush_latency_seconds', lambda: self.chat_relay.last_flush_latency)
+        self.metrics.collect('craftbot_chat_archive_pending', lambda: len(self.chat_archive.pending))
+        self.metrics.collect('craftbot_chat_archive_written_total', lambda: self.chat_archive.written)
+        self.metrics.collect('craftbot_chat_archive_pruned_total', lambda: self.chat_archive.pruned)
+        self.metrics.collect('craftbot_identity_cache_hits_total', lambda: self.identity_cache.hits)
+        self.metrics.collect('craftbot_identity_cache_misses_total', lambda: self.identity_cache.misses)
+        request = self.http.request
+        async def timed_request(route, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await request(route, **kwargs)
+            finally:
+                self.metrics.observe('craftbot_discord_request_seconds', time.perf_counter() - start, (('method', route.method), ('route', route.path)))
+        self.http.request = timed_request
+        logging.getLogger('discord').addHandler(RateLimitLogHandler(self.metrics))
 
     # Load the config from the specified file
     def init_config(self, config_file_path: str) -> bool:
@@ -91,48 +2391,149 @@ class CraftBot(discord.Bot):
             config_file = open(config_file_path, 'r', encoding='utf-8')
             self.config = json.loads(config_file.read())
             config_file.close()
+            self.apply_config(self.config, ConfigSnapshot(self.config))
+            self.config_path = config_file_path
+            self.config_stat = self.stat_config()
             return True
         except Exception as e:
             log_exception('Init', 'Failed to load bot config!', e)
         return False
 
+    # Swap in a new config and update everything derived from it
+    def apply_config(self, config: dict, snapshot: ConfigSnapshot):
+        self.config, self.config_snapshot = config, snapshot
+        self.log_pipeline.configure(snapshot)
+        self.admin_user_ids = frozenset(snapshot.get_list('admin.users'))
+        self.admin_role_ids = frozenset(snapshot.get_list('admin.roles'))
+        self.identity_cache.max_size = snapshot.get_int('identity_cache.max_size')
+        self.identity_cache.ttl = snapshot.get_float('identity_cache.ttl')
+        self.update_servers()
+        self.message_router.rebuild()
+
+    # Add and remove game servers to match the config, keeping the state of existing ones
+    def update_servers(self):
+        server_ids = self.config_snapshot.get('servers')
+        legacy = server_ids is None
+        servers = {}
+        for server_id in (['default'] if legacy else server_ids):
+            server = self.servers.get(server_id)
+            if server is None or server.legacy != legacy:
+                server = GameServer(self, server_id, legacy)
+                # Servers added while running need their saved stats loaded now
+                try:
+                    asyncio.get_running_loop().create_task(server.load())
+                except RuntimeError:
+                    pass
+            servers[server_id] = server
+        for server_id, server in self.servers.items():
+            if servers.get(server_id) is not server:
+                self.message_router.unregister(server.config_key('chat_channel_id'))
+                try:
+                    asyncio.get_running_loop().create_task(server.flush())
+                except RuntimeError:
+                    pass
+        for server in servers.values():
+            self.message_router.register(server.config_key('chat_channel_id'), server.on_chat_message)
+        self.servers = servers
+
+    # Get a game server by ID, or the first one if no ID is given
+    def get_server(self, server_id: str = None) -> GameServer:
+        if server_id is None:
+            return next(iter(self.servers.values()), None)
+        return self.servers.get(server_id)
+
+    # Reload the config file, keeping the current config if the new one is invalid
+    async def reload_config(self) -> bool:
+        try:
+            config = json.loads(await self.loop.run_in_executor(None, read_file, self.config_path))
+            snapshot = ConfigSnapshot(config)
+        except Exception as e:
+            log_exception('Config', 'Failed to reload bot config!', e)
+            return False
+        self.apply_config(config, snapshot)
+        log_message('Config', 'Reloaded bot config')
+        self.dispatch('config_reload')
+        return True
+
+    # Watch the config file for changes and reload it when it does
+    async def watch_config(self, interval: float = 2.0):
+        while True:
+            await asyncio.sleep(interval)
+            config_stat = self.stat_config()
+            if config_stat is not None and config_stat != self.config_stat:
+                self.config_stat = config_stat
+                await self.reload_config()
+
+    def stat_config(self):
+        try:
+            config_stat = os.stat(self.config_path)
+            return (config_stat.st_mtime_ns, config_stat.st_size)
+        except OSError:
+            return None
+
     # Save the config to the specified file
     def save_config(self, config_file_path: str) -> bool:
+        return self.write_config(config_file_path, json.dumps(self.config, indent=4, sort_keys=True))
+
+    # Write config text to a temporary file and swap it in, so a failed write never leaves a partial config
+    def write_config(self, config_file_path: str, config_text: str) -> bool:
         try:
-            config_file = open(config_file_path, 'w', encoding='utf-8')
-            config_file.write(json.dumps(self.config, indent=4, sort_keys=True))
+            temp_file_path = config_file_path + '.tmp'
+            config_file = open(temp_file_path, 'w', encoding='utf-8')
+            config_file.write(config_text)
             config_file.close()
+            os.replace(temp_file_path, config_file_path)
+            # Don't treat our own write as an external change
+            if config_file_path == self.config_path:
+                self.config_stat = self.stat_config()
             return True
         except Exception as e:
             log_exception('Saving', 'Failed to save bot config!', e)
         return False
 
+    # Save the config without blocking the event loop, merging overlapping requests
+    def request_config_save(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save_config(self.config_path)
+            return
+        self.config_save_pending = True
+        if self.config_save_task is None or self.config_save_task.done():
+            self.config_save_task = loop.create_task(self.run_config_save())
+
+    async def run_config_save(self):
+        while self.config_save_pending:
+            self.config_save_pending = False
+            config_text = json.dumps(self.config, indent=4, sort_keys=True)
+            await self.loop.run_in_executor(None, self.write_config, self.config_path, config_text)
+
     # Read a value from the config
     def get_config_value(self, key: str):
-        return search_get_dict(self.config, key)
+        return self.config_snapshot.get(key)
 
-    # Set a value in the config
+    # Set a value in the config and write it through to the config file
     def set_config_value(self, key: str, value) -> bool:
-        return search_set_dict(self.config, key, value)
+        config = copy.deepcopy(self.config)
+        if not search_set_dict(config, key, value):
+            return False
+        try:
+            snapshot = ConfigSnapshot(config)
+        except ValueError as e:
+            log_exception('Config', 'Refusing to set invalid config value "{0}"!'.format(key), e)
+            return False
+        self.apply_config(config, snapshot)
+        self.request_config_save()
+        return True
 
     # Connect to the specified SQLite database file
     def init_sqlite(self, db_file_path: str) -> bool:
         try:
-            self.database = sqlite3.connect(db_file_path)
-            self.database.row_factory = sqlite3.Row
-            log_message('Init', 'Connected to SQLite database, running version ' + sqlite3.version)
+            self.database = Database(db_file_path)
+            log_message('Init', 'Connected to SQLite database, running version ' + sqlite3.sqlite_version)
             try:
-                # Create table
-                # self.database.execute('DROP TABLE mc_accounts;')
-                self.database.execute('''
-                        CREATE TABLE IF NOT EXISTS mc_accounts (
-                            username TEXT NOT NULL,
-                            type TEXT NOT NULL,
-                            uuid TEXT UNIQUE,
-                            owner INTEGER
-                        );
-                    ''')
-                self.database.commit()
+                # Create or update tables
+                self.database.migrate(database_migrations)
                 return True
             except sqlite3.Error as e:
                 log_exception('Init', 'Error while creating database tables!', e)
@@ -144,51 +2545,179 @@ class CraftBot(discord.Bot):
     def save_sqlite(self, db_file_path: str) -> bool:
         return False
 
+    # Run a startup function, recording how long it took under a phase name
+    def time_startup_phase(self, phase: str, function, *args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.startup_times[phase] = time.perf_counter() - start
+
+    # Find the cogs in the cogs folder, every module there with a setup function is loaded
+    def discover_cogs(self) -> list[str]:
+        cog_names = []
+        for file_name in sorted(os.listdir(cogs_path)):
+            if file_name.endswith('.py') and not file_name.startswith('_'):
+                # Look for the function in the source rather than importing modules that aren't cogs
+                with open(os.path.join(cogs_path, file_name), encoding='utf-8', errors='replace') as cog_file:
+                    if re.search(r'^def setup\(', cog_file.read(), re.MULTILINE) is not None:
+                        cog_names.append('cogs.' + file_name[:-3])
+        return cog_names
+
+    # Hash a cog's source file, returns None if it no longer exists
+    def hash_cog(self, cog_name: str) -> str:
+        try:
+            with open(os.path.join(cogs_path, cog_name.split('.', 1)[1] + '.py'), 'rb') as cog_file:
+                return hashlib.sha256(cog_file.read()).hexdigest()
+        except FileNotFoundError:
+            return None
+
     def init_cogs(self) -> bool:
         success = True
         for cog_name in self.cog_names:
+            start = time.perf_counter()
             try:
                 self.load_extension(cog_name)
-                log_message('Init', 'Loaded cog "{0}"'.format(cog_name))
+                self.cog_hashes[cog_name] = self.hash_cog(cog_name)
+                log_message('Init', 'Loaded cog "{0}" in {1:.1f}ms'.format(cog_name, (time.perf_counter() - start) * 1000))
             except Exception as e:
                 success = False
                 log_exception('Init', 'Failed to load cog "{0}"!'.format(cog_name), e)
         return success
 
-    def reload_cogs(self) -> bool:
-        success = True
-        for cog_name in self.cog_names:
+    # Load new cogs, unload deleted ones and reload those whose source changed, or every cog if forced
+    # A cog that fails to reload keeps running its previous version, returns the changed and failed cog names
+    def reload_cogs(self, force: bool = False) -> tuple[list[str], list[str]]:
+        cog_names = self.discover_cogs()
+        changed, failed = [], []
+        for cog_name in sorted(set(cog_names) | set(self.cog_hashes)):
+            cog_hash = self.hash_cog(cog_name)
+            if cog_hash is not None and cog_hash == self.cog_hashes.get(cog_name) and not force:
+                continue
+            start = time.perf_counter()
             try:
-                self.reload_extension(cog_name)
-                log_message('Init', 'Reloaded cog "{0}"'.format(cog_name))
+                if cog_hash is None:
+                    self.unload_extension(cog_name)
+                    del self.cog_hashes[cog_name]
+                    action = 'Unloaded'
+                elif cog_name in self.extensions:
+                    # PyCord puts the previous version back if loading the new one fails
+                    self.reload_extension(cog_name)
+                    self.cog_hashes[cog_name] = cog_hash
+                    action = 'Reloaded'
+                else:
+                    self.load_extension(cog_name)
+                    self.cog_hashes[cog_name] = cog_hash
+                    action = 'Loaded'
+                changed.append(cog_name)
+                log_message('Cogs', '{0} cog "{1}" in {2:.1f}ms'.format(action, cog_name, (time.perf_counter() - start) * 1000))
             except Exception as e:
-                success = False
-                log_exception('Cogs', 'Failed to reload cog "{0}"!'.format(cog_name), e)
-        return success
+                failed.append(cog_name)
+                log_exception('Cogs', 'Failed to reload cog "{0}", keeping the previous version!'.format(cog_name), e)
+        self.cog_names = cog_names
+        return (changed, failed)
 
-    # Start listening on the specified UDP port
-    def run_udp(self, address: str, port: int):
+    # Start listening on the specified UDP port and dispatch received messages
+    async def run_udp(self, address: str, port: int):
         try:
-            self.udp_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-            self.udp_socket.bind((address, port))
+            self.udp_queue = UDPIngestQueue(self.config_snapshot.get_int('udp.queue_size'), self.config_snapshot.get_str('udp.queue_policy'))
+            self.udp_transport, _ = await self.loop.create_datagram_endpoint(lambda: UDPBridgeProtocol(self), local_addr=(address, port), family=socket.AF_INET)
             log_message('Init', 'UDP socket bound to {0}:{1}'.format(address, port))
-            while True:
-                try:
-                    data = self.udp_socket.recv(4096)
-                    asyncio.run_coroutine_threadsafe(self.on_udp_message(data.decode('utf-8')), self.loop)
-                except socket.error:
-                    # No data was received
-                    pass
         except Exception as e:
             log_exception('Init', 'Error while handling UDP socket!', e)
+            return
+        batch_size = self.config_snapshot.get_int('udp.batch_size')
+        dropped = 0
+        while True:
+            batch = await self.udp_queue.get_batch(batch_size)
+            await self.on_udp_batch(batch)
+            # Report dropped messages once per batch instead of once per packet
+            if self.udp_queue.dropped != dropped:
+                log_message('UDP', 'Ingest queue is full, dropped {0} message(s)'.format(self.udp_queue.dropped - dropped))
+                dropped = self.udp_queue.dropped
+
+    # Serve the metrics over HTTP in the Prometheus text format
+    async def run_metrics(self, address: str, port: int):
+        try:
+            self.metrics_server = await asyncio.start_server(self.on_metrics_request, address, port)
+            log_message('Init', 'Metrics endpoint listening on http://{0}:{1}/metrics'.format(address, port))
+        except Exception as e:
+            log_exception('Init', 'Error while starting metrics endpoint!', e)
+
+    async def on_metrics_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Skip the request headers
+            while await asyncio.wait_for(reader.readline(), 5) not in [b'\r\n', b'\n', b'']:
+                pass
+            request_split = request_line.decode('latin-1').split()
+            if len(request_split) >= 2 and request_split[0] == 'GET' and request_split[1].partition('?')[0] == '/metrics':
+                status, body = '200 OK', self.metrics.render()
+            else:
+                status, body = '404 Not Found', 'Not found\n'
+            body = body.encode()
+            writer.write('HTTP/1.1 {0}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nContent-Length: {1}\r\nConnection: close\r\n\r\n'.format(status, len(body)).encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    # Stop listening for UDP messages
+    def close_udp(self):
+        if self.udp_task is not None:
+            self.udp_task.cancel()
+            self.udp_task = None
+        if self.udp_transport is not None:
+            self.udp_transport.close()
+            self.udp_transport = None
 
     def run_bot(self):
         self.run(os.environ['CRAFTBOT_TOKEN'])
 
+    async def start(self, token: str, *, reconnect: bool = True):
+        # Load saved server state and resume delivering control messages left over from the last run
+        state_start = time.perf_counter()
+        await asyncio.gather(*[server.load() for server in self.servers.values()], self.udp_outbox.load())
+        self.startup_times['state'] = time.perf_counter() - state_start
+        # Start UDP server alongside the Discord connection
+        self.udp_task = asyncio.create_task(self.run_udp(self.config_snapshot.get_str('udp.listen_address'), self.config_snapshot.get_int('udp.listen_port')))
+        # Hot reload the config when its file changes
+        self.config_task = asyncio.create_task(self.watch_config())
+        # Prune old chat now and then
+        self.chat_archive_task = asyncio.create_task(self.chat_archive.run_prune())
+        # Serve metrics if a port is configured
+        if self.config_snapshot.get('metrics.listen_port') is not None:
+            await self.run_metrics(self.config_snapshot.get_str('metrics.listen_address'), self.config_snapshot.get_int('metrics.listen_port'))
+        await super().start(token, reconnect=reconnect)
+
+    async def close(self):
+        if self.is_closed():
+            return
+        if self.config_task is not None:
+            self.config_task.cancel()
+        if self.chat_archive_task is not None:
+            self.chat_archive_task.cancel()
+        self.close_udp()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            self.metrics_server = None
+        await self.udp_outbox.close()
+        await self.chat_relay.close()
+        await super().close()
+        for server in self.servers.values():
+            await server.flush()
+        await self.chat_archive.flush()
+        self.database.close()
+        self.log_pipeline.close()
+
     async def on_ready(self):
+        # Report how long startup took, once per run
+        if 'ready' not in self.startup_times:
+            self.startup_times['ready'] = time.time() - self.start_time
+            log_message('Init', 'Startup took {0}'.format(', '.join('{0} {1:.1f}ms'.format(phase, seconds * 1000) for phase, seconds in self.startup_times.items())))
         # Fetch some helpful variables
-        config_guild_id = int(os.environ['CRAFTBOT_GUILD_ID'])
-        self.guild = self.get_guild(config_guild_id)
+        self.guild = self.get_guild(self.guild_id)
         if self.guild is not None:
             # Print bot info
             log_message('Event', 'CraftBot Info:')
@@ -198,57 +2727,94 @@ class CraftBot(discord.Bot):
             log_message('Event', '  Prefix: \t{0}'.format(self.get_config_value('prefix')))
             # Set bot activity
             await self.change_presence(activity=discord.Game('Minecraft'))
+            # Warm up the identity cache with every guild member
+            if not self.guild.chunked:
+                await self.guild.chunk()
+            for member in self.guild.members:
+                self.identity_cache.put(member)
+            log_message('Event', 'Cached {0} guild members'.format(len(self.identity_cache)))
+            # Catch up on votes cast while the bot was offline, once per run
+            if self.suggestion_backfill_task is None:
+                self.suggestion_backfill_task = asyncio.create_task(self.backfill_suggestions())
         else:
-            log_message('Event', 'Failed to fetch guild {0}!'.format(config_guild_id))
+            log_message('Event', 'Failed to fetch guild {0}!'.format(self.guild_id))
+
+    async def backfill_suggestions(self):
+        channel = self.guild.get_channel(self.get_config_value('modules.suggestions.channel_id'))
+        if channel is None:
+            return
+        try:
+            count = await self.suggestion_index.backfill(channel)
+            log_message('Event', 'Indexed votes of {0} recent suggestions'.format(count))
+        except Exception as e:
+            log_exception('Event', 'Error while indexing suggestion votes!', e)
+
+    # Suggestion votes, read from raw events so reactions on uncached messages count too
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        if payload.channel_id != self.get_config_value('modules.suggestions.channel_id') or payload.user_id == self.user.id:
+            return
+        vote = self.suggestion_index.get_vote(payload.emoji)
+        if vote is not None:
+            await self.suggestion_index.add_vote(payload.message_id, payload.channel_id, payload.user_id, vote)
+
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        if payload.channel_id != self.get_config_value('modules.suggestions.channel_id') or payload.user_id == self.user.id:
+            return
+        vote = self.suggestion_index.get_vote(payload.emoji)
+        if vote is not None:
+            await self.suggestion_index.remove_vote(payload.message_id, payload.user_id, vote)
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if payload.channel_id == self.get_config_value('modules.suggestions.channel_id'):
+            await self.suggestion_index.remove_suggestion(payload.message_id)
+
+    async def on_member_join(self, member: discord.Member):
+        self.identity_cache.put(member)
+
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        self.identity_cache.put(after)
+
+    async def on_member_remove(self, member: discord.Member):
+        self.identity_cache.invalidate(member.id)
+
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        self.identity_cache.invalidate(after.id)
+
+    # Get a user from the identity cache, fetching and caching them if needed
+    async def resolve_user(self, user_id: int) -> discord.abc.User:
+        user = self.identity_cache.get(user_id)
+        if user is None:
+            user = await self.get_or_fetch_user(user_id)
+            if user is not None:
+                self.identity_cache.put(user)
+        return user
 
     async def on_message(self, message):
         try:
-            # Prevent bot from replying to itself
-            if message.author != self.user:
-                # Check if message was sent directly to the bot
-                if type(message.channel) in [discord.DMChannel, discord.GroupChannel]:
-                    pass
-                else:
-                    if type(message.channel) == discord.Thread:
-                        pass
-                    else:
-                        # These modules don't need to process messages from other bots, as it could cause issues!
-                        if not message.author.bot:
-                            # Chat forwarding channel
-                            if message.channel.id == self.get_config_value('modules.chat.channel_id'):
-                                # Forward message to in-game chat
-                                self.send_udp_message('chat', '{0.name}#{0.discriminator} {1}'.format(message.author, message.clean_content))
-                            # Help channel
-                            elif message.channel.id == self.get_config_value('modules.help.channel_id'):
-                                # Create thread for message and greet user
-                                thread = await message.create_thread(name=self.get_config_value('modules.help.formats.thread_title').format(message))
-                                await thread.send(self.get_config_value('modules.help.formats.message_greeting').format(message))
-                            # Suggestions channel
-                            elif message.channel.id == self.get_config_value('modules.suggestions.channel_id'):
-                                # Create thread for message, add voting reactions, and greet user
-                                thread = await message.create_thread(name=self.get_config_value('modules.suggestions.formats.thread_title').format(message))
-                                await message.add_reaction(self.get_config_value('modules.suggestions.formats.reaction_upvote'))
-                                await message.add_reaction(self.get_config_value('modules.suggestions.formats.reaction_downvote'))
-                                await thread.send(self.get_config_value('modules.suggestions.formats.message_greeting').format(message))
-                            # Whitelist channel
-                            # elif message.channel.id == self.get_config_value('modules.whitelist.channel_id'):
-                            #     # Add reactions and greet user
-                            #     await message.add_reaction(self.get_config_value('modules.whitelist.formats.reaction_java'))
-                            #     await message.add_reaction(self.get_config_value('modules.whitelist.formats.reaction_bedrock'))
-                            #     await message.channel.send(self.get_config_value('modules.whitelist.formats.message_greeting').format(message))
+            await self.message_router.dispatch(message)
         except Exception as e:
             log_exception('Event', 'Error while processing received message!', e)
 
-    # async def on_reaction_add(self, reaction, user):
-    #     message = reaction.message
-    #     try:
-    #         # Prevent bot from replying to itself
-    #         if user != self.user:
-    #             # Whitelist channel
-    #             if message.channel.id == self.get_config_value('modules.whitelist.channel_id'):
-    #                 await message.channel.send(reaction.emoji)
-    #     except Exception as e:
-    #         log_exception('Event', 'Error while processing received message!', e)   
+    # Help channel
+    async def on_help_message(self, message: discord.Message):
+        # Create thread for message and greet user
+        await self.call_scheduler.run(message.channel.id, self.create_greeted_thread, message, 'modules.help')
+
+    # Suggestions channel
+    async def on_suggestion_message(self, message: discord.Message):
+        # Create thread for message and greet user while adding the voting reactions, upvote first
+        async def add_reactions():
+            await self.call_scheduler.call('reaction', message.channel.id, message.add_reaction, self.get_config_value('modules.suggestions.formats.reaction_upvote'))
+            await self.call_scheduler.call('reaction', message.channel.id, message.add_reaction, self.get_config_value('modules.suggestions.formats.reaction_downvote'))
+        async def setup():
+            await asyncio.gather(self.suggestion_index.add_suggestion(message), self.create_greeted_thread(message, 'modules.suggestions'), add_reactions())
+        await self.call_scheduler.run(message.channel.id, setup)
+
+    # Create a thread for a message and greet its author, using the formats of the specified module
+    async def create_greeted_thread(self, message: discord.Message, module: str):
+        # Thread names are limited to 100 characters
+        thread = await self.call_scheduler.call('thread', message.channel.id, message.create_thread, name=self.get_config_value(module + '.formats.thread_title').format(message)[:100])
+        await self.call_scheduler.call('message', thread.id, thread.send, self.get_config_value(module + '.formats.message_greeting').format(message))
 
     async def on_command_error(self, ctx: discord.ApplicationContext, error):
         if isinstance(error, commands.CheckFailure):
@@ -257,6 +2823,20 @@ class CraftBot(discord.Bot):
             craftbot.log_exception('Command', 'An error occured while proccessing a command.', error)
             await ctx.interaction.response.send_message(content='An unspecified error has occured. Please check the log for details.')
 
+    # Dispatch a batch of UDP messages, skipping stats that are superseded later in the batch
+    async def on_udp_batch(self, messages: list[str]):
+        latest = {}
+        for i, message in enumerate(messages):
+            message_key = get_udp_message_key(message)
+            if message_key[1] in UDPIngestQueue.coalesce_types:
+                latest[message_key] = i
+        for i, message in enumerate(messages):
+            message_key = get_udp_message_key(message)
+            if message_key not in latest or latest[message_key] == i:
+                start = time.perf_counter()
+                await self.on_udp_message(message)
+                self.metrics.observe('craftbot_udp_handler_seconds', time.perf_counter() - start)
+
     async def on_udp_message(self, message):
         try:
             # Split message into parts
@@ -266,39 +2846,55 @@ class CraftBot(discord.Bot):
             # print('Received UDP packet')
             # print('  Type:\t%s' % message_type)
             # print('  Content:\t%s' % message_content)
+            # Find the server that sent the message
+            server = self.find_udp_server(message_split[0])
+            if server is None:
+                log_message('UDP', 'Dropped message from unknown or unauthorized server "%s"' % message_split[0].partition(':')[0])
+                return
+            # Hand replies to anything waiting on this message type
+            waiters = self.udp_waiters.pop((server.id, message_type), None)
+            if waiters:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(message_content)
+                return
             # Fetch appropriate guild
             if self.guild is not None:
                 message_types_chat = {'chat': ('**{0[0]}**: {0[1]}', 1), 'chat_system': ('*{0[0]}*', 0)}
-                message_types_stat = {'playerlist': self.parse_playerlist, 'playtimes': self.parse_playtimes}
                 # Perform action based on message type
                 if message_type in message_types_chat:
-                    chat_channel_id = self.get_config_value('modules.chat.channel_id')
+                    if message_type == 'chat':
+                        author, _, content = message_content.partition(' ')
+                        self.chat_archive.add(server.id, 'game', author, content)
+                    else:
+                        self.chat_archive.add(server.id, 'game', None, message_content)
+                    chat_channel_id = server.get_config_value('chat_channel_id')
                     chat_channel = self.guild.get_channel(chat_channel_id)
                     if chat_channel and type(chat_channel) is discord.TextChannel:
                         message_format, split_limit = message_types_chat.get(message_type)
-                        await chat_channel.send(message_format.format(message_content.split(' ', split_limit)))
+                        message_parts = message_content.split(' ', split_limit)
+                        # Player chat can be sent through a webhook so the player shows as the sender
+                        webhook_url = server.get_config_value('webhook_url')
+                        if message_type == 'chat' and webhook_url:
+                            self.chat_relay.queue(chat_channel, message_parts[1], message_parts[0], webhook_url)
+                        else:
+                            self.chat_relay.queue(chat_channel, message_format.format(message_parts))
                     else:
-                        log_message('UDP', 'Could not find the linked chat text channel with ID %d!' % chat_channel_id)
-                elif message_type in message_types_stat:
+                        log_message('UDP', 'Could not find the linked chat text channel with ID {0} for server "{1}"!'.format(chat_channel_id, server.id))
+                elif message_type in server.stat_parsers:
                     # Cache response
-                    self.message_cache[message_type] = message_content
-                    self.embed_data[message_type] = message_types_stat.get(message_type)(message_content)
-                    # Locate channel of player list message
-                    stats_channel_id = self.get_config_value('modules.stats.channel_id')
-                    stats_channel = self.guild.get_channel(stats_channel_id)
-                    if stats_channel is not None and type(stats_channel) == discord.TextChannel:
-                        # Locate player list message to edit
-                        stats_message_id = self.get_config_value('modules.stats.message_id')
-                        if stats_message_id is not None:
-                            stats_message = await stats_channel.fetch_message(stats_message_id)
-                            if stats_message is not None:
-                                await stats_message.edit(embed=self.generate_playerstats_embed(message_types_stat))
-                                return
-                        # Channel or message could not be found
-                        stats_message = await stats_channel.send(embed=self.generate_playerstats_embed(message_types_stat))
-                        self.set_config_value('modules.stats.message_id', stats_message.id)
-                    else:
-                        log_message('UDP', 'Could not find the player list text channel with ID %d!' % stats_channel_id)
+                    server.message_cache[message_type] = message_content
+                    server.embed_data[message_type] = server.stat_parsers.get(message_type)(message_content)
+                    # Track who joined and left since the last player list
+                    if message_type == 'playerlist':
+                        server.presence_tracker.update(message_content.split(',') if len(message_content) > 0 else [])
+                    # Update the player stats message
+                    server.stats_publisher.request_update()
+                elif message_type in server.delta_parsers:
+                    # Apply the changes to the state built from earlier messages
+                    stat_type, parser = server.delta_parsers[message_type]
+                    server.embed_data[stat_type] = parser(message_content)
+                    server.stats_publisher.request_update()
                 else:
                     log_message('UDP', 'Unrecognized message type "%s"' % message_type)
             else:
@@ -306,57 +2902,165 @@ class CraftBot(discord.Bot):
         except Exception as e:
             log_exception('UDP', 'Error while processing UDP message!', e)
 
-    def send_udp_message(self, message_type: str, message_content: str) -> bool:
-        address, port = (self.get_config_value('udp.sendto_address'), self.get_config_value('udp.sendto_port'))
+    # Find the server a packet came from by its first field, which holds the server ID and optionally ':' and its secret
+    def find_udp_server(self, server_field: str) -> GameServer:
+        server = self.get_server()
+        if server is not None and server.legacy:
+            # A single server accepts every packet, as before
+            return server
+        server_id, _, secret = server_field.partition(':')
+        server = self.servers.get(server_id)
+        if server is not None and server.check_secret(secret):
+            return server
+        return None
+
+    # Acknowledge a sequenced frame and unwrap it into a plain message, returns None if there is nothing left to dispatch
+    def unwrap_udp_frame(self, message: str) -> str:
+        try:
+            message_split = message.split('\0', 2)
+            server = self.find_udp_server(message_split[0])
+            if server is None:
+                log_message('UDP', 'Dropped message from unknown or unauthorized server "%s"' % message_split[0].partition(':')[0])
+                return None
+            # Acknowledgements of our own messages, holding our epoch and the sequence number
+            if message_split[1] == 'ack':
+                epoch, _, sequence = message_split[2].rpartition('\0')
+                if epoch == self.udp_outbox.epoch:
+                    self.udp_outbox.ack(server.id, int(sequence))
+                return None
+            if message_split[1] == udp_protocol_version:
+                epoch, sequence, message_type, message_content = message_split[2].split('\0', 3)
+                ack_content = epoch + '\0' + sequence
+            else:
+                # Legacy frames have no epoch, so a game server sending them must never reuse sequence numbers
+                epoch = None
+                sequence, message_type, message_content = message_split[2].split('\0', 2)
+                ack_content = sequence
+            # Acknowledge every copy, since an earlier acknowledgement may have been lost
+            self.send_udp_packet(server, server.encode_udp_message('ack', ack_content))
+            if not server.check_sequence(epoch, int(sequence)):
+                return None
+            return '\0'.join([message_split[0], message_type, message_content])
+        except Exception as e:
+            log_exception('UDP', 'Error while unwrapping sequenced UDP message!', e)
+        return None
+
+    # Add a chunk of a split message, returns the reassembled message once every chunk has arrived
+    def reassemble_udp_chunk(self, message: str) -> str:
         try:
-            self.udp_socket.sendto('\0'.join([message_type, message_content]).encode(errors='replace'), (address, port))
+            message_split = message.split('\0', 2)
+            server = self.find_udp_server(message_split[0])
+            if server is None:
+                log_message('UDP', 'Dropped message from unknown or unauthorized server "%s"' % message_split[0].partition(':')[0])
+                return None
+            chunk_id, index, count, payload = message_split[2].split('\0', 3)
+            whole_message = server.add_chunk(chunk_id, int(index), int(count), payload)
+            if whole_message is None:
+                return None
+            return '\0'.join([message_split[0], whole_message])
+        except Exception as e:
+            log_exception('UDP', 'Error while reassembling chunked UDP message!', e)
+        return None
+
+    # Send an encoded packet to a game server, returns whether it was sent
+    def send_udp_packet(self, server: GameServer, data: bytes) -> bool:
+        address, port = server.address
+        try:
+            if self.udp_transport is None:
+                raise ConnectionError('UDP socket is not open')
+            self.udp_transport.sendto(data, (address, port))
+            self.metrics.inc('craftbot_udp_packets_sent_total')
+            self.metrics.inc('craftbot_udp_bytes_sent_total', len(data))
             return True
-        except Exception as exc:
-            print('Failed to send UDP packet!')
-            print('  Destination:\t{0}:{1}'.format(address, port))
-            print('  Type:\t%s' % message_type)
-            print('  Content:\t%s' % message_content)
-            print(exc)
-            print(exc.__traceback__)
+        except Exception as e:
+            self.metrics.inc('craftbot_udp_send_errors_total')
+            log_exception('UDP', 'Failed to send UDP packet to server "{0}" at {1}:{2}!'.format(server.id, address, port), e)
         return False
 
-    def generate_playerstats_embed(self, content_parsers) -> discord.Embed:
-        embed = discord.Embed(title='**Player Stats**', colour=discord.Colour.from_rgb(255, 170, 0), timestamp=date.datetime.now(tz=date.timezone.utc))
-        for field_type in content_parsers.keys():
-            field_name, field_content = self.embed_data.get(field_type, content_parsers.get(field_type)(self.message_cache.get(field_type, '')))
-            embed.add_field(name=field_name, value=field_content, inline=False)
-        return embed
+    # Send a message to a game server, or to every game server if no ID is given
+    def send_udp_message(self, message_type: str, message_content: str, server_id: str = None) -> bool:
+        success = True
+        for server in (self.servers.values() if server_id is None else [self.servers.get(server_id)]):
+            if server is None:
+                log_message('UDP', 'Cannot send to unknown server "%s"' % server_id)
+                return False
+            # Control messages to servers that acknowledge them are delivered through the outbox
+            if message_type in UDPOutbox.message_types and server.get_config_value('reliable'):
+                self.udp_outbox.put(server.id, message_type, message_content)
+            elif not self.send_udp_packet(server, server.encode_udp_message(message_type, message_content)):
+                success = False
+        return success
 
-    def parse_playerlist(self, message: str) -> tuple[str, str]:
-        playerlist = ['No players online']
-        if message is not None and len(message) > 0:
-            playerlist = message.split(',')
-        return ('**Currently Online**', '\n'.join(['```'] + playerlist + ['```']))
+    # Send a list of entries using as few packets as possible, returns the number of packets sent
+    def send_udp_batch(self, message_type: str, entries: list[str], server_id: str = None, max_size: int = 1200) -> int:
+        packets = 0
+        batch = []
+        batch_size = 0
+        for entry in entries:
+            # Start a new packet once this one would grow too large to send unfragmented
+            if batch and batch_size + len(entry) + 1 > max_size:
+                packets += self.send_udp_message(message_type, ','.join(batch), server_id)
+                batch = []
+                batch_size = 0
+            batch.append(entry)
+            batch_size += len(entry) + 1
+        if batch:
+            packets += self.send_udp_message(message_type, ','.join(batch), server_id)
+        return packets
 
-    def parse_playtimes(self, message: str, count=10) -> tuple[str, str]:
+    # Add or remove whitelist entries on a game server, or on every game server if no ID is given
+    # Returns the replies of servers reached over RCON by server ID, with errors formatted in place of replies
+    async def update_whitelist(self, action: str, entries: list[str], server_id: str = None) -> dict[str, list[str]]:
+        servers = list(self.servers.values()) if server_id is None else [self.servers.get(server_id)]
+        if None in servers:
+            log_message('RCON', 'Cannot update the whitelist of unknown server "{0}"'.format(server_id))
+            return {}
+        replies = {}
+        for server, results in zip(servers, await asyncio.gather(*[server.update_whitelist(action, entries) for server in servers], return_exceptions=True)):
+            if results is None:
+                continue
+            if isinstance(results, Exception):
+                results = [results] * len(entries)
+            for entry, result in zip(entries, results):
+                if isinstance(result, Exception):
+                    log_message('RCON', 'Failed to {0} "{1}" on server "{2}": {3}'.format(action, entry, server.id, result), logging.WARNING)
+            replies[server.id] = ['Error: {0}'.format(str(result) or type(result).__name__) if isinstance(result, Exception) else result for result in results]
+        return replies
+
+    # Wait for a game server to send a message of the specified type, returns its content
+    async def wait_for_udp_message(self, server_id: str, message_type: str, timeout: float = 10.0) -> str:
+        key = (server_id, message_type)
+        waiter = self.loop.create_future()
+        self.udp_waiters.setdefault(key, []).append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        finally:
+            waiters = self.udp_waiters.get(key)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+
+    # Format a playtime leaderboard from (username, milliseconds) pairs
+    def format_playtimes(self, rankings: list[tuple[str, int]], count=10) -> str:
         timeslist = ['No data']
-        if message is not None and len(message) > 0:
+        if len(rankings) > 0:
             timeslist = []
-            for i,item in enumerate(message.split(',')[:count]):
-                username, playtime = item.split(' ', 1)
-                timeslist.append(('{0:<%d} {1:<18} {2}h {3}m' % (len(str(count)) + 1)).format(str(i + 1) + '.', username + ':', math.floor(int(playtime) / (1000 * 60 * 60)), round(int(playtime) / (1000 * 60)) % 60))
-        return ('**Playtime Rankings**', '\n'.join(['```'] + timeslist + ['```']))
+            for i, (username, playtime) in enumerate(rankings[:count]):
+                timeslist.append(('{0:<%d} {1:<18} {2}h {3}m' % (len(str(count)) + 1)).format(str(i + 1) + '.', username + ':', math.floor(playtime / (1000 * 60 * 60)), round(playtime / (1000 * 60)) % 60))
+        return '\n'.join(['```'] + timeslist + ['```'])
 
     # Checks if the user of the specified context is an admin here or not
     async def is_admin(ctx: discord.ApplicationContext) -> bool:
         author = ctx.author
-        admin_list = ctx.bot.get_config_value('admin')
         # Check if user specifically is an admin
-        if author.id in admin_list['users']:
+        if author.id in ctx.bot.admin_user_ids:
             return True
         # Check if user has an admin role
-        if isinstance(author, discord.Member) and any(role in admin_list['roles'] for role in author.roles):
+        if isinstance(author, discord.Member) and any(role.id in ctx.bot.admin_role_ids for role in author.roles):
             return True
         # Checks failed :(
         return False
 
 
-
 if __name__ == '__main__':
     # Start bot
     CraftBot().run_bot()
\ No newline at end of file
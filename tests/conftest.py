@@ -0,0 +1,9 @@
+# Python 3.10
+
+# Built-in Python libraries
+import os, sys
+
+
+# Let tests import the bot and the benchmark helpers from the repository root
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root, os.path.join(root, 'benchmarks')]
@@ -0,0 +1,38 @@
+# Python 3.10
+
+# Built-in Python libraries
+import asyncio, json, os, time, types
+
+# Main CraftBot module
+import craftbot
+
+
+# Make an archive writing to a fresh database, with a small batch size
+def make_archive(tmp_path) -> craftbot.ChatArchive:
+    with open(os.path.join(os.path.dirname(craftbot.__file__), 'config.json')) as file:
+        config = json.load(file)
+    config['chat_archive'].update({'batch_size': 5, 'flush_interval': 0.05})
+    database = craftbot.Database(str(tmp_path / 'data.db'))
+    database.migrate(craftbot.database_migrations)
+    return craftbot.ChatArchive(types.SimpleNamespace(config_snapshot=craftbot.ConfigSnapshot(config), database=database))
+
+
+def test_full_batch_does_not_cancel_a_running_write(tmp_path):
+    archive = make_archive(tmp_path)
+    async def run():
+        # Keep the database thread busy so the first batch's write waits in line
+        busy = asyncio.ensure_future(archive.bot.database.run(lambda connection: time.sleep(0.2)))
+        await asyncio.sleep(0)
+        for i in range(5):
+            archive.add('survival', 'game', 'Steve', 'line {0}'.format(i))
+        await asyncio.sleep(0.05)
+        for i in range(5, 8):
+            archive.add('survival', 'game', 'Steve', 'line {0}'.format(i))
+        await busy
+        await asyncio.wait_for(archive.flush_task, 5)
+        return await archive.bot.database.fetch_all('SELECT content FROM chat_log ORDER BY id;')
+    try:
+        rows = asyncio.run(run())
+    finally:
+        archive.bot.database.close()
+    assert [row['content'] for row in rows] == ['line {0}'.format(i) for i in range(8)]
@@ -0,0 +1,76 @@
+# Python 3.10
+
+# Built-in Python libraries
+import asyncio, time, types
+# Testing
+import pytest
+
+# Main CraftBot module
+import craftbot
+
+
+# Channel raising the error listed for each send in turn, None lets a send through
+class FlakyChannel:
+
+    def __init__(self, errors: list):
+        self.id = 1
+        self.errors = errors
+        self.sent = []
+
+    async def send(self, content: str):
+        error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            raise error
+        self.sent.append(content)
+
+
+def make_relay(lines: list[str]) -> craftbot.ChatRelay:
+    bot = types.SimpleNamespace(loop=types.SimpleNamespace(time=lambda: 0.0), metrics=craftbot.Metrics())
+    bot.call_scheduler = craftbot.DiscordCallScheduler(bot)
+    relay = craftbot.ChatRelay(bot)
+    relay.message_limit = 10
+    relay.buffers[1] = craftbot.collections.deque((0.0, None, line) for line in lines)
+    relay.buffer_sizes[1] = sum(len(line) + 1 for line in lines)
+    return relay
+
+
+def test_failed_flush_keeps_unsent_lines():
+    relay = make_relay(['aaaa', 'bbbb', 'cccc', 'dddd'])
+    channel = FlakyChannel([None, ConnectionResetError()])
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(relay.flush(channel))
+    # The first message went out, the other two lines wait in order for the next flush
+    assert channel.sent == ['aaaa\nbbbb']
+    assert [line for _, _, line in relay.buffers[1]] == ['cccc', 'dddd']
+    assert relay.buffer_sizes[1] == 10
+
+
+def test_rejected_message_is_dropped():
+    relay = make_relay(['aaaa', 'bbbb', 'cccc'])
+    response = types.SimpleNamespace(status=400, reason='Bad Request')
+    with pytest.raises(craftbot.discord.HTTPException):
+        asyncio.run(relay.flush(FlakyChannel([craftbot.discord.HTTPException(response, 'Invalid Form Body')])))
+    assert [line for _, _, line in relay.buffers[1]] == ['cccc']
+
+
+def test_truncated_line_counts_its_stored_length():
+    relay = make_relay([])
+    relay.message_limit = 2000
+    async def run():
+        relay.queue(FlakyChannel([]), 'a' * 3000)
+        relay.tasks[1].cancel()
+    asyncio.run(run())
+    assert relay.buffer_sizes[1] == 2001
+    assert len(relay.buffers[1][0][2]) == 2000
+
+
+def test_flush_waits_for_the_channel_bucket(monkeypatch):
+    monkeypatch.setitem(craftbot.DiscordCallScheduler.route_limits, 'message', (1, 0.1))
+    relay = make_relay(['aaaaaaaa', 'bbbbbbbb', 'cccccccc'])
+    channel = FlakyChannel([])
+    async def run():
+        start = time.monotonic()
+        await relay.flush(channel)
+        return time.monotonic() - start
+    assert asyncio.run(run()) >= 0.2
+    assert channel.sent == ['aaaaaaaa', 'bbbbbbbb', 'cccccccc']
@@ -0,0 +1,18 @@
+# Python 3.10
+
+# Main CraftBot module
+import craftbot
+
+
+def test_only_modules_with_setup_are_discovered(tmp_path, monkeypatch):
+    (tmp_path / 'chat.py').write_text('def setup(bot):\n    pass\n')
+    (tmp_path / 'helpers.py').write_text('def format_line(line):\n    # setup(bot) is not called here\n    return line\n')
+    (tmp_path / '_private.py').write_text('def setup(bot):\n    pass\n')
+    (tmp_path / 'notes.txt').write_text('def setup(bot):\n')
+    monkeypatch.setattr(craftbot, 'cogs_path', str(tmp_path))
+    assert craftbot.CraftBot.discover_cogs(None) == ['cogs.chat']
+
+
+def test_bundled_cogs_are_discovered():
+    cog_names = craftbot.CraftBot.discover_cogs(None)
+    assert 'cogs.registration' in cog_names and 'cogs.chatlog' in cog_names
@@ -0,0 +1,25 @@
+# Python 3.10
+
+# Built-in Python libraries
+import json, os
+# Testing
+import pytest
+
+# Main CraftBot module
+import craftbot
+
+
+def load_config() -> dict:
+    with open(os.path.join(os.path.dirname(craftbot.__file__), 'config.json')) as file:
+        return json.load(file)
+
+
+def test_default_config_is_valid():
+    assert craftbot.ConfigSnapshot(load_config()).get('udp.queue_policy') == 'coalesce'
+
+
+def test_unknown_queue_policy_is_rejected():
+    config = load_config()
+    config['udp']['queue_policy'] = 'drop_everything'
+    with pytest.raises(ValueError, match='udp.queue_policy'):
+        craftbot.ConfigSnapshot(config)
@@ -0,0 +1,74 @@
+# Python 3.10
+
+# Built-in Python libraries
+import asyncio, sqlite3, types
+# Testing
+import pytest
+
+# Main CraftBot module
+import craftbot
+
+
+# Database stand-in whose first write fails as if it were locked, recording the later ones
+class LockedOnceDatabase:
+
+    def __init__(self):
+        self.failed = False
+        self.writes = []
+
+    async def run(self, function, *args):
+        if not self.failed:
+            self.failed = True
+            raise sqlite3.OperationalError('database is locked')
+        self.writes.append(args)
+
+
+def make_bot() -> types.SimpleNamespace:
+    return types.SimpleNamespace(database=LockedOnceDatabase())
+
+
+def test_playtimes_survive_a_failed_write():
+    bot = make_bot()
+    store = craftbot.PlaytimeStore(bot, types.SimpleNamespace(id='survival'))
+    async def run():
+        store.pending_totals = {'Steve': 100, 'Alex': 50}
+        store.pending_deltas = {('Steve', 0): 30}
+        with pytest.raises(sqlite3.OperationalError):
+            await store.flush()
+        # Newer reports arrive before the retry
+        store.pending_totals['Steve'] = 120
+        store.pending_deltas[('Steve', 0)] = store.pending_deltas.get(('Steve', 0), 0) + 20
+        await store.flush()
+    asyncio.run(run())
+    totals, deltas = bot.database.writes[0]
+    assert sorted(totals) == [('survival', 'Alex', 50), ('survival', 'Steve', 120)]
+    assert deltas == [('survival', 'Steve', 0, 50)]
+
+
+def test_presence_events_survive_a_failed_write():
+    bot = make_bot()
+    tracker = craftbot.PresenceTracker(bot, types.SimpleNamespace(id='survival'))
+    async def run():
+        tracker.pending_events = [('join', 'Steve', 1)]
+        tracker.pending_counts = [(1, 1)]
+        with pytest.raises(sqlite3.OperationalError):
+            await tracker.flush()
+        tracker.pending_events.append(('leave', 'Steve', 2))
+        tracker.pending_counts.append((2, 0))
+        await tracker.flush()
+    asyncio.run(run())
+    assert bot.database.writes == [([('join', 'Steve', 1), ('leave', 'Steve', 2)], [(1, 1), (2, 0)])]
+
+
+def test_archived_chat_survives_a_failed_write():
+    bot = make_bot()
+    archive = craftbot.ChatArchive(bot)
+    async def run():
+        archive.pending = [('survival', 'game', 'Steve', None, 'hello', 1)]
+        with pytest.raises(sqlite3.OperationalError):
+            await archive.flush()
+        archive.pending.append(('survival', 'game', 'Alex', None, 'hi', 2))
+        await archive.flush()
+    asyncio.run(run())
+    assert bot.database.writes == [([('survival', 'game', 'Steve', None, 'hello', 1), ('survival', 'game', 'Alex', None, 'hi', 2)],)]
+    assert archive.written == 2
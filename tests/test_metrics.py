@@ -0,0 +1,22 @@
+# Python 3.10
+
+# Built-in Python libraries
+import logging
+
+# Main CraftBot module
+import craftbot
+
+
+def test_global_rate_limit_is_counted_once():
+    metrics = craftbot.Metrics()
+    logger = logging.getLogger('discord.http.test')
+    handler = craftbot.RateLimitLogHandler(metrics)
+    logger.addHandler(handler)
+    try:
+        # The two warnings PyCord logs for one globally rate limited request
+        logger.warning('We are being rate limited. Retrying in %.2f seconds. Handled under the bucket "%s"', 1.5, 'global')
+        logger.warning('Global rate limit has been hit. Retrying in %.2f seconds.', 1.5)
+    finally:
+        logger.removeHandler(handler)
+    histogram = metrics.histograms[('craftbot_discord_rate_limit_seconds', ())]
+    assert histogram.count == 1 and histogram.sum == 1.5
@@ -0,0 +1,65 @@
+# Python 3.10
+
+# Built-in Python libraries
+import asyncio
+
+# Main CraftBot module
+import craftbot
+
+
+# Serve pages of rows with IDs 1 to 45, in the given direction from the cursor
+def make_fetch(descending: bool):
+    ids = list(range(45, 0, -1) if descending else range(1, 46))
+    async def fetch_page(cursor, limit: int) -> list[dict]:
+        if cursor is not None:
+            ids_after = [row_id for row_id in ids if (row_id < cursor if descending else row_id > cursor)]
+        else:
+            ids_after = ids
+        return [{'id': row_id, 'rowid': row_id} for row_id in ids_after[:limit]]
+    return fetch_page
+
+
+async def format_rows(rows: list) -> list[str]:
+    return [str(row['id']) for row in rows]
+
+
+# Render every page going forward, then the first page again going back, returns the rows of each render
+async def page_through(pages: craftbot.KeysetPages) -> list[list[str]]:
+    rendered = []
+    while True:
+        rendered.append((await pages.render()).description.split('\n'))
+        if pages.next_page.disabled:
+            break
+        pages.page += 1
+    pages.page = 0
+    rendered.append((await pages.render()).description.split('\n'))
+    return rendered
+
+
+def test_ascending_rowid_pages():
+    async def run():
+        pages = craftbot.KeysetPages('Test', make_fetch(False), format_rows, 1)
+        return await page_through(pages), pages.page_starts
+    rendered, page_starts = asyncio.run(run())
+    assert [len(page) for page in rendered] == [20, 20, 5, 20]
+    assert rendered[2] == [str(row_id) for row_id in range(41, 46)]
+    assert rendered[3] == rendered[0]
+    assert page_starts == [0, 20, 40]
+
+
+def test_descending_id_pages():
+    async def run():
+        pages = craftbot.KeysetPages('Test', make_fetch(True), format_rows, 1, cursor_column='id', first_cursor=None, page_size=15)
+        return await page_through(pages), pages.page_starts
+    rendered, page_starts = asyncio.run(run())
+    assert [len(page) for page in rendered] == [15, 15, 15, 15]
+    assert rendered[0][0] == '45' and rendered[2][-1] == '1'
+    assert page_starts == [None, 31, 16]
+
+
+def test_empty_result_renders_nothing():
+    async def run():
+        async def fetch_page(cursor, limit):
+            return []
+        return await craftbot.KeysetPages('Test', fetch_page, format_rows, 1).render()
+    assert asyncio.run(run()) is None
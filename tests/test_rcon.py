@@ -0,0 +1,96 @@
+# Python 3.10
+
+# Built-in Python libraries
+import asyncio, time
+# Testing
+import pytest
+
+# Main CraftBot module
+import craftbot
+# RCON server stand-in
+from fake_rcon import FakeRCONServer
+
+
+# Run a test coroutine against a fresh fake server, closing both ends afterwards
+def run_with_server(test, latency: float = 0.0, **pool_options):
+    async def run():
+        server = FakeRCONServer('secret', latency)
+        await server.start()
+        pool = craftbot.RCONPool('127.0.0.1', server.port, pool_options.pop('password', 'secret'), **pool_options)
+        try:
+            await test(server, pool)
+        finally:
+            pool.close()
+            await server.close()
+    asyncio.run(run())
+
+
+def test_login_failure_raises_permission_error():
+    async def test(server, pool):
+        with pytest.raises(PermissionError):
+            await pool.command('whitelist list')
+        assert server.commands == []
+    run_with_server(test, password='wrong')
+
+
+def test_failed_login_backs_off():
+    async def test(server, pool):
+        with pytest.raises(PermissionError):
+            await pool.command('whitelist list')
+        with pytest.raises(ConnectionError, match='retrying'):
+            await pool.command('whitelist list')
+        assert server.connections == 1
+    run_with_server(test, password='wrong')
+
+
+def test_pipelined_replies_match_their_commands():
+    async def test(server, pool):
+        names = ['Player{0}'.format(i) for i in range(20)]
+        start = time.monotonic()
+        replies = await pool.pipeline(['whitelist add {0}'.format(name) for name in names])
+        elapsed = time.monotonic() - start
+        assert replies == ['Added {0} to the whitelist'.format(name) for name in names]
+        # All twenty commands share one round trip instead of waiting for each other
+        assert elapsed < 0.1 * 5
+        assert server.connections == 1
+    run_with_server(test, latency=0.1, size=1)
+
+
+def test_split_reply_is_reassembled():
+    async def test(server, pool):
+        names = ['LongPlayerName{0:04}'.format(i) for i in range(500)]
+        for name in names:
+            server.whitelist[name.lower()] = name
+        reply = await pool.command('whitelist list')
+        assert len(reply) > FakeRCONServer.max_payload
+        assert reply == 'There are 500 whitelisted player(s): {0}'.format(', '.join(names))
+        # The next command still gets its own reply
+        assert await pool.command('whitelist remove LongPlayerName0000') == 'Removed LongPlayerName0000 from the whitelist'
+    run_with_server(test)
+
+
+def test_dropped_connection_fails_pending_commands_and_reconnects():
+    async def test(server, pool):
+        assert await pool.command('whitelist add Steve') == 'Added Steve to the whitelist'
+        pending = asyncio.gather(*[pool.command('whitelist add Alex{0}'.format(i)) for i in range(3)], return_exceptions=True)
+        await asyncio.sleep(0.05)
+        server.drop_connections()
+        results = await pending
+        assert all(isinstance(result, ConnectionError) for result in results)
+        assert await pool.command('whitelist remove Steve') == 'Removed Steve from the whitelist'
+        assert server.connections == 2
+    run_with_server(test, latency=0.5, size=1)
+
+
+def test_command_timeout():
+    async def test(server, pool):
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.command('whitelist list', timeout=0.1)
+        connection = pool.connections[0]
+        assert connection.in_flight == 0 and connection.markers == {}
+        # A late reply to the timed out command is dropped and the connection keeps working
+        server.latency = 0.0
+        await asyncio.sleep(0.5)
+        assert await pool.command('whitelist add Steve') == 'Added Steve to the whitelist'
+        assert server.connections == 1
+    run_with_server(test, latency=0.3, size=1)
@@ -0,0 +1,92 @@
+# Python 3.10
+
+# Built-in Python libraries
+import asyncio, sqlite3, types
+# Testing
+import pytest
+
+# Main CraftBot module
+import craftbot
+# Cog under test
+from cogs.registration import RegistrationCog
+
+
+# Make a cog without a running bot, only the parts the import helpers use
+def make_cog(servers: dict = None) -> RegistrationCog:
+    cog = RegistrationCog.__new__(RegistrationCog)
+    cog.bot = types.SimpleNamespace(servers=servers or {})
+    return cog
+
+
+def test_json_import_must_be_a_list():
+    with pytest.raises(ValueError):
+        make_cog()._parse_whitelist_file('whitelist.json', '{"name": "Steve"}', 'java')
+
+
+def test_json_import_counts_malformed_entries_as_invalid():
+    text = '[{"name": "Steve", "uuid": "a"}, "Alex", {"uuid": "b"}, {"name": 5}, {"name": "Notch", "uuid": 7}]'
+    rows, invalid = make_cog()._parse_whitelist_file('whitelist.json', text, 'java')
+    assert rows == [('Steve', 'java', 'a', None, None), ('Notch', 'java', None, None, None)]
+    assert invalid == 3
+
+
+def test_import_does_not_count_uuid_clashes_as_new(tmp_path):
+    database = craftbot.Database(str(tmp_path / 'data.db'))
+    database.migrate(craftbot.database_migrations)
+    database.connection.execute("INSERT INTO mc_accounts (username, type, uuid) VALUES ('Steve', 'java', 'a');")
+    rows = [('Steve2', 'java', 'a', None, None), ('Alex', 'java', 'b', None, None), ('Alex2', 'java', 'b', None, None), ('steve', 'java', None, None, None)]
+    try:
+        new_rows = make_cog()._import_rows(database.connection, rows)
+        assert new_rows == [('Alex', 'java', 'b', None, None)]
+        assert database.connection.execute('SELECT COUNT(*) FROM mc_accounts;').fetchone()[0] == 2
+    finally:
+        database.close()
+
+
+# Migrate a fresh database and add a whitelist request for each (message ID, user ID, username)
+def make_request_database(tmp_path, requests: list[tuple]) -> craftbot.Database:
+    database = craftbot.Database(str(tmp_path / 'data.db'))
+    database.migrate(craftbot.database_migrations)
+    database.connection.executemany("INSERT INTO whitelist_requests (message_id, channel_id, user_id, username, type, state, created, updated) VALUES (?, 1, ?, ?, 'java', 'registering', 0, 0);", requests)
+    database.connection.commit()
+    return database
+
+
+def test_concurrent_requests_for_one_username_register_once(tmp_path):
+    database = make_request_database(tmp_path, [(1, 10, 'Steve'), (2, 20, 'steve')])
+    cog = make_cog()
+    async def run():
+        return await asyncio.gather(*[database.run(cog._claim_whitelist_request, message_id, user_id, username, 'java') for message_id, user_id, username in [(1, 10, 'Steve'), (2, 20, 'steve')]])
+    try:
+        assert asyncio.run(run()) == [('registered', True), ('rejected', False)]
+        states = database.connection.execute('SELECT state FROM whitelist_requests ORDER BY message_id;').fetchall()
+        assert [row['state'] for row in states] == ['registered', 'rejected']
+    finally:
+        database.close()
+
+
+def test_member_with_two_requests_registers_once(tmp_path):
+    database = make_request_database(tmp_path, [(1, 10, 'Steve'), (2, 10, 'Alex')])
+    cog = make_cog()
+    async def run():
+        return await asyncio.gather(*[database.run(cog._claim_whitelist_request, message_id, 10, username, 'java') for message_id, username in [(1, 'Steve'), (2, 'Alex')]])
+    try:
+        assert asyncio.run(run()) == [('registered', True), ('rejected', False)]
+        assert database.connection.execute('SELECT COUNT(*) FROM mc_accounts;').fetchone()[0] == 1
+    finally:
+        database.close()
+
+
+def test_unique_username_migration_keeps_the_first_registration(tmp_path):
+    database = craftbot.Database(str(tmp_path / 'data.db'))
+    try:
+        database.migrate(craftbot.database_migrations[:-1])
+        database.connection.executemany('INSERT INTO mc_accounts (username, type, owner) VALUES (?, ?, ?);', [('Steve', 'java', 1), ('steve', 'java', 2), ('Steve', 'bedrock', 3)])
+        database.connection.commit()
+        database.migrate(craftbot.database_migrations)
+        rows = database.connection.execute('SELECT username, type, owner FROM mc_accounts ORDER BY rowid;').fetchall()
+        assert [tuple(row) for row in rows] == [('Steve', 'java', 1), ('Steve', 'bedrock', 3)]
+        with pytest.raises(sqlite3.IntegrityError):
+            database.connection.execute("INSERT INTO mc_accounts (username, type) VALUES ('STEVE', 'java');")
+    finally:
+        database.close()
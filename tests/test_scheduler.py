@@ -0,0 +1,87 @@
+# Python 3.10
+
+# Built-in Python libraries
+import asyncio, types
+# Testing
+import pytest
+
+# Main CraftBot module
+import craftbot
+
+
+def make_scheduler() -> craftbot.DiscordCallScheduler:
+    return craftbot.DiscordCallScheduler(types.SimpleNamespace(metrics=craftbot.Metrics()))
+
+
+def test_cancelled_workflow_is_never_started():
+    calls = []
+    async def workflow():
+        calls.append(True)
+    async def run():
+        scheduler = make_scheduler()
+        scheduler.channel_concurrency = 1
+        blocker = asyncio.Event()
+        first = asyncio.create_task(scheduler.run(1, blocker.wait))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(scheduler.run(1, workflow))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        blocker.set()
+        await first
+        await asyncio.gather(waiting, return_exceptions=True)
+    asyncio.run(run())
+    assert calls == []
+
+
+# Replace backoff sleeps with a plain yield to the event loop
+def make_instant_sleep():
+    sleep = asyncio.sleep
+    async def instant_sleep(delay, *args):
+        await sleep(0)
+    return instant_sleep
+
+
+# Fail a set number of times with a timeout, then succeed
+def make_flaky_call(failures: int):
+    calls = []
+    async def call():
+        calls.append(True)
+        if len(calls) <= failures:
+            raise asyncio.TimeoutError()
+        return len(calls)
+    return call, calls
+
+
+def test_reactions_are_retried(monkeypatch):
+    monkeypatch.setattr(craftbot.DiscordCallScheduler, 'attempts', 2)
+    monkeypatch.setattr(asyncio, 'sleep', make_instant_sleep())
+    call, calls = make_flaky_call(1)
+    assert asyncio.run(make_scheduler().call('reaction', 1, call)) == 2
+    assert len(calls) == 2
+
+
+def test_messages_and_threads_are_not_retried(monkeypatch):
+    monkeypatch.setattr(asyncio, 'sleep', make_instant_sleep())
+    for route in ['message', 'thread']:
+        call, calls = make_flaky_call(1)
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(make_scheduler().call(route, 1, call))
+        assert len(calls) == 1
+
+
+def test_idle_buckets_and_semaphores_are_dropped(monkeypatch):
+    monkeypatch.setattr(craftbot.DiscordCallScheduler, 'prune_interval', 0.0)
+    monkeypatch.setitem(craftbot.DiscordCallScheduler.route_limits, 'message', (5, 0.05))
+    async def send():
+        pass
+    async def run():
+        scheduler = make_scheduler()
+        # A greeting in each new thread, then one more call after they have all gone idle
+        for thread_id in range(100):
+            await scheduler.run(thread_id, scheduler.call, 'message', thread_id, send)
+        await asyncio.sleep(0.1)
+        await scheduler.call('message', 1000, send)
+        return scheduler
+    scheduler = asyncio.run(run())
+    assert list(scheduler.buckets) == [('message', 1000)]
+    assert scheduler.semaphores == {} and scheduler.workflow_counts == {}